@@ -0,0 +1,87 @@
+import logging
+
+import cv2
+import numpy as np
+
+from ai_models.inference_server import InferenceServer
+
+logger = logging.getLogger(__name__)
+
+
+def load_keras_model(model_path):
+    """Return a loader that builds a batched callable for a Keras/SavedModel file."""
+    def _load():
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path, compile=False)
+        return lambda batch: model(batch, training=False)
+    return _load
+
+
+def preprocess_image(image, input_size):
+    """BGR uint8 array -> normalised RGB float32 tensor of shape (input_size, input_size, 3)."""
+    image = cv2.resize(image, (input_size, input_size), interpolation=cv2.INTER_AREA)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image.astype(np.float32) / 255.0
+
+
+class BatchedImageAnalyzer:
+    """Drop-in alternative to ImageAnalyzer that serves predictions through an InferenceServer.
+
+    Requests from many Flask threads are coalesced into batched forward passes
+    on a single thread that owns the TensorFlow model.
+    """
+
+    def __init__(self, model_path, labels, input_size=224, max_batch_size=16, max_wait_ms=5,
+                 intra_op_threads=0, inter_op_threads=0, timeout=30, load_model=None, name='image_analyzer'):
+        self.model_path = model_path
+        self.labels = labels
+        self.input_size = input_size
+        self.timeout = timeout
+        self.server = InferenceServer(
+            name,
+            load_model or load_keras_model(model_path),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads
+        )
+
+    def preprocess(self, image):
+        return preprocess_image(image, self.input_size)
+
+    def analyze_image_array(self, image):
+        """Analyze a decoded BGR image array."""
+        scores = self.server.predict(self.preprocess(image), timeout=self.timeout)
+        return self.format_result(scores)
+
+    def analyze_image(self, image_path):
+        """Analyze an image on disk; kept for callers of the ImageAnalyzer interface."""
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            logger.error(f"Could not read image at {image_path}")
+            return None
+        return self.analyze_image_array(image)
+
+    def format_result(self, scores):
+        scores = np.asarray(scores, dtype=np.float32).ravel()
+        if scores.size == 1:
+            # Single sigmoid output: labels[0] is the negative class, labels[1] the positive one
+            positive = float(scores[0])
+            scores = np.array([1.0 - positive, positive], dtype=np.float32)
+
+        top = np.argsort(scores)[::-1][:3]
+        predictions = [
+            {'label': self._label(i), 'confidence': round(float(scores[i]) * 100, 2)}
+            for i in top
+        ]
+        return {
+            'condition': predictions[0]['label'],
+            'confidence': predictions[0]['confidence'],
+            'predictions': predictions
+        }
+
+    def stats(self):
+        return self.server.stats()
+
+    def _label(self, index):
+        return self.labels[index] if index < len(self.labels) else f"class_{index}"
@@ -0,0 +1,50 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+SYMPTOM_STREAM_INSTRUCTIONS = (
+    "You are a clinical decision-support assistant. Given the patient's symptoms, duration, severity, "
+    "history and vital signs, explain in a few short plain-text sentences which conditions you are "
+    "considering and why. Do not output JSON or a final diagnosis; advise seeing a doctor."
+)
+
+
+class GeminiSymptomStreamer:
+    """Streams a Gemini symptom analysis as it is generated.
+
+    stream_disease_from_symptoms() yields text chunks that stream_symptom_events()
+    forwards as a preview while the disease predictor computes the actual
+    result. It uses generate_content(stream=True), so the first chunk arrives
+    after the model's first tokens rather than after the whole answer.
+    """
+
+    def __init__(self, api_key, model_name='gemini-pro', temperature=0.2):
+        if genai is None:
+            raise RuntimeError("google-generativeai is not installed; streaming symptom analysis is unavailable.")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY is not set; streaming symptom analysis is unavailable.")
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.generation_config = {'temperature': temperature}
+
+    def stream_disease_from_symptoms(self, input_text):
+        response = self.model.generate_content(
+            f"{SYMPTOM_STREAM_INSTRUCTIONS}\n\n{input_text}",
+            generation_config=self.generation_config,
+            stream=True
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # A chunk blocked by safety filters has no text part
+                logger.warning(f"Gemini returned a chunk without text: {getattr(chunk, 'prompt_feedback', None)}")
+                continue
+            if text:
+                yield text
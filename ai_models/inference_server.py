@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceServer:
+    """Dynamic-batching inference loop around a single model.
+
+    One dedicated thread owns the model. Callers submit single inputs and get a
+    Future back; the thread waits up to max_wait_ms after the first queued
+    request to gather up to max_batch_size inputs, runs one batched forward
+    pass and resolves every Future with its row of the output.
+    """
+
+    def __init__(self, name, load_model, max_batch_size=16, max_wait_ms=5,
+                 intra_op_threads=0, inter_op_threads=0, latency_window=1000):
+        self.name = name
+        self.load_model = load_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._load_error = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._latencies = {
+            'queue_wait_ms': deque(maxlen=latency_window),
+            'inference_ms': deque(maxlen=latency_window),
+            'total_ms': deque(maxlen=latency_window),
+        }
+        self._requests_served = 0
+
+    def start(self):
+        """Start the inference thread (idempotent) and wait for the model to load.
+
+        Raises RuntimeError if the model failed to load or the thread has died,
+        so callers fail fast instead of queueing work nobody will serve.
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"inference-{self.name}", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+        if self._load_error:
+            raise RuntimeError(f"Inference server '{self.name}' failed to load its model: {self._load_error}")
+        if not self._thread.is_alive():
+            raise RuntimeError(f"Inference server '{self.name}' is not running.")
+
+    def submit(self, model_input):
+        """Queue one input (without a batch dimension) and return a Future for its output."""
+        self.start()
+        future = Future()
+        self._queue.put((model_input, future, time.perf_counter()))
+        return future
+
+    def predict(self, model_input, timeout=None):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(model_input).result(timeout=timeout)
+
+    def stats(self):
+        """Queue depth, batch size histogram and per-stage latency percentiles."""
+        with self._stats_lock:
+            latencies = {stage: self._summarize(list(samples)) for stage, samples in self._latencies.items()}
+            return {
+                'model': self.name,
+                'queue_depth': self._queue.qsize(),
+                'requests_served': self._requests_served,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'latency': latencies,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
+
+    # ---------- inference thread ----------
+
+    def _configure_threading(self):
+        if not (self.intra_op_threads or self.inter_op_threads):
+            return
+        try:
+            import tensorflow as tf
+            if self.intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+            if self.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError as e:
+            # TF only accepts this before its runtime has been initialised
+            logger.warning(f"Could not set TensorFlow thread counts for '{self.name}': {e}")
+        except ImportError:
+            pass
+
+    def _run(self):
+        try:
+            self._configure_threading()
+            model = self.load_model()
+            logger.info(f"Inference server '{self.name}' loaded its model.")
+        except Exception as e:
+            logger.error(f"Inference server '{self.name}' failed to load model: {e}", exc_info=True)
+            self._load_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        try:
+            self._serve(model)
+        finally:
+            # Only reached if the loop itself crashed; fail whatever is still queued
+            error = RuntimeError(f"Inference server '{self.name}' stopped.")
+            while True:
+                try:
+                    _, future, _ = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if not future.done():
+                    future.set_exception(error)
+
+    def _serve(self, model):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(model, batch)
+
+    def _run_batch(self, model, batch):
+        started = time.perf_counter()
+        try:
+            inputs = np.stack([item[0] for item in batch])
+            outputs = model(inputs)
+            outputs = outputs.numpy() if hasattr(outputs, 'numpy') else np.asarray(outputs)
+        except Exception as e:
+            logger.error(f"Batched inference failed on '{self.name}': {e}", exc_info=True)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        for i, (_, future, _) in enumerate(batch):
+            future.set_result(outputs[i])
+
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._requests_served += len(batch)
+            inference_ms = (finished - started) * 1000.0
+            for _, _, enqueued in batch:
+                self._latencies['queue_wait_ms'].append((started - enqueued) * 1000.0)
+                self._latencies['inference_ms'].append(inference_ms)
+                self._latencies['total_ms'].append((finished - enqueued) * 1000.0)
+
+    @staticmethod
+    def _summarize(samples):
+        if not samples:
+            return {'count': 0}
+        values = np.asarray(samples)
+        return {
+            'count': int(values.size),
+            'mean': round(float(values.mean()), 3),
+            'p50': round(float(np.percentile(values, 50)), 3),
+            'p95': round(float(np.percentile(values, 95)), 3),
+            'p99': round(float(np.percentile(values, 99)), 3),
+        }
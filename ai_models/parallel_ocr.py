@@ -0,0 +1,208 @@
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pytesseract
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def _ocr_page(file_path, page_number, dpi, lang, tesseract_config, page_timeout, deadline=None):
+    """Rasterize and recognize one page. Runs inside a pool worker process.
+
+    deadline is the document's wall-clock deadline (time.time()). Pages that
+    start after it return at once, and the pdftoppm and Tesseract
+    subprocesses are given only the time that is left, so a timed-out
+    document stops holding pool workers shortly after its deadline.
+    """
+    def time_left():
+        if deadline is None:
+            return page_timeout or None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError(f"Document deadline passed before page {page_number} finished.")
+        return min(page_timeout, remaining) if page_timeout else remaining
+
+    started = time.perf_counter()
+    if file_path.lower().endswith('.pdf'):
+        from pdf2image import convert_from_path
+        image = convert_from_path(file_path, dpi=dpi, first_page=page_number, last_page=page_number, timeout=time_left())[0]
+    else:
+        time_left()
+        image = Image.open(file_path)
+        image.load()
+    rasterized = time.perf_counter()
+
+    text = pytesseract.image_to_string(image, lang=lang, config=tesseract_config, timeout=time_left() or 0)
+    finished = time.perf_counter()
+    return {
+        'page': page_number,
+        'text': text,
+        'rasterize_ms': round((rasterized - started) * 1000.0, 1),
+        'ocr_ms': round((finished - rasterized) * 1000.0, 1),
+    }
+
+
+APP_SCRIPTS = ('app.py', 'run.py')
+
+
+def launched_from_app_script():
+    """Path of the launching script when it is one that imports the whole app, else None.
+
+    forkserver and spawn workers re-import the __main__ script, so under
+    `python run.py` every pool worker would rebuild the app.
+    """
+    main_path = getattr(sys.modules.get('__main__'), '__file__', None)
+    if main_path and os.path.basename(main_path) in APP_SCRIPTS:
+        return main_path
+    return None
+
+
+def _pool_context():
+    """Start pool workers fresh rather than forking the web server with its threads and locks."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class ParallelOCRProcessor:
+    """Page-parallel OCR over a bounded process pool.
+
+    Every page of a PDF is rasterized and recognized in its own task, so a
+    30-page document uses all pool workers instead of one request thread.
+    Output is always reassembled in page order.
+
+    Workers are started with forkserver (spawn where that is unavailable),
+    never by forking the multi-threaded server process. Like any spawned
+    worker they import the launching script, so this engine is only used
+    under a WSGI server or `flask run`, whose scripts are cheap to import.
+    app.py falls back to OCRProcessor when it was started as `python
+    run.py` or `python app.py` (see launched_from_app_script()).
+    """
+
+    def __init__(self, max_workers=None, max_pages=50, document_timeout=120, page_timeout=60,
+                 dpi=300, lang='eng', tesseract_config=''):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pages = max_pages
+        self.document_timeout = document_timeout
+        self.page_timeout = page_timeout
+        self.dpi = dpi
+        self.lang = lang
+        self.tesseract_config = tesseract_config
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._engine_version = None
+
+    @property
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+            return self._executor
+
+    @property
+    def engine_version(self):
+        """Everything that changes OCR output; used to key cached results."""
+        if self._engine_version is None:
+            try:
+                tesseract_version = str(pytesseract.get_tesseract_version())
+            except Exception:
+                tesseract_version = 'unknown'
+            self._engine_version = f"tesseract-{tesseract_version}|lang={self.lang}|dpi={self.dpi}|config={self.tesseract_config}"
+        return self._engine_version
+
+    def count_pages(self, file_path):
+        if file_path.lower().endswith('.pdf'):
+            from pdf2image import pdfinfo_from_path
+            return int(pdfinfo_from_path(file_path)['Pages'])
+        return 1
+
+    def iter_pages(self, file_path):
+        """Yield page results as they finish (not in page order), then a summary dict.
+
+        The summary (always the last item, with 'summary': True) carries
+        page_count, pages_processed, truncated, timed_out and elapsed_ms.
+        """
+        started = time.perf_counter()
+        page_count = self.count_pages(file_path)
+        pages_to_run = min(page_count, self.max_pages) if self.max_pages else page_count
+
+        # Wall clock, because workers in other processes compare against it
+        wall_deadline = time.time() + self.document_timeout if self.document_timeout else None
+        futures = {
+            self.executor.submit(_ocr_page, file_path, page, self.dpi, self.lang, self.tesseract_config,
+                                 self.page_timeout, wall_deadline): page
+            for page in range(1, pages_to_run + 1)
+        }
+        deadline = started + self.document_timeout if self.document_timeout else None
+        processed = 0
+        failed = []
+        timed_out = False
+
+        pending = set(futures)
+        try:
+            while pending:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    timed_out = True
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"OCR failed on page {futures[future]} of {file_path}: {e}")
+                        failed.append(futures[future])
+                        continue
+                    processed += 1
+                    yield result
+        finally:
+            # Also runs if the consumer stops iterating early (e.g. a client disconnects).
+            # Queued pages are cancelled; pages already running stop at the document deadline.
+            for future in pending:
+                future.cancel()
+
+        if timed_out:
+            logger.warning(f"OCR of {file_path} hit the {self.document_timeout}s document timeout with {len(pending)} pages outstanding.")
+
+        yield {
+            'summary': True,
+            'page_count': page_count,
+            'pages_processed': processed,
+            'failed_pages': sorted(failed),
+            'truncated': pages_to_run < page_count,
+            'timed_out': timed_out,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 1),
+        }
+
+    def process_document_pages(self, file_path):
+        """Run OCR on every page and return (pages in page order, summary)."""
+        pages = []
+        summary = None
+        for item in self.iter_pages(file_path):
+            if item.get('summary'):
+                summary = item
+            else:
+                pages.append(item)
+        pages.sort(key=lambda p: p['page'])
+        return pages, summary
+
+    def process_document(self, file_path):
+        """Same contract as OCRProcessor.process_document: the document's text."""
+        pages, _ = self.process_document_pages(file_path)
+        return self.join_pages(pages)
+
+    @staticmethod
+    def join_pages(pages):
+        return '\n\n'.join(page['text'].strip() for page in pages).strip()
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,161 @@
+"""
+Quantized (TFLite) export and CPU inference for the image models.
+
+Export a float32 Keras model to an int8 or float16 TFLite file:
+
+    python -m ai_models.quantization --model models/image_model.h5 \
+        --output models/image_model_int8.tflite --mode int8 --calibration-dir data/calibration
+
+Then set IMAGE_INFERENCE_ENGINE=tflite and IMAGE_TFLITE_MODEL_PATH to serve it
+through the same analyze_image interface.
+"""
+
+import argparse
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from ai_models.batched_image_analyzer import preprocess_image
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('int8', 'float16')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(directory, limit=None):
+    """Sorted image paths under directory (recursive), so runs are reproducible."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def load_preprocessed_images(paths, input_size):
+    images = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning(f"Skipping unreadable image {path}")
+            continue
+        images.append(preprocess_image(image, input_size))
+    return images
+
+
+def export_quantized_model(model_path, output_path, mode='int8', calibration_images=None):
+    """Convert a Keras model to a quantized TFLite flatbuffer and write it to output_path.
+
+    int8 uses full-integer quantization and needs calibration_images
+    (preprocessed float32 arrays) as a representative dataset. float16
+    halves the weight size and needs no calibration.
+    """
+    import tensorflow as tf
+
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unsupported quantization mode '{mode}'. Choose one of {QUANTIZATION_MODES}.")
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        if not calibration_images:
+            raise ValueError('int8 quantization requires calibration images.')
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [np.expand_dims(image, 0).astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    logger.info(f"Wrote {mode} model to {output_path} ({len(tflite_model) / 1024:.1f} KiB).")
+    return output_path
+
+
+class TFLiteModel:
+    """Batched callable over a TFLite interpreter, (de)quantizing int8 inputs and outputs."""
+
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads or None)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail['shape'][0])
+        # The interpreter is stateful; callers outside the InferenceServer thread must not interleave
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            batch = np.asarray(batch, dtype=np.float32)
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input_detail['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self.input_detail = self.interpreter.get_input_details()[0]
+                self.output_detail = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+
+            self.interpreter.set_tensor(self.input_detail['index'], self._quantize(batch, self.input_detail))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self.output_detail['index']), self.output_detail)
+
+    @staticmethod
+    def _quantize(values, detail):
+        dtype = detail['dtype']
+        if dtype in (np.int8, np.uint8):
+            scale, zero_point = detail['quantization']
+            info = np.iinfo(dtype)
+            values = np.clip(np.round(values / scale + zero_point), info.min, info.max)
+        return values.astype(dtype)
+
+    @staticmethod
+    def _dequantize(values, detail):
+        if detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = detail['quantization']
+            return (values.astype(np.float32) - zero_point) * scale
+        return values.astype(np.float32)
+
+
+def load_tflite_model(model_path, num_threads=None):
+    """Loader for InferenceServer/BatchedImageAnalyzer that serves a quantized TFLite model."""
+    def _load():
+        return TFLiteModel(model_path, num_threads=num_threads)
+    return _load
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a quantized TFLite version of an image model.')
+    parser.add_argument('--model', required=True, help='Path to the float32 Keras model')
+    parser.add_argument('--output', required=True, help='Where to write the .tflite file')
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES, default='int8')
+    parser.add_argument('--calibration-dir', help='Directory of representative images (required for int8)')
+    parser.add_argument('--calibration-limit', type=int, default=200)
+    parser.add_argument('--input-size', type=int, default=224)
+    args = parser.parse_args()
+
+    calibration_images = None
+    if args.calibration_dir:
+        paths = list_images(args.calibration_dir, args.calibration_limit)
+        calibration_images = load_preprocessed_images(paths, args.input_size)
+    export_quantized_model(args.model, args.output, args.mode, calibration_images)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import vosk
+    vosk.SetLogLevel(-1)
+except ImportError:
+    vosk = None
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_vosk_model(model_path):
+    """Load a Vosk model once per process; later calls return the same instance."""
+    if vosk is None:
+        raise RuntimeError("vosk is not installed; offline speech recognition is unavailable.")
+    with _models_lock:
+        model = _models.get(model_path)
+        if model is None:
+            logger.info(f"Loading offline speech model from {model_path}...")
+            model = vosk.Model(model_path)
+            _models[model_path] = model
+        return model
+
+
+class VoiceActivityDetector:
+    """Splits 16-bit mono PCM into fixed frames and keeps only those containing speech.
+
+    Uses WebRTC VAD when available, otherwise an RMS energy gate. A few
+    frames of hangover are kept after speech stops so word endings are
+    not clipped. speech_ended is set on the frame where an utterance ends,
+    which the transcriber uses as its endpoint.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=30, aggressiveness=2, energy_threshold=300, hangover_frames=10):
+        if frame_ms not in (10, 20, 30):
+            raise ValueError("frame_ms must be 10, 20 or 30")
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.energy_threshold = energy_threshold
+        self.hangover_frames = hangover_frames
+        self._vad = webrtcvad.Vad(aggressiveness) if webrtcvad is not None and sample_rate in (8000, 16000, 32000, 48000) else None
+        self._pending = b''
+        self._hangover = 0
+        self.in_speech = False
+        self.total_frames = 0
+        self.speech_frames = 0
+
+    def _is_speech(self, frame):
+        if self._vad is not None:
+            return self._vad.is_speech(frame, self.sample_rate)
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        return float(np.sqrt(np.mean(samples * samples))) >= self.energy_threshold
+
+    def process(self, pcm):
+        """Yield (speech_bytes, speech_ended) for each run of frames in pcm. Partial frames are buffered."""
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+
+        voiced = bytearray()
+        for offset in range(0, usable, self.frame_bytes):
+            frame = data[offset:offset + self.frame_bytes]
+            self.total_frames += 1
+            if self._is_speech(frame):
+                self.in_speech = True
+                self._hangover = self.hangover_frames
+            elif self.in_speech and self._hangover > 0:
+                self._hangover -= 1
+            elif self.in_speech:
+                self.in_speech = False
+                yield bytes(voiced), True
+                voiced = bytearray()
+                continue
+            else:
+                continue
+            self.speech_frames += 1
+            voiced += frame
+        if voiced:
+            yield bytes(voiced), False
+
+    @property
+    def frame_seconds(self):
+        return self.frame_bytes / 2 / self.sample_rate
+
+
+class StreamingTranscription:
+    """One utterance stream: feed PCM chunks as they arrive and collect partial/final transcript events."""
+
+    def __init__(self, model, sample_rate, vad):
+        self._recognizer = vosk.KaldiRecognizer(model, sample_rate)
+        self._vad = vad
+        self._segments = []
+        self._last_partial = ''
+
+    def feed(self, pcm):
+        """Process a chunk of 16-bit mono PCM. Returns a list of {'type': 'partial'|'final', 'text'} events."""
+        events = []
+        for speech, ended in self._vad.process(pcm):
+            if speech and self._recognizer.AcceptWaveform(speech):
+                self._add_final(json.loads(self._recognizer.Result()).get('text', ''), events)
+            elif speech:
+                partial = json.loads(self._recognizer.PartialResult()).get('partial', '')
+                if partial and partial != self._last_partial:
+                    self._last_partial = partial
+                    events.append({'type': 'partial', 'text': partial})
+            if ended:
+                # Silence was dropped by the VAD, so the recognizer never sees an endpoint on its own
+                self._add_final(json.loads(self._recognizer.FinalResult()).get('text', ''), events)
+        return events
+
+    def finish(self):
+        """Flush the recognizer and return the full transcript plus any last events."""
+        events = []
+        self._add_final(json.loads(self._recognizer.FinalResult()).get('text', ''), events)
+        return {
+            'text': ' '.join(self._segments),
+            'segments': list(self._segments),
+            'audio_seconds': round(self._vad.total_frames * self._vad.frame_seconds, 2),
+            'speech_seconds': round(self._vad.speech_frames * self._vad.frame_seconds, 2),
+            'events': events,
+        }
+
+    def _add_final(self, text, events):
+        self._last_partial = ''
+        if text:
+            self._segments.append(text)
+            events.append({'type': 'final', 'text': text})
+
+
+class OfflineSpeechRecognizer:
+    """Offline streaming speech-to-text (Vosk) with voice-activity detection.
+
+    The acoustic model is loaded once in the constructor and shared by all
+    streams; each stream gets its own lightweight recognizer and VAD state.
+    Audio is 16-bit little-endian mono PCM at sample_rate.
+    """
+
+    def __init__(self, model_path, sample_rate=16000, vad_aggressiveness=2, energy_threshold=300):
+        self.sample_rate = sample_rate
+        self.vad_aggressiveness = vad_aggressiveness
+        self.energy_threshold = energy_threshold
+        self.model = load_vosk_model(model_path)
+        if webrtcvad is None:
+            logger.warning("webrtcvad is not installed; falling back to an energy-based voice activity detector.")
+
+    def create_stream(self):
+        vad = VoiceActivityDetector(self.sample_rate, aggressiveness=self.vad_aggressiveness, energy_threshold=self.energy_threshold)
+        return StreamingTranscription(self.model, self.sample_rate, vad)
+
+    def transcribe_pcm(self, pcm, chunk_size=32000):
+        """Transcribe a complete buffer of PCM audio. Returns the transcript text."""
+        stream = self.create_stream()
+        for offset in range(0, len(pcm), chunk_size):
+            stream.feed(pcm[offset:offset + chunk_size])
+        return stream.finish()['text']
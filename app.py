@@ -1,8 +1,15 @@
 import logging
 import os
 import hashlib
+import hmac
+import inspect
 import uuid
 import tempfile
+import shutil
+import threading
+import time
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import speech_recognition as sr
 import joblib
 import numpy as np
@@ -10,8 +17,9 @@ import pandas as pd
 from datetime import datetime, timezone
 import pytz
 import json
+import requests
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
@@ -28,28 +36,181 @@ from database.supabase_client import SupabaseClient
 from ai_models.disease_predictor import DiseasePredictor
 from ai_models.image_analyzer import ImageAnalyzer
 from ai_models.ocr_processor import OCRProcessor
+from ai_models.batched_image_analyzer import BatchedImageAnalyzer
+from ai_models.quantization import load_tflite_model
+from ai_models.parallel_ocr import ParallelOCRProcessor, launched_from_app_script
+from ai_models.streaming_speech import OfflineSpeechRecognizer
+from ai_models.gemini_stream import GeminiSymptomStreamer
 from services.ipfs_service import IPFSService
 from services.emergency_service import EmergencyService
 from services.analytics_service import AnalyticsService
+from services.upload_service import ResumableUploadService, UploadError, MultipartFileBody
+from services.diagnosis_cache import ImageDiagnosisCache, perceptual_hash, content_hash
+from services.ocr_cache import OCRResultCache, file_sha256
+from services.search_index import MedicalRecordSearchIndex
+from services.tile_service import TilePyramidService
+from services.fleet_index import FleetSpatialIndex, parse_coordinates
+from services.vitals_store import VitalsStore, validate_vitals_batch
+from services.vitals_timeseries import VitalsTimeSeriesStore
+from services.vitals_rules import VitalsRuleEngine, load_rules
+from services.priority_lanes import PriorityLaneMiddleware
+from services.response_cache import CoalescingCache, normalize_text, symptom_cache_key
+from services.idempotency_store import IdempotencyStore
+from services.event_hub import AlertFeed, EventHub, StreamTickets, UrgentCasesWatcher
+from services.analytics_rollups import AnalyticsRollups
+from services.doctor_metrics import DoctorMetricsEngine
+from services.risk_scoring import RiskModels, RiskScoreStore, RiskScoringJob
+from services.appointment_index import AppointmentIndex
 from backend.anemia_detection import AnemiaDetector
+from backend.anemia_batch import BatchAnemiaDetector
 from utils.validators import validate_patient_data, validate_medical_record
 from utils.encryption import encrypt_sensitive_data, decrypt_sensitive_data
+from utils.image_utils import decode_image_bytes
+from utils.sse import SSE_HEADERS, format_sse, format_sse_comment
+from utils.metrics import LatencyMetrics
 
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000", "http://192.168.0.108:5000"], "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"]}})
+CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000", "http://192.168.0.108:5000"], "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key", "Last-Event-ID"]}})
 
 # Initialize services
 db = SupabaseClient()
 disease_predictor = DiseasePredictor()
-image_analyzer = ImageAnalyzer()
-ocr_processor = OCRProcessor()
+if app.config['IMAGE_INFERENCE_ENGINE'] in ('batched', 'tflite'):
+    # Both engines share the batching server; 'tflite' swaps in the quantized model
+    image_model_path = app.config['IMAGE_TFLITE_MODEL_PATH'] if app.config['IMAGE_INFERENCE_ENGINE'] == 'tflite' else app.config['IMAGE_MODEL_PATH']
+    image_analyzer = BatchedImageAnalyzer(
+        image_model_path,
+        app.config['IMAGE_MODEL_LABELS'],
+        input_size=app.config['IMAGE_MODEL_INPUT_SIZE'],
+        max_batch_size=app.config['IMAGE_BATCH_MAX_SIZE'],
+        max_wait_ms=app.config['IMAGE_BATCH_MAX_WAIT_MS'],
+        intra_op_threads=app.config['TF_INTRA_OP_THREADS'],
+        inter_op_threads=app.config['TF_INTER_OP_THREADS'],
+        timeout=app.config['IMAGE_INFERENCE_TIMEOUT'],
+        load_model=load_tflite_model(image_model_path, app.config['TF_INTRA_OP_THREADS']) if app.config['IMAGE_INFERENCE_ENGINE'] == 'tflite' else None
+    )
+else:
+    image_analyzer = ImageAnalyzer()
+# OCR pool workers re-import the launching script. Started as `python run.py` or `python app.py`,
+# that is this whole module (models, database client, background threads) once per worker
+ocr_engine = app.config['OCR_ENGINE']
+app_script = launched_from_app_script()
+if ocr_engine == 'parallel' and app_script:
+    logger.warning(f"OCR_ENGINE=parallel needs a WSGI server or `flask run`; pool workers would re-import {app_script}. "
+                   "Using the single-process OCR engine.")
+    ocr_engine = 'default'
+if ocr_engine == 'parallel':
+    ocr_processor = ParallelOCRProcessor(
+        max_workers=app.config['OCR_MAX_WORKERS'],
+        max_pages=app.config['OCR_MAX_PAGES'],
+        document_timeout=app.config['OCR_DOCUMENT_TIMEOUT'],
+        page_timeout=app.config['OCR_PAGE_TIMEOUT'],
+        dpi=app.config['OCR_DPI'],
+        lang=app.config['OCR_LANG']
+    )
+else:
+    ocr_processor = OCRProcessor()
 ipfs_service = IPFSService(app.config['PINATA_API_KEY'], app.config['PINATA_SECRET_KEY'], app.config['PINATA_GATEWAY_URL'])
 emergency_service = EmergencyService()
 analytics_service = AnalyticsService()
 anemia_detector = AnemiaDetector()
+batch_anemia_detector = BatchAnemiaDetector(feature_model_path=app.config['ANEMIA_FEATURE_MODEL_PATH'])
+diagnosis_cache = ImageDiagnosisCache(app.config['IMAGE_CACHE_MAX_ENTRIES'], app.config['IMAGE_CACHE_HAMMING_THRESHOLD'],
+                                      [t.strip() for t in app.config['IMAGE_CACHE_EXACT_TYPES'].split(',') if t.strip()])
+ocr_cache = OCRResultCache(app.config['OCR_CACHE_PATH'], app.config['OCR_CACHE_MAX_BYTES'])
+search_index = MedicalRecordSearchIndex(app.config['SEARCH_INDEX_DIR'], compact_after=app.config['SEARCH_INDEX_COMPACT_AFTER'])
+tile_service = TilePyramidService(app.config['TILE_CACHE_DIR'], tile_size=app.config['TILE_SIZE'], max_workers=app.config['TILE_WORKERS'],
+                                  max_queued=app.config['TILE_MAX_QUEUED'], max_cache_bytes=app.config['TILE_CACHE_MAX_MB'] * 1024 * 1024)
+symptom_cache = CoalescingCache(app.config['SYMPTOM_CACHE_MAX_ENTRIES'], app.config['SYMPTOM_CACHE_TTL'])
+symptom_stream_executor = ThreadPoolExecutor(max_workers=app.config['SYMPTOM_STREAM_WORKERS'], thread_name_prefix='symptom-stream')
+latency_metrics = LatencyMetrics()
+vitals_store = VitalsStore(app.config['VITALS_DB_PATH'])
+vitals_series = VitalsTimeSeriesStore(app.config['VITALS_SERIES_DIR'], segment_capacity=app.config['VITALS_SEGMENT_CAPACITY'])
+vitals_rules = VitalsRuleEngine(load_rules(app.config['VITALS_RULES_PATH']), cooldown_ms=app.config['VITALS_ALERT_COOLDOWN_MS'])
+vitals_ingest_lock = threading.Lock()
+idempotency_store = IdempotencyStore(
+    app.config['IDEMPOTENCY_DB_PATH'], ttl=app.config['IDEMPOTENCY_KEY_TTL'],
+    max_keys=app.config['IDEMPOTENCY_MAX_KEYS'], lease=app.config['IDEMPOTENCY_LEASE_SECONDS']
+)
+fleet_index = FleetSpatialIndex(app.config['FLEET_GRID_CELL_DEG'], max_search_km=app.config['FLEET_MAX_SEARCH_KM'],
+                                basic_types=app.config['FLEET_BASIC_EMERGENCY_TYPES'])
+event_hub = EventHub(replay_size=app.config['EVENT_REPLAY_BUFFER'], max_queue=app.config['EVENT_SUBSCRIBER_QUEUE'])
+event_stream_tickets = StreamTickets(app.config['EVENT_TICKETS_DB_PATH'], ttl=app.config['EVENT_TICKET_TTL'])
+urgent_cases_watcher = UrgentCasesWatcher(
+    event_hub, lambda doctor_id: db.get_urgent_cases_for_doctor(doctor_id), interval=app.config['URGENT_CASES_REFRESH_SECONDS']
+)
+# Alerts are stored in the shared vitals database; every worker publishes them to its own subscribers
+alert_feed = AlertFeed(
+    event_hub, vitals_store.last_alert_cursor, vitals_store.alerts_after, interval=app.config['ALERT_FEED_POLL_SECONDS'],
+    on_alerts=lambda alerts: urgent_cases_watcher.invalidate() if any(a['severity'] == 'critical' for a in alerts) else None
+)
+doctor_metrics = DoctorMetricsEngine(
+    app.config['DOCTOR_METRICS_SNAPSHOT_PATH'],
+    retention_days=app.config['DOCTOR_METRICS_RETENTION_DAYS'],
+    snapshot_interval=app.config['DOCTOR_METRICS_SNAPSHOT_SECONDS'],
+    loader=lambda: (db.get_all_consultations(), db.get_all_medical_records()),
+    reconcile_interval=app.config['DOCTOR_METRICS_RECONCILE_SECONDS']
+)
+appointment_index = AppointmentIndex(
+    lambda doctor_id: db.get_doctor_appointments(doctor_id),
+    default_minutes=app.config['APPOINTMENT_DEFAULT_MINUTES'], max_age=app.config['APPOINTMENT_INDEX_MAX_AGE'],
+    lock_dir=app.config['APPOINTMENT_LOCK_DIR']
+)
+analytics_rollups = AnalyticsRollups(
+    lambda: (db.get_all_users(), db.get_all_consultations(), db.get_all_medical_records()),
+    interval=app.config['ANALYTICS_RECONCILE_SECONDS'], days=app.config['ANALYTICS_ROLLUP_DAYS'],
+    # Responses keep analytics_service's schema; the rollups only keep its counts current between reconciles
+    template_loaders={
+        'dashboard': lambda: analytics_service.get_overall_dashboard_data(),
+        'consultations': lambda: analytics_service.get_consultation_metrics(),
+    }
+)
+# AI, streaming and event-feed traffic is capped below the server's thread count, so emergency requests always find a free thread
+priority_lanes = PriorityLaneMiddleware(
+    app.wsgi_app,
+    priority_prefixes=('/api/emergency/',),
+    heavy_prefixes=app.config['HEAVY_REQUEST_PREFIXES'],
+    stream_prefixes=app.config['STREAM_REQUEST_PREFIXES'],
+    event_paths=('/api/doctor/events',),
+    server_threads=app.config['SERVER_THREADS'],
+    reserved_threads=app.config['EMERGENCY_RESERVED_THREADS'],
+    heavy_max_concurrent=app.config['HEAVY_MAX_CONCURRENT'],
+    heavy_max_queued=app.config['HEAVY_MAX_QUEUED'],
+    heavy_queue_timeout=app.config['HEAVY_QUEUE_TIMEOUT'],
+    stream_max_concurrent=app.config['STREAM_MAX_CONCURRENT'],
+    event_max_connections=app.config['EVENT_MAX_CONNECTIONS'],
+    priority_slo_ms=app.config['EMERGENCY_LATENCY_SLO_MS'],
+    metrics=latency_metrics
+)
+app.wsgi_app = priority_lanes
+upload_service = ResumableUploadService(
+    app.config['RESUMABLE_UPLOAD_FOLDER'],
+    chunk_size=app.config['RESUMABLE_UPLOAD_CHUNK_SIZE'],
+    max_file_size=app.config['RESUMABLE_UPLOAD_MAX_SIZE'],
+    session_ttl=app.config['RESUMABLE_UPLOAD_SESSION_TTL']
+)
+# Streams a text preview of symptom analyses when the predictor cannot stream itself (opt-in)
+symptom_streamer = disease_predictor if hasattr(disease_predictor, 'stream_disease_from_symptoms') else None
+if symptom_streamer is None and app.config['SYMPTOM_STREAM_ENGINE'] == 'gemini':
+    try:
+        symptom_streamer = GeminiSymptomStreamer(app.config['GEMINI_API_KEY'], app.config['GEMINI_SYMPTOM_MODEL'])
+    except Exception as e:
+        logger.warning(f"Gemini symptom streaming unavailable, streamed analyses arrive in one piece: {e}")
+speech_recognizer = None
+if app.config['SPEECH_RECOGNIZER'] == 'offline':
+    try:
+        # Loaded once per process and shared by every voice request
+        speech_recognizer = OfflineSpeechRecognizer(
+            app.config['SPEECH_MODEL_PATH'],
+            sample_rate=app.config['SPEECH_SAMPLE_RATE'],
+            vad_aggressiveness=app.config['SPEECH_VAD_AGGRESSIVENESS'],
+            energy_threshold=app.config['SPEECH_ENERGY_THRESHOLD']
+        )
+    except Exception as e:
+        logger.error(f"Error loading offline speech recognizer, falling back to Google: {e}")
 
 # Define the Pinata Gateway URL for direct access to content
 # PINATA_GATEWAY_URL = app.config['PINATA_GATEWAY_URL'] # Get from Config
@@ -97,12 +258,91 @@ except Exception as e:
     kidney_model = None
     kidney_scaler = None
 
+# Nightly risk scoring over every patient's latest model inputs, feeding the doctor AI insights
+risk_store = RiskScoreStore(app.config['RISK_SCORES_DB_PATH'])
+risk_scoring_job = RiskScoringJob(
+    risk_store,
+    RiskModels(
+        heart_disease_model, heart_scaler, cancer_model, cancer_scaler,
+        diabetes_model, diabetes_scaler, diabetes_class_encoder, diabetes_gender_encoder,
+        kidney_model, kidney_scaler
+    ),
+    lambda: [(c['doctor_id'], c['patient_id']) for c in db.get_all_consultations() if c.get('doctor_id') and c.get('patient_id')],
+    chunk_size=app.config['RISK_SCORING_CHUNK_SIZE'],
+    lease_seconds=app.config['RISK_SCORING_LEASE_SECONDS']
+)
+risk_scoring_job.schedule_nightly(app.config['RISK_SCORING_HOUR_UTC'])
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'dcm'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def idempotent(view):
+    """Honour an Idempotency-Key header: the first request runs, duplicates get its stored response.
+
+    Keys are scoped to the caller's Authorization header and the route, and
+    tied to a hash of the request body, so reusing a key for a different
+    payload is rejected with 422. Anonymous callers (the emergency routes)
+    are scoped by the body's patient_id and their address instead. Keys and
+    responses live in idempotency_store (SQLite), so a retry that lands on
+    another worker process is still recognized. A duplicate that arrives
+    while the first request is still running waits only briefly, then gets
+    409 with Retry-After rather than holding a worker thread. 5xx responses
+    are not stored, so a retry can succeed.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if request.method == 'OPTIONS' or not idempotency_key:
+            return view(*args, **kwargs)
+        if len(idempotency_key) > 255:
+            return jsonify({'error': 'Idempotency-Key must be at most 255 characters.'}), 400
+
+        # cache=True keeps the body available for request.form / request.files afterwards
+        fingerprint = hashlib.sha256(request.get_data(cache=True)).hexdigest()
+        client = request.headers.get('Authorization', '')
+        if not client:
+            payload = request.get_json(silent=True)
+            patient_id = payload.get('patient_id') if isinstance(payload, dict) else None
+            client = f"anonymous:{patient_id or ''}:{request.remote_addr or ''}"
+        scope = hashlib.sha256('\n'.join([
+            client, request.method, request.path, idempotency_key
+        ]).encode('utf-8')).hexdigest()
+
+        state, stored = idempotency_store.begin(scope, fingerprint)
+        if stored['fingerprint'] != fingerprint:
+            return jsonify({'error': 'Idempotency-Key was already used with a different request body.'}), 422
+        if state == IdempotencyStore.PENDING:
+            state, stored = idempotency_store.wait(scope, app.config['IDEMPOTENCY_WAIT_TIMEOUT'])
+        if state in (None, IdempotencyStore.PENDING):
+            response = jsonify({'error': 'A request with this Idempotency-Key is still being processed; retry shortly.'})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+        if state == IdempotencyStore.STORED:
+            response = Response(stored['body'], status=stored['status'], headers=stored['headers'])
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        owner = stored['owner']
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.abandon(scope, owner)
+            raise
+        try:
+            if response.status_code < 500:
+                headers = [(k, v) for k, v in response.headers if k.lower() != 'content-length']
+                idempotency_store.finish(scope, owner, response.status_code, headers, response.get_data())
+            else:
+                idempotency_store.abandon(scope, owner)
+        except Exception as e:
+            # The write already happened; a failure to record it must not turn into an error response
+            logger.warning(f"Could not store idempotent response: {e}")
+        return response
+    return wrapper
+
 # ==================== AUTHENTICATION ROUTES ====================
 
 # Helper function to generate a consistent dummy email and password from wallet address
@@ -147,6 +387,7 @@ def wallet_login():
             if not created_user:
                 logger.error(f"Failed to create user in public.users table for wallet {wallet_address}.")
                 return jsonify({'error': 'Failed to create user record.'}), 500
+            track_write(analytics_rollups, 'user_created', created_user)
             user_in_db = created_user
             user_id_to_use = new_user_id
             logger.info(f"New user created in public.users for wallet {wallet_address} with ID {new_user_id}.")
@@ -211,6 +452,8 @@ def register_user():
         }
         
         user = db.create_user(user_data)
+        if user:
+            track_write(analytics_rollups, 'user_created', user)
         
         return jsonify({
             'success': True,
@@ -224,9 +467,16 @@ def register_user():
 
 # ==================== AI DIAGNOSIS ROUTES ====================
 
+def build_symptom_prompt(symptoms, duration, severity, medical_history, vital_signs):
+    """Predictor input for a symptom analysis request. Whitespace is folded and history sorted so equal requests build equal prompts."""
+    history = sorted({' '.join(str(item).split()) for item in (medical_history or []) if normalize_text(item)}, key=normalize_text)
+    vital_signs = vital_signs or {}
+    return f"Symptoms: {' '.join(str(symptoms).split())}. Duration: {' '.join(str(duration).split())}. Severity: {severity}/10. Medical History: {', '.join(history)}. Vital Signs: Heart Rate: {vital_signs.get('heart_rate', 'N/A')}, BP: {vital_signs.get('blood_pressure_systolic', 'N/A')}/{vital_signs.get('blood_pressure_diastolic', 'N/A')}, Temp: {vital_signs.get('temperature', 'N/A')}."
+
 @app.route('/api/ai/symptom-analysis', methods=['POST'])
 def analyze_symptoms():
-    """Analyze symptoms using AI models"""
+    """Analyze symptoms using AI models. With ?stream=1, partial output is pushed as Server-Sent Events."""
+    started = time.perf_counter()
     try:
         # Check authentication
         auth_header = request.headers.get('Authorization')
@@ -248,12 +498,26 @@ def analyze_symptoms():
             return jsonify({'error': 'Symptoms description required'}), 400
         
         # Prepare input for AI model
-        input_text = f"Symptoms: {symptoms}. Duration: {duration}. Severity: {severity}/10. Medical History: {', '.join(medical_history)}. Vital Signs: Heart Rate: {vital_signs.get('heart_rate', 'N/A')}, BP: {vital_signs.get('blood_pressure_systolic', 'N/A')}/{vital_signs.get('blood_pressure_diastolic', 'N/A')}, Temp: {vital_signs.get('temperature', 'N/A')}."
+        input_text = build_symptom_prompt(symptoms, duration, severity, medical_history, vital_signs)
         
-        diagnosis_result = disease_predictor.predict_disease_from_symptoms(input_text)
+        # Identical requests (modulo case, whitespace and history order) share one predictor call
+        cache_key = symptom_cache_key(symptoms, duration, severity, medical_history, vital_signs)
+        
+        if request.args.get('stream', '').lower() in ('1', 'true'):
+            return Response(stream_with_context(stream_symptom_events(input_text, cache_key, started)),
+                            mimetype='text/event-stream', headers=SSE_HEADERS)
+        
+        diagnosis_result, cache_status = symptom_cache.get_or_compute(
+            cache_key,
+            lambda: disease_predictor.predict_disease_from_symptoms(input_text),
+            timeout=app.config['SYMPTOM_ANALYSIS_TIMEOUT']
+        )
+        latency_metrics.record('symptom_analysis_ms', (time.perf_counter() - started) * 1000.0)
         
         if diagnosis_result:
-            return jsonify(diagnosis_result), 200
+            response = jsonify(diagnosis_result)
+            response.headers['X-Cache'] = cache_status
+            return response, 200
         else:
             return jsonify({'error': 'AI diagnosis failed or returned no results.'}), 500
             
@@ -261,6 +525,104 @@ def analyze_symptoms():
         logger.error(f"Symptom analysis error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error during symptom analysis'}), 500
 
+def parse_symptom_stream_text(text):
+    """Structured result from a streamed answer: the JSON object in it if there is one, else the raw text."""
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            parsed = json.loads(text[start:end + 1])
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+    return {'analysis': text.strip()} if text.strip() else None
+
+def stream_symptom_events(input_text, cache_key, started):
+    """Yield 'token' events with partial output, then one 'result' event with the predictor's diagnosis.
+
+    The 'result' event always carries the same payload as the non-streamed
+    endpoint. When the predictor can stream itself, its chunks are pushed as
+    they are generated. When SYMPTOM_STREAM_ENGINE='gemini', Gemini's text is
+    pushed as a preview (token events with 'source') while the predictor runs
+    in a worker thread; its answer is never used as the result. Otherwise
+    heartbeats keep the connection open until the predictor finishes.
+
+    symptom_stream_first_token_ms is the time to the first generated token and
+    is only recorded when output was actually streamed; symptom_stream_result_ms
+    is the time to the complete result on every path.
+    """
+    def record_result_latency():
+        latency_metrics.record('symptom_stream_result_ms', (time.perf_counter() - started) * 1000.0)
+
+    def record_first_token():
+        latency_metrics.record('symptom_stream_first_token_ms', (time.perf_counter() - started) * 1000.0)
+
+    try:
+        cached = symptom_cache.get(cache_key)
+        if cached:
+            record_result_latency()
+            yield format_sse({'result': cached, 'cached': True}, event='result')
+            return
+
+        result = None
+        if symptom_streamer is disease_predictor and symptom_streamer is not None:
+            chunks = []
+            for chunk in symptom_streamer.stream_disease_from_symptoms(input_text):
+                if isinstance(chunk, dict):
+                    result = chunk
+                    continue
+                if not chunk:
+                    continue
+                if not chunks:
+                    record_first_token()
+                chunks.append(chunk)
+                yield format_sse({'text': chunk}, event='token')
+            if result is None:
+                result = parse_symptom_stream_text(''.join(chunks))
+            if result:
+                symptom_cache.put(cache_key, result)
+        else:
+            future = symptom_stream_executor.submit(
+                symptom_cache.get_or_compute, cache_key,
+                lambda: disease_predictor.predict_disease_from_symptoms(input_text),
+                app.config['SYMPTOM_ANALYSIS_TIMEOUT']
+            )
+            deadline = time.monotonic() + app.config['SYMPTOM_ANALYSIS_TIMEOUT']
+            if symptom_streamer is not None:
+                try:
+                    first = True
+                    for chunk in symptom_streamer.stream_disease_from_symptoms(input_text):
+                        if future.done() or time.monotonic() >= deadline:
+                            break
+                        if not chunk or isinstance(chunk, dict):
+                            continue
+                        if first:
+                            record_first_token()
+                            first = False
+                        yield format_sse({'text': chunk, 'source': symptom_streamer.model_name}, event='token')
+                except Exception as e:
+                    # The preview is optional; the predictor's result still arrives
+                    logger.warning(f"Symptom preview stream failed: {e}")
+            while True:
+                try:
+                    result, _ = future.result(timeout=min(app.config['SSE_HEARTBEAT_INTERVAL'], max(deadline - time.monotonic(), 0.01)))
+                    break
+                except FutureTimeoutError:
+                    if time.monotonic() >= deadline:
+                        raise
+                    yield format_sse_comment('heartbeat')
+
+        if not result:
+            yield format_sse({'error': 'AI diagnosis failed or returned no results.'}, event='error')
+            return
+        record_result_latency()
+        yield format_sse({'result': result, 'cached': False}, event='result')
+    except Exception as e:
+        logger.error(f"Streaming symptom analysis error: {str(e)}", exc_info=True)
+        yield format_sse({'error': 'Internal server error during symptom analysis'}, event='error')
+    finally:
+        latency_metrics.record('symptom_stream_total_ms', (time.perf_counter() - started) * 1000.0)
+
 @app.route('/api/ai/image-diagnosis', methods=['POST'])
 def image_diagnosis():
     """Perform medical image diagnosis using AI models."""
@@ -277,22 +639,33 @@ def image_diagnosis():
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_extension = filename.rsplit('.', 1)[1].lower()
 
-            temp_dir = tempfile.mkdtemp()
-            temp_filepath = os.path.join(temp_dir, filename)
-            file.save(temp_filepath)
-
-            result = None
-            if diagnosis_type == 'eye_anemia':
-                # Use the AnemiaDetector service for eye_anemia diagnosis
-                result = anemia_detector.detect_anemia_from_eye_image(temp_filepath)
+            image_bytes = file.read()
+            analyze_array, analyze_path = image_analysis_entry_points(diagnosis_type)
+            if analyze_array is not None:
+                # Decode straight from the upload buffer, downscaled to the models' working resolution
+                image = decode_image_bytes(image_bytes, app.config['IMAGE_WORKING_SIZE'])
+                hash_image = image
             else:
-                # Default to general image analysis if no specific type or type not recognized
-                result = image_analyzer.analyze_image(temp_filepath)
+                # The model reads the file itself; only the cache key needs pixels, and pHash needs just a thumbnail
+                image = None
+                hash_image = None
+                if diagnosis_cache.max_entries > 0 and not diagnosis_cache.is_exact(diagnosis_type):
+                    hash_image = decode_image_bytes(image_bytes, PHASH_DECODE_SIZE)
+
+            # Repeat submissions of the same photo (retries, patient + doctor) reuse the earlier result.
+            # pHash ignores colour, so colour-dependent types only reuse byte-identical uploads.
+            if diagnosis_cache.is_exact(diagnosis_type):
+                image_hash = content_hash(image_bytes)
+            else:
+                image_hash = perceptual_hash(hash_image) if hash_image is not None else None
+            model_version = image_model_version(diagnosis_type)
+            result = diagnosis_cache.get(diagnosis_type, model_version, image_hash) if image_hash is not None else None
 
-            os.remove(temp_filepath)
-            os.rmdir(temp_dir)
+            if result is None:
+                result = run_image_analysis(analyze_array, analyze_path, image, image_bytes, filename)
+                if result and image_hash is not None:
+                    diagnosis_cache.put(diagnosis_type, model_version, image_hash, result)
 
             if result:
                 return jsonify(result), 200
@@ -304,9 +677,98 @@ def image_diagnosis():
         logger.error(f"Image diagnosis error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error during image diagnosis'}), 500
 
+def image_model_version(diagnosis_type):
+    """Identify the model serving diagnosis_type, so cached results are dropped when it changes."""
+    analyzer = anemia_detector if diagnosis_type == 'eye_anemia' else image_analyzer
+    version = [app.config['IMAGE_MODEL_VERSION'], type(analyzer).__name__, str(getattr(analyzer, 'model_version', ''))]
+    model_path = getattr(analyzer, 'model_path', None)
+    if model_path and os.path.exists(model_path):
+        version.append(f"{model_path}@{os.path.getmtime(model_path)}")
+    return ':'.join(version)
+
+# perceptual_hash works on a 32x32 reduction, so a cache-only decode can let the codec drop most of the pixels
+PHASH_DECODE_SIZE = 32
+
+def image_analysis_entry_points(diagnosis_type):
+    """(array entry point or None, file path entry point) of the analyzer serving diagnosis_type."""
+    if diagnosis_type == 'eye_anemia':
+        # Use the AnemiaDetector service for eye_anemia diagnosis
+        return getattr(anemia_detector, 'detect_anemia_from_array', None), anemia_detector.detect_anemia_from_eye_image
+    # Default to general image analysis if no specific type or type not recognized
+    return getattr(image_analyzer, 'analyze_image_array', None), image_analyzer.analyze_image
+
+def run_image_analysis(analyze_array, analyze_path, image, image_bytes, filename):
+    """Run an analyzer, preferring the in-memory array path when the image was decoded for it."""
+    if image is not None and analyze_array is not None:
+        return analyze_array(image)
+
+    # The analyzer only accepts file paths, or the upload is not a plain image (e.g. DICOM).
+    # TemporaryDirectory guarantees cleanup even if the analysis raises.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_filepath = os.path.join(temp_dir, filename)
+        with open(temp_filepath, 'wb') as f:
+            f.write(image_bytes)
+        return analyze_path(temp_filepath)
+
+@app.route('/api/ai/anemia-screening', methods=['POST'])
+def anemia_screening():
+    """Screen many conjunctiva photos for anemia in vectorized batches (screening camps)."""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        # Prefer the diagnostic model's own batched path; otherwise the trained pallor feature model.
+        # With neither there is nothing calibrated to screen with, so say so rather than guess.
+        detect_batch = getattr(anemia_detector, 'detect_anemia_from_arrays', None)
+        if detect_batch is None and batch_anemia_detector.available:
+            detect_batch = batch_anemia_detector.detect_batch
+        if detect_batch is None:
+            return jsonify({'error': 'Batch anemia screening is unavailable: no anemia feature model has been fitted (python -m backend.anemia_batch).'}), 503
+
+        files = request.files.getlist('images')
+        if not files:
+            return jsonify({'error': 'No image files provided'}), 400
+        if len(files) > app.config['ANEMIA_MAX_IMAGES_PER_REQUEST']:
+            return jsonify({'error': f"At most {app.config['ANEMIA_MAX_IMAGES_PER_REQUEST']} images per request."}), 400
+
+        results = []
+        batch_size = app.config['ANEMIA_BATCH_SIZE']
+        for start in range(0, len(files), batch_size):
+            chunk = files[start:start + batch_size]
+            images = [
+                decode_image_bytes(f.read(), app.config['IMAGE_WORKING_SIZE']) if allowed_file(f.filename) else None
+                for f in chunk
+            ]
+            for f, result in zip(chunk, detect_batch(images)):
+                result['filename'] = secure_filename(f.filename)
+                results.append(result)
+
+        return jsonify({'success': True, 'count': len(results), 'results': results}), 200
+    except Exception as e:
+        logger.error(f"Anemia screening error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error during anemia screening'}), 500
+
+@app.route('/api/ai/inference-stats', methods=['GET'])
+def get_inference_stats():
+    """Queue depth, batch size histogram and latency for the batched image model, result cache stats and request latency metrics."""
+    try:
+        stats = image_analyzer.stats() if hasattr(image_analyzer, 'stats') else None
+        return jsonify({
+            'success': True,
+            'engine': app.config['IMAGE_INFERENCE_ENGINE'],
+            'stats': stats,
+            'cache': diagnosis_cache.stats(),
+            'symptom_cache': symptom_cache.stats(),
+            'latency': latency_metrics.snapshot()
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting inference stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch inference stats.'}), 500
+
 @app.route('/api/ai/ocr-analysis', methods=['POST'])
 def ocr_analysis():
-    """Perform OCR on medical documents."""
+    """Perform OCR on medical documents. With ?stream=1, pages are pushed as Server-Sent Events."""
     try:
         auth_header = request.headers.get('Authorization')
         if not auth_header:
@@ -317,19 +779,57 @@ def ocr_analysis():
 
         file = request.files['document']
 
+        # Optionally attach the extracted text to an existing record so it becomes searchable
+        record = None
+        if request.form.get('record_id'):
+            record = get_accessible_medical_record(request.form['record_id'], auth_header)
+            if not record:
+                return jsonify({'error': 'Medical record not found or access denied.'}), 404
+
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            temp_dir = tempfile.mkdtemp()
-            temp_filepath = os.path.join(temp_dir, filename)
-            file.save(temp_filepath)
-
-            extracted_text = ocr_processor.process_document(temp_filepath)
 
-            os.remove(temp_filepath)
-            os.rmdir(temp_dir)
+            if request.args.get('stream', '').lower() in ('1', 'true'):
+                # The generator outlives this function. It removes the temp dir when it finishes, and
+                # call_on_close covers a client that disconnects before the generator ever runs.
+                temp_dir = tempfile.mkdtemp()
+                temp_filepath = os.path.join(temp_dir, filename)
+                file.save(temp_filepath)
+                response = Response(stream_with_context(stream_ocr_events(temp_dir, temp_filepath, record)),
+                                    mimetype='text/event-stream', headers=SSE_HEADERS)
+                response.call_on_close(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+                return response
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_filepath = os.path.join(temp_dir, filename)
+                file.save(temp_filepath)
+
+                # Identical documents (same bytes, same OCR engine/config) skip Tesseract entirely
+                content_hash = file_sha256(temp_filepath)
+                engine_version = ocr_engine_version()
+                cached = ocr_cache.get(content_hash, engine_version)
+
+                page_timings = None
+                summary = None
+                if cached:
+                    extracted_text = cached['extracted_text']
+                    page_timings = cached['pages']
+                elif hasattr(ocr_processor, 'process_document_pages'):
+                    pages, summary = ocr_processor.process_document_pages(temp_filepath)
+                    extracted_text = ocr_processor.join_pages(pages)
+                    page_timings = ocr_page_timings(pages)
+                    cache_ocr_result(content_hash, engine_version, extracted_text, page_timings, summary)
+                else:
+                    extracted_text = ocr_processor.process_document(temp_filepath)
+                    cache_ocr_result(content_hash, engine_version, extracted_text)
 
             if extracted_text:
-                return jsonify({'success': True, 'extracted_text': extracted_text}), 200
+                if record:
+                    index_ocr_text(record, extracted_text)
+                response = {'success': True, 'extracted_text': extracted_text, 'cached': bool(cached)}
+                if page_timings is not None:
+                    response.update({'pages': page_timings, 'summary': summary})
+                return jsonify(response), 200
             else:
                 return jsonify({'error': 'OCR failed to extract text.'}), 500
         else:
@@ -338,6 +838,86 @@ def ocr_analysis():
         logger.error(f"OCR analysis error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error during OCR analysis'}), 500
 
+def get_accessible_medical_record(record_id, auth_header):
+    """The record, if the caller is its patient or a doctor; otherwise None."""
+    token = auth_header.split(" ")[1]
+    user_session = db.get_user_by_token(token)
+    if not user_session:
+        return None
+    record = db.get_medical_record_by_id(record_id)
+    if not record:
+        return None
+    if user_session.get('id') != record.get('patient_id') and user_session.get('role') != 'doctor':
+        return None
+    return record
+
+def index_ocr_text(record, extracted_text):
+    try:
+        search_index.index_ocr_text(record['id'], record.get('patient_id'), extracted_text)
+    except Exception as e:
+        logger.warning(f"Search indexing of OCR text failed for record {record.get('id')}: {e}")
+
+def ocr_engine_version():
+    return getattr(ocr_processor, 'engine_version', type(ocr_processor).__name__)
+
+def ocr_page_timings(pages):
+    return [
+        {'page': p['page'], 'rasterize_ms': p['rasterize_ms'], 'ocr_ms': p['ocr_ms'], 'characters': len(p['text'])}
+        for p in pages
+    ]
+
+def cache_ocr_result(content_hash, engine_version, extracted_text, page_timings=None, summary=None):
+    """Store a complete OCR result. Partial results (truncated, timed out or failed pages) are not cached."""
+    if not extracted_text:
+        return
+    if summary and (summary['truncated'] or summary['timed_out'] or summary['failed_pages']):
+        return
+    ocr_cache.put(content_hash, engine_version, extracted_text, page_timings)
+
+def stream_ocr_events(temp_dir, temp_filepath, record=None):
+    """Yield a 'page' event per recognized page (in completion order), then a 'summary' event."""
+    try:
+        content_hash = file_sha256(temp_filepath)
+        engine_version = ocr_engine_version()
+        cached = ocr_cache.get(content_hash, engine_version)
+        if cached:
+            if record:
+                index_ocr_text(record, cached['extracted_text'])
+            yield format_sse({'extracted_text': cached['extracted_text'], 'pages': cached['pages'], 'summary': None, 'cached': True}, event='summary')
+            return
+
+        if not hasattr(ocr_processor, 'iter_pages'):
+            # Engine without page-level progress: one page event carrying the whole document
+            extracted_text = ocr_processor.process_document(temp_filepath)
+            cache_ocr_result(content_hash, engine_version, extracted_text)
+            if record and extracted_text:
+                index_ocr_text(record, extracted_text)
+            yield format_sse({'page': 1, 'text': extracted_text}, event='page')
+            yield format_sse({'extracted_text': extracted_text, 'pages': None, 'summary': None, 'cached': False}, event='summary')
+            return
+
+        pages = []
+        summary = None
+        for item in ocr_processor.iter_pages(temp_filepath):
+            if item.get('summary'):
+                summary = item
+                continue
+            pages.append(item)
+            yield format_sse(item, event='page')
+
+        pages.sort(key=lambda p: p['page'])
+        extracted_text = ocr_processor.join_pages(pages)
+        page_timings = ocr_page_timings(pages)
+        cache_ocr_result(content_hash, engine_version, extracted_text, page_timings, summary)
+        if record and extracted_text:
+            index_ocr_text(record, extracted_text)
+        yield format_sse({'extracted_text': extracted_text, 'pages': page_timings, 'summary': summary, 'cached': False}, event='summary')
+    except Exception as e:
+        logger.error(f"Streaming OCR analysis error: {str(e)}", exc_info=True)
+        yield format_sse({'error': 'Internal server error during OCR analysis'}, event='error')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
 @app.route('/api/ml-diagnosis', methods=['POST'])
 def ml_diagnosis():
     """Predict medical conditions using various ML models based on structured input."""
@@ -587,6 +1167,15 @@ def ml_diagnosis():
             return jsonify({'error': 'Invalid model_name provided.'}), 400
 
         if prediction_result:
+            # The latest inputs per patient and model are what the nightly risk scoring job ranks.
+            # Only a doctor may file inputs under another patient; a patient always files under their own id
+            if user_session.get('role') == 'doctor':
+                patient_id = data.get('patient_id')
+            elif user_session.get('role') == 'patient':
+                patient_id = user_session['id']
+            else:
+                patient_id = None
+            track_write(risk_store, 'record_inputs', patient_id, model_name, input_data)
             return jsonify(prediction_result), 200
         else:
             return jsonify({'error': 'ML prediction failed or returned no results.'}), 500
@@ -750,7 +1339,96 @@ def create_prescription(patient_id):
 
 # ==================== MEDICAL RECORDS ROUTES ====================
 
+def index_medical_record(record):
+    """Keep the search index in step with a created or updated record. Never fails the request."""
+    try:
+        search_index.index_record(record)
+    except Exception as e:
+        app.logger.warning(f"Search indexing failed for record {record.get('id') if record else 'N/A'}: {e}")
+
+def track_write(tracker, event, *args):
+    """Apply a write to a derived store (analytics rollups, doctor metrics, risk inputs). Never fails the request."""
+    try:
+        getattr(tracker, event)(*args)
+    except Exception as e:
+        app.logger.warning(f"{type(tracker).__name__}.{event} failed: {e}")
+
+def pin_file_from_disk(file_path, filename):
+    """Pin a file to IPFS by streaming it from disk, so large uploads are never held in memory. Returns the IPFS hash or None.
+
+    Goes through ipfs_service.pin_file() when the service provides it. Otherwise
+    the file is streamed to PINATA_PIN_FILE_URL with the service's own
+    credentials, falling back to the configured ones.
+    """
+    if hasattr(ipfs_service, 'pin_file'):
+        return ipfs_service.pin_file(file_path, filename)
+    body = MultipartFileBody(file_path, filename)
+    try:
+        response = requests.post(
+            app.config['PINATA_PIN_FILE_URL'],
+            data=body,
+            headers={
+                'Content-Type': body.content_type,
+                'pinata_api_key': getattr(ipfs_service, 'api_key', None) or app.config['PINATA_API_KEY'] or '',
+                'pinata_secret_api_key': getattr(ipfs_service, 'secret_key', None) or app.config['PINATA_SECRET_KEY'] or '',
+            },
+            timeout=(10, 600)
+        )
+        response.raise_for_status()
+        return response.json().get('IpfsHash')
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Streaming IPFS upload of {filename} failed: {e}")
+        return None
+
+def store_medical_record_file(file_content, filename, patient_id, uploader_id, record_type, title, description, file_path=None):
+    """Pin a medical record file to IPFS and save its metadata. Returns a Flask response tuple.
+
+    Pass file_path instead of file_content for large files already on disk; they are streamed, not read into memory.
+    """
+    # Upload to IPFS
+    if file_path is not None:
+        ipfs_hash = pin_file_from_disk(file_path, filename)
+    else:
+        ipfs_hash = ipfs_service.upload_file(file_content=file_content, filename=filename)
+
+    if not ipfs_hash:
+        return jsonify({'error': 'Failed to upload file to IPFS'}), 500
+
+    # Construct the IPFS gateway URL
+    pinata_gateway_url = app.config.get('PINATA_GATEWAY_URL') # Retrieve from config again for clarity
+    if not pinata_gateway_url:
+        app.logger.error("PINATA_GATEWAY_URL not configured in app.config.")
+        return jsonify({'error': 'Pinata Gateway URL not configured.'}), 500
+
+    profile_pic_url = f"{pinata_gateway_url}/ipfs/{ipfs_hash}"
+
+    # Prepare medical record data
+    medical_record_data = {
+        'patient_id': patient_id,
+        'uploaded_by_id': uploader_id,
+        'record_type': record_type,
+        'title': title,
+        'description': description,
+        'file_url': profile_pic_url,
+        'ipfs_hash': ipfs_hash,
+        'uploaded_at': datetime.utcnow().isoformat() + '+00:00'
+    }
+
+    # Save record metadata to Supabase
+    new_record = db.create_medical_record(medical_record_data)
+
+    if new_record:
+        index_medical_record(new_record)
+        track_write(analytics_rollups, 'record_created', new_record)
+        track_write(doctor_metrics, 'record_created', new_record)
+        # Build the zoomable preview in the background; the viewer polls /preview until it is ready
+        tile_service.schedule(file_path if file_path is not None else file_content, filename, alias=ipfs_hash)
+        return jsonify({'success': True, 'message': 'Medical record uploaded and saved.', 'record': new_record}), 201
+    else:
+        return jsonify({'error': 'Failed to save medical record metadata.'}), 500
+
 @app.route('/api/medical-records', methods=['POST'])
+@idempotent
 def upload_medical_record():
     """Upload a new medical record (e.g., PDF, image)."""
     try:
@@ -793,48 +1471,211 @@ def upload_medical_record():
             temp_filepath = os.path.join(temp_dir, filename)
             file.save(temp_filepath)
 
-            # Upload to IPFS
-            ipfs_hash = ipfs_service.upload_file(file_content=open(temp_filepath, 'rb').read(), filename=filename)
+            with open(temp_filepath, 'rb') as f:
+                file_content = f.read()
 
             # Clean up temporary file
             os.remove(temp_filepath)
             os.rmdir(temp_dir)
 
-            if not ipfs_hash:
-                return jsonify({'error': 'Failed to upload file to IPFS'}), 500
+            return store_medical_record_file(file_content, filename, patient_id, uploader_id, record_type, title, description)
+        else:
+            return jsonify({'error': 'Invalid file type or no file selected.'}), 400
+    except Exception as e:
+        logger.error(f"Error uploading medical record: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to upload medical record.'}), 500
 
-            # Construct the IPFS gateway URL
-            pinata_gateway_url = app.config.get('PINATA_GATEWAY_URL') # Retrieve from config again for clarity
-            if not pinata_gateway_url:
-                app.logger.error("PINATA_GATEWAY_URL not configured in app.config.")
-                return jsonify({'error': 'Pinata Gateway URL not configured.'}), 500
+# ---------- Resumable (chunked) uploads ----------
 
-            profile_pic_url = f"{pinata_gateway_url}/ipfs/{ipfs_hash}"
+@app.route('/api/medical-records/uploads', methods=['POST', 'OPTIONS'])
+def create_upload_session():
+    """Start a resumable upload session for a large medical record file."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
 
-            # Prepare medical record data
-            medical_record_data = {
-                'patient_id': patient_id,
-                'uploaded_by_id': uploader_id,
-                'record_type': record_type,
-                'title': title,
-                'description': description,
-                'file_url': profile_pic_url,
-                'ipfs_hash': ipfs_hash,
-                'uploaded_at': datetime.utcnow().isoformat() + '+00:00'
-            }
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session:
+            return jsonify({'error': 'Invalid authentication token.'}), 401
 
-            # Save record metadata to Supabase
-            new_record = db.create_medical_record(medical_record_data)
+        uploader_id = user_session['id']
+        uploader_role = user_session['role']
 
-            if new_record:
-                return jsonify({'success': True, 'message': 'Medical record uploaded and saved.', 'record': new_record}), 201
-            else:
-                return jsonify({'error': 'Failed to save medical record metadata.'}), 500
-        else:
-            return jsonify({'error': 'Invalid file type or no file selected.'}), 400
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename', ''))
+        total_size = data.get('total_size')
+        patient_id = data.get('patient_id')
+
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type or no file name provided.'}), 400
+        try:
+            total_size = int(total_size)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'total_size (in bytes) is required.'}), 400
+
+        if uploader_role == 'doctor' and not patient_id:
+            return jsonify({'error': 'Patient ID is required for doctors uploading records.'}), 400
+        elif uploader_role == 'patient':
+            patient_id = uploader_id # Patient uploads their own record
+
+        metadata = {
+            'patient_id': patient_id,
+            'record_type': data.get('record_type', 'unspecified'),
+            'title': data.get('title', 'Medical Record'),
+            'description': data.get('description', '')
+        }
+        upload = upload_service.create_session(uploader_id, filename, total_size, metadata)
+        return jsonify({'success': True, 'upload': upload}), 201
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error uploading medical record: {e}", exc_info=True)
-        return jsonify({'error': 'Failed to upload medical record.'}), 500
+        logger.error(f"Error creating upload session: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to create upload session.'}), 500
+
+@app.route('/api/medical-records/uploads/<upload_id>', methods=['GET', 'PUT', 'OPTIONS'])
+def handle_upload_chunk(upload_id):
+    """Query received byte ranges (GET) or write a chunk at ?offset=N (PUT, raw body)."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session:
+            return jsonify({'error': 'Invalid authentication token.'}), 401
+
+        session = upload_service.get_session(upload_id, user_session['id'])
+        if not session:
+            return jsonify({'error': 'Upload session not found.'}), 404
+
+        if request.method == 'GET':
+            return jsonify({'success': True, 'upload': upload_service.describe(session)}), 200
+
+        try:
+            offset = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Chunk offset is required.'}), 400
+
+        upload = upload_service.write_chunk(session, offset, request.get_data())
+        return jsonify({'success': True, 'upload': upload}), 200
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error handling upload chunk for {upload_id}: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to process upload chunk.'}), 500
+
+@app.route('/api/medical-records/uploads/<upload_id>/complete', methods=['POST', 'OPTIONS'])
+@idempotent
+def complete_upload_session(upload_id):
+    """Finalize a resumable upload and save it as a medical record."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session:
+            return jsonify({'error': 'Invalid authentication token.'}), 401
+
+        session = upload_service.get_session(upload_id, user_session['id'])
+        if not session:
+            return jsonify({'error': 'Upload session not found.'}), 404
+
+        data = request.get_json(silent=True) or {}
+        data_path, sha256 = upload_service.finalize(session, data.get('sha256'))
+        app.logger.info(f"Upload {upload_id} assembled ({session['total_size']} bytes, sha256 {sha256}).")
+
+        metadata = session['metadata']
+        response = store_medical_record_file(
+            None, session['filename'], metadata['patient_id'], user_session['id'],
+            metadata['record_type'], metadata['title'], metadata['description'], file_path=data_path
+        )
+        # Keep the assembled file around if IPFS/DB failed so the client can retry completion
+        if response[1] == 201:
+            upload_service.discard(upload_id)
+        return response
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error completing upload {upload_id}: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to complete upload.'}), 500
+
+# ---------- Scan previews (tile pyramids) ----------
+
+def get_record_pyramid(record_id):
+    """Authorize the caller for record_id and return (content_hash, error_response)."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return None, (jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401)
+    record = get_accessible_medical_record(record_id, auth_header)
+    if not record:
+        return None, (jsonify({'error': 'Medical record not found or access denied.'}), 404)
+    content_hash = tile_service.resolve(record.get('ipfs_hash')) if record.get('ipfs_hash') else None
+    if not content_hash:
+        return None, (jsonify({'error': 'No preview available for this record.'}), 404)
+    return content_hash, None
+
+@app.route('/api/medical-records/<record_id>/preview', methods=['GET', 'OPTIONS'])
+def get_record_preview(record_id):
+    """Tile pyramid manifest for a record's image or DICOM file (status 'pending' while building)."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        content_hash, error = get_record_pyramid(record_id)
+        if error:
+            return error
+        status = tile_service.status(content_hash)
+        if not status:
+            return jsonify({'error': 'No preview available for this record.'}), 404
+        return jsonify({'success': True, 'preview': status}), 200
+    except Exception as e:
+        logger.error(f"Error getting preview for record {record_id}: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch preview.'}), 500
+
+@app.route('/api/medical-records/<record_id>/tiles/<int:frame>/<int:level>/<int:x>_<int:y>.jpg', methods=['GET'])
+def get_record_tile(record_id, frame, level, x, y):
+    """One JPEG tile of a record's preview pyramid. Level 0 is full resolution."""
+    try:
+        content_hash, error = get_record_pyramid(record_id)
+        if error:
+            return error
+        tile_path = tile_service.tile_path(content_hash, frame, level, x, y)
+        if not tile_path:
+            return jsonify({'error': 'Tile not found.'}), 404
+        # Tiles are content-addressed, so they never change once written
+        response = send_file(tile_path, mimetype='image/jpeg')
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+    except Exception as e:
+        logger.error(f"Error serving tile for record {record_id}: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch tile.'}), 500
+
+@app.route('/api/medical-records/<record_id>/thumbnail', methods=['GET'])
+def get_record_thumbnail(record_id):
+    """Small JPEG thumbnail of a record's image (middle slice for DICOM studies)."""
+    try:
+        content_hash, error = get_record_pyramid(record_id)
+        if error:
+            return error
+        thumbnail_path = tile_service.thumbnail_path(content_hash)
+        if not thumbnail_path:
+            return jsonify({'error': 'Thumbnail not ready.'}), 404
+        response = send_file(thumbnail_path, mimetype='image/jpeg')
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+    except Exception as e:
+        logger.error(f"Error serving thumbnail for record {record_id}: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch thumbnail.'}), 500
 
 @app.route('/api/medical-records/single/<record_id>', methods=['GET', 'OPTIONS'])
 def get_single_medical_record(record_id):
@@ -872,6 +1713,7 @@ def get_single_medical_record(record_id):
         return jsonify({'error': 'Failed to fetch medical record.'}), 500
 
 @app.route('/api/patients/<patient_id>/medical-records', methods=['POST'])
+@idempotent
 def create_patient_medical_record(patient_id):
     """Create a new medical record for a specific patient (for doctor dashboard)."""
     try:
@@ -902,6 +1744,9 @@ def create_patient_medical_record(patient_id):
         new_record = db.create_medical_record(record_data)
 
         if new_record:
+            index_medical_record(new_record)
+            track_write(analytics_rollups, 'record_created', new_record)
+            track_write(doctor_metrics, 'record_created', new_record)
             app.logger.info(f"Medical record created for patient {patient_id} by doctor {doctor_user['id']}.")
             return jsonify({'success': True, 'medical_record': new_record}), 201
         else:
@@ -966,8 +1811,18 @@ def add_patient_vitals(patient_id):
         new_record = db.create_medical_record(medical_record_data)
 
         if new_record:
+            index_medical_record(new_record)
+            track_write(analytics_rollups, 'record_created', new_record)
+            track_write(doctor_metrics, 'record_created', new_record)
+            alerts = []
+            try:
+                _, rejected, alerts = store_vitals_readings([{**vitals_data, 'patient_id': patient_id, 'timestamp': record_date}])
+                if rejected:
+                    app.logger.warning(f"Vitals for patient {patient_id} were not added to the vitals store: {rejected[0]['reason']}.")
+            except Exception as e:
+                app.logger.warning(f"Failed to add vitals for patient {patient_id} to the vitals store: {e}")
             app.logger.info(f"Vital signs added for patient {patient_id} by doctor {doctor_id}.")
-            return jsonify({'success': True, 'message': 'Vital signs added as medical record.', 'record': new_record}), 201
+            return jsonify({'success': True, 'message': 'Vital signs added as medical record.', 'record': new_record, 'alerts': alerts}), 201
         else:
             app.logger.error(f"Failed to add vital signs for patient {patient_id}.")
             return jsonify({'success': False, 'error': 'Failed to add vital signs.'}), 500
@@ -1081,6 +1936,12 @@ def delete_medical_record_route(record_id):
         success = db.delete_medical_record(record_id)
 
         if success:
+            track_write(analytics_rollups, 'record_deleted', record_to_delete)
+            track_write(doctor_metrics, 'record_deleted', record_to_delete)
+            try:
+                search_index.remove_record(record_id)
+            except Exception as e:
+                app.logger.warning(f"Search index removal failed for record {record_id}: {e}")
             app.logger.info(f"Medical record {record_id} deleted successfully by doctor {user_session['id']}.")
             return jsonify({'success': True, 'message': 'Medical record deleted successfully.'}), 200
         else:
@@ -1129,6 +1990,8 @@ def update_medical_record_route(record_id):
         updated_record = db.update_medical_record(record_id, filtered_update_data)
 
         if updated_record:
+            index_medical_record({**record_to_update, **filtered_update_data})
+            track_write(analytics_rollups, 'record_updated', record_to_update, {**record_to_update, **filtered_update_data})
             app.logger.info(f"Medical record {record_id} updated successfully by doctor {user_session['id']}.")
             return jsonify({'success': True, 'message': 'Medical record updated successfully.', 'record': updated_record}), 200
         else:
@@ -1139,9 +2002,73 @@ def update_medical_record_route(record_id):
         app.logger.error(f"Error updating medical record {record_id}: {e}", exc_info=True)
         return jsonify({'error': 'Failed to update medical record.'}), 500
 
+# ==================== SEARCH ROUTES ====================
+
+@app.route('/api/search/medical-records', methods=['GET', 'OPTIONS'])
+def search_medical_records():
+    """Full-text search over record titles, descriptions and OCR text, ranked by relevance."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session:
+            return jsonify({'error': 'Invalid authentication token.'}), 401
+
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Search query (q) required.'}), 400
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        patient_id = request.args.get('patient_id')
+
+        # Patients only ever see their own records; doctors may narrow to one patient
+        if user_session.get('role') == 'patient':
+            patient_ids = [user_session['id']]
+        elif user_session.get('role') == 'doctor':
+            patient_ids = [patient_id] if patient_id else None
+        else:
+            return jsonify({'error': 'Permission denied. Unauthorized role.'}), 403
+
+        started = datetime.utcnow()
+        results = search_index.search(query, patient_ids=patient_ids, limit=limit)
+        took_ms = round((datetime.utcnow() - started).total_seconds() * 1000, 2)
+        return jsonify({'success': True, 'results': results, 'took_ms': took_ms}), 200
+    except Exception as e:
+        logger.error(f"Medical record search error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to search medical records.'}), 500
+
+@app.route('/api/search/reindex', methods=['POST', 'OPTIONS'])
+def reindex_medical_records():
+    """Rebuild the search index from the database (doctor only), e.g. after moving servers."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can rebuild the search index.'}), 403
+
+        records = []
+        for patient in db.get_all_patients():
+            records.extend(db.get_medical_records(patient['id']) or [])
+        search_index.rebuild(records)
+        return jsonify({'success': True, 'index': search_index.stats()}), 200
+    except Exception as e:
+        logger.error(f"Search reindex error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to rebuild search index.'}), 500
+
 # ==================== EMERGENCY ROUTES ====================
 
 @app.route('/api/emergency/alert', methods=['POST'])
+@idempotent
 def create_emergency_alert():
     """Create an emergency alert."""
     try:
@@ -1164,6 +2091,7 @@ def create_emergency_alert():
         return jsonify({'error': 'Failed to create emergency alert.'}), 500
 
 @app.route('/api/emergency/ambulance', methods=['POST'])
+@idempotent
 def request_ambulance():
     """Request an ambulance to a specific location."""
     try:
@@ -1176,16 +2104,132 @@ def request_ambulance():
         if not patient_id or not location:
             return jsonify({'error': 'Patient ID and location required.'}), 400
 
-        response = emergency_service.dispatch_ambulance(patient_id, location, emergency_type)
+        # Reserve the nearest available unit able to handle this emergency type, when the caller sent coordinates
+        coordinates = parse_coordinates(location)
+        unit = fleet_index.reserve_nearest(*coordinates, capability=emergency_type) if coordinates else None
+        
+        try:
+            response = dispatch_ambulance(patient_id, location, emergency_type, unit)
+        except Exception:
+            if unit:
+                fleet_index.set_available(unit['unit_id'], True)
+            raise
         
         if response:
-            return jsonify({'success': True, 'message': 'Ambulance dispatched successfully', 'details': response}), 200
+            details = response if isinstance(response, dict) else {'dispatch': response}
+            if coordinates:
+                hospitals = fleet_index.nearest(*coordinates, k=1, kind='hospital', capability=emergency_type, available_only=False)
+                details = {**details, 'assigned_unit': unit, 'nearest_hospital': hospitals[0] if hospitals else None}
+            return jsonify({'success': True, 'message': 'Ambulance dispatched successfully', 'details': details}), 200
         else:
+            if unit:
+                fleet_index.set_available(unit['unit_id'], True)
             return jsonify({'error': 'Failed to dispatch ambulance.'}), 500
     except Exception as e:
         logger.error(f"Error requesting ambulance: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to request ambulance.'}), 500
 
+def dispatch_ambulance(patient_id, location, emergency_type, unit):
+    """Hand a dispatch to the emergency service, naming the reserved unit when its dispatch_ambulance() takes one."""
+    if unit is not None and 'unit' in inspect.signature(emergency_service.dispatch_ambulance).parameters:
+        return emergency_service.dispatch_ambulance(patient_id, location, emergency_type, unit=unit)
+    return emergency_service.dispatch_ambulance(patient_id, location, emergency_type)
+
+def authorize_fleet_feed():
+    """Error response unless the caller is the dispatch service (EMERGENCY_DISPATCH_TOKEN) or a dispatcher/admin user."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or len(auth_header.split(" ")) < 2:
+        return jsonify({'error': 'Authentication required'}), 401
+    token = auth_header.split(" ")[1]
+    service_token = app.config.get('EMERGENCY_DISPATCH_TOKEN')
+    if service_token and hmac.compare_digest(token.encode(), service_token.encode()):
+        return None
+    user_session = db.get_user_by_token(token)
+    if not user_session:
+        return jsonify({'error': 'Invalid authentication token.'}), 401
+    if user_session.get('role') not in ('dispatcher', 'admin'):
+        return jsonify({'error': 'Only the dispatch service can update fleet units.'}), 403
+    return None
+
+@app.route('/api/emergency/units/positions', methods=['POST'])
+def update_unit_positions():
+    """Report positions for ambulances and hospitals: {'units': [{unit_id, lat, lng, kind?, capabilities?, available?}]}."""
+    try:
+        error = authorize_fleet_feed()
+        if error:
+            return error
+        data = request.get_json() or {}
+        units = data.get('units')
+        if not isinstance(units, list):
+            return jsonify({'error': 'A list of units is required.'}), 400
+
+        updated, rejected = 0, []
+        for unit in units:
+            coordinates = parse_coordinates(unit) if isinstance(unit, dict) else None
+            if not coordinates or not unit.get('unit_id'):
+                rejected.append(unit.get('unit_id') if isinstance(unit, dict) else None)
+                continue
+            if set(unit) <= {'unit_id', 'lat', 'lng', 'latitude', 'longitude'} and fleet_index.update_position(unit['unit_id'], *coordinates):
+                updated += 1
+                continue
+            kind = unit.get('kind', 'ambulance')
+            if kind not in ('ambulance', 'hospital'):
+                rejected.append(unit['unit_id'])
+                continue
+            fleet_index.upsert(unit['unit_id'], *coordinates, kind=kind,
+                               capabilities=unit.get('capabilities'), available=unit.get('available'))
+            updated += 1
+
+        return jsonify({'success': True, 'updated': updated, 'rejected': rejected}), 200
+    except Exception as e:
+        logger.error(f"Error updating unit positions: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to update unit positions.'}), 500
+
+@app.route('/api/emergency/units/<unit_id>/availability', methods=['PUT'])
+def set_unit_availability(unit_id):
+    """Mark a unit available again (e.g. after a call) or out of service."""
+    try:
+        error = authorize_fleet_feed()
+        if error:
+            return error
+        data = request.get_json() or {}
+        if 'available' not in data:
+            return jsonify({'error': 'available is required.'}), 400
+        if not fleet_index.set_available(unit_id, data['available']):
+            return jsonify({'error': 'Unit not found.'}), 404
+        return jsonify({'success': True, 'unit': fleet_index.get(unit_id)}), 200
+    except Exception as e:
+        logger.error(f"Error updating unit availability: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to update unit availability.'}), 500
+
+@app.route('/api/emergency/units/nearest', methods=['GET'])
+def get_nearest_units():
+    """k nearest units to ?lat=&lng=, optionally filtered by emergency_type and kind."""
+    try:
+        coordinates = parse_coordinates({'lat': request.args.get('lat'), 'lng': request.args.get('lng')})
+        if not coordinates:
+            return jsonify({'error': 'Valid lat and lng are required.'}), 400
+        k = max(1, min(request.args.get('k', default=5, type=int), 50))
+        units = fleet_index.nearest(
+            *coordinates, k=k,
+            kind=request.args.get('kind', 'ambulance'),
+            capability=request.args.get('emergency_type'),
+            available_only=request.args.get('available_only', 'true').lower() != 'false'
+        )
+        return jsonify({'success': True, 'units': units}), 200
+    except Exception as e:
+        logger.error(f"Error finding nearest units: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to find nearest units.'}), 500
+
+@app.route('/api/emergency/lane-stats', methods=['GET'])
+def get_emergency_lane_stats():
+    """Emergency lane latency against its SLO, and heavy-request admission counters."""
+    try:
+        return jsonify({'success': True, 'lanes': priority_lanes.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting emergency lane stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch emergency lane stats.'}), 500
+
 # ==================== ANALYTICS ROUTES ====================
 
 @app.route('/api/analytics/dashboard', methods=['GET'])
@@ -1193,7 +2237,8 @@ def get_dashboard_analytics():
     """Get overall dashboard analytics."""
     try:
         # Authentication and authorization logic for doctors/admins
-        analytics_data = analytics_service.get_overall_dashboard_data()
+        # Same schema either way: analytics_service's payload, with live rollup counts once they have loaded
+        analytics_data = analytics_rollups.dashboard() if analytics_rollups.ready else analytics_service.get_overall_dashboard_data()
         return jsonify({'success': True, 'data': analytics_data}), 200
     except Exception as e:
         logger.error(f"Error getting dashboard analytics: {str(e)}", exc_info=True)
@@ -1204,21 +2249,56 @@ def get_consultation_analytics():
     """Get analytics related to consultations."""
     try:
         # Authentication and authorization logic for doctors/admins
-        analytics_data = analytics_service.get_consultation_metrics()
+        analytics_data = analytics_rollups.consultation_metrics() if analytics_rollups.ready else analytics_service.get_consultation_metrics()
         return jsonify({'success': True, 'data': analytics_data}), 200
     except Exception as e:
         logger.error(f"Error getting consultation analytics: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch consultation analytics.'}), 500
 
+@app.route('/api/analytics/rollup-stats', methods=['GET'])
+def get_analytics_rollup_stats():
+    """Rollup reconcile status and the drift its last full recompute corrected."""
+    try:
+        return jsonify({'success': True, 'rollups': analytics_rollups.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting analytics rollup stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch analytics rollup stats.'}), 500
+
+def parse_time_arg(value):
+    """Epoch milliseconds from an ISO 8601 string or an epoch-ms number, or None."""
+    if not value:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
 @app.route('/api/analytics/patient-health-trends', methods=['GET'])
 def get_patient_health_trends():
-    """Get health trends for patients."""
+    """Get health trends for patients, downsampled server-side to the chart width.
+
+    Optional query args: start/end (ISO 8601 or epoch ms), width (points per
+    series) and mode ('minmax' buckets or 'lttb').
+    """
     try:
         patient_id = request.args.get('patient_id')
         if not patient_id:
             return jsonify({'error': 'Patient ID required for health trends.'}), 400
         # Authentication and authorization logic here (patient can see their own, doctor can see their patients')
-        health_trends_data = analytics_service.get_patient_health_trends(patient_id)
+        try:
+            start_ms, end_ms = parse_time_arg(request.args.get('start')), parse_time_arg(request.args.get('end'))
+        except ValueError:
+            return jsonify({'error': 'start and end must be ISO 8601 timestamps or epoch milliseconds.'}), 400
+        width = max(10, min(request.args.get('width', default=app.config['TRENDS_DEFAULT_WIDTH'], type=int), app.config['TRENDS_MAX_WIDTH']))
+        mode = request.args.get('mode', 'minmax')
+        if mode not in ('minmax', 'lttb'):
+            return jsonify({'error': "mode must be 'minmax' or 'lttb'."}), 400
+
+        ensure_vitals_series(patient_id)
+        health_trends_data = vitals_series.query(patient_id, start_ms, end_ms, width=width, mode=mode)
+        if not health_trends_data['points'] and start_ms is None and end_ms is None:
+            # No vitals recorded for this patient; keep serving whatever the analytics service derives
+            health_trends_data = analytics_service.get_patient_health_trends(patient_id)
         return jsonify({'success': True, 'data': health_trends_data}), 200
     except Exception as e:
         logger.error(f"Error getting patient health trends: {str(e)}", exc_info=True)
@@ -1226,6 +2306,37 @@ def get_patient_health_trends():
 
 # ==================== CONSULTATION (APPOINTMENT) ROUTES ====================
 
+def find_booking_conflicts(doctor_id, consultation, exclude_id=None):
+    """The doctor's active consultations overlapping this one, read fresh from the database.
+
+    Call with appointment_index.booking(doctor_id) held. Returns None when the
+    calendar cannot be loaded, so the caller refuses the write rather than
+    risking a double booking.
+    """
+    try:
+        bounds = appointment_index.interval(consultation)
+        if bounds is None:
+            return []
+        return appointment_index.conflicts(doctor_id, *bounds, exclude_id=exclude_id, fresh=True)
+    except Exception as e:
+        app.logger.warning(f"Appointment conflict check failed for doctor {doctor_id}: {e}")
+        return None
+
+def get_indexed_appointment(consultation_id, doctor_id=None):
+    """The consultation wherever it is booked: the index first (doctor_id's calendar, then any loaded one), then the database."""
+    try:
+        found = appointment_index.find(consultation_id, doctor_id)
+        if found:
+            return found
+    except Exception as e:
+        app.logger.warning(f"Appointment index lookup failed for consultation {consultation_id}: {e}")
+    # Booked with a doctor whose calendar this process has not loaded
+    try:
+        return next((c for c in db.get_all_consultations() or [] if str(c.get('id')) == str(consultation_id)), {})
+    except Exception as e:
+        app.logger.warning(f"Consultation lookup failed for {consultation_id}: {e}")
+        return {}
+
 @app.route('/api/consultations', methods=['POST', 'OPTIONS'])
 def create_consultation():
     """Create a new consultation"""
@@ -1266,10 +2377,28 @@ def create_consultation():
         except ValueError:
             return jsonify({'error': 'Invalid scheduled_at format. Expected ISO format.'}), 400
 
-        new_consultation = db.create_consultation(data)
+        allow_overlap = bool(data.pop('allow_overlap', False))
+        # Held across the check and the insert so two requests cannot book the same slot
+        with appointment_index.booking(user['id']):
+            conflicts = [] if allow_overlap else find_booking_conflicts(user['id'], data)
+            if conflicts is None:
+                return jsonify({'success': False, 'error': 'Could not check the calendar for conflicts; please retry.'}), 503
+            if conflicts:
+                return jsonify({
+                    'success': False,
+                    'error': 'You already have a consultation at this time. Resend with allow_overlap to book anyway.',
+                    'conflicts': conflicts
+                }), 409
+            new_consultation = db.create_consultation(data)
+            saved = new_consultation if isinstance(new_consultation, dict) else data
+            if new_consultation:
+                track_write(appointment_index, 'upsert', saved, user['id'])
 
         if new_consultation:
             app.logger.info(f"Consultation created for patient {data['patient_id']} by doctor {data['doctor_id']}.")
+            urgent_cases_watcher.invalidate(user['id'])
+            track_write(analytics_rollups, 'consultation_saved', saved)
+            track_write(doctor_metrics, 'consultation_saved', saved, user['id'])
             return jsonify({'success': True, 'consultation': new_consultation}), 201
         else:
             app.logger.error(f"Failed to create consultation.")
@@ -1296,10 +2425,32 @@ def update_consultation(consultation_id):
             return jsonify({'error': 'Permission denied. Only doctors can update consultations.'}), 403
 
         update_data = request.get_json()
-
-        updated_consultation = db.update_consultation(consultation_id, update_data)
+        allow_overlap = bool(update_data.pop('allow_overlap', False))
+
+        # Conflicts are checked in the calendar the consultation belongs to (or moves to), not the editor's
+        current = get_indexed_appointment(consultation_id, user_session['id'])
+        owner_id = update_data.get('doctor_id') or current.get('doctor_id') or user_session['id']
+        with appointment_index.booking(owner_id):
+            if not allow_overlap and ('scheduled_at' in update_data or 'duration_minutes' in update_data or 'doctor_id' in update_data):
+                conflicts = find_booking_conflicts(owner_id, {**current, **update_data}, exclude_id=consultation_id)
+                if conflicts is None:
+                    return jsonify({'error': 'Could not check the calendar for conflicts; please retry.'}), 503
+                if conflicts:
+                    return jsonify({
+                        'error': 'You already have a consultation at this time. Resend with allow_overlap to move it anyway.',
+                        'conflicts': conflicts
+                    }), 409
+            updated_consultation = db.update_consultation(consultation_id, update_data)
+            saved = {**update_data, 'id': consultation_id, **(updated_consultation if isinstance(updated_consultation, dict) else {})}
+            if updated_consultation:
+                track_write(appointment_index, 'upsert', saved, owner_id)
 
         if updated_consultation:
+            urgent_cases_watcher.invalidate(owner_id)
+            if current.get('doctor_id') not in (None, owner_id):
+                urgent_cases_watcher.invalidate(current['doctor_id'])
+            track_write(analytics_rollups, 'consultation_saved', saved, update_data)
+            track_write(doctor_metrics, 'consultation_saved', saved, owner_id)
             return jsonify({'success': True, 'message': 'Consultation updated successfully', 'consultation': updated_consultation}), 200
         else:
             return jsonify({'error': 'Failed to update consultation.'}), 500
@@ -1313,15 +2464,112 @@ def update_consultation(consultation_id):
 
 @app.route('/api/health-monitoring/alerts', methods=['GET'])
 def get_health_alerts():
-    """Get real-time health alerts."""
+    """Get real-time health alerts: those raised by the vitals rule engine, then any stored in the database."""
     try:
         # Authentication and authorization logic
-        alerts = db.get_health_alerts() # Assuming this function exists
+        limit = max(1, min(request.args.get('limit', default=100, type=int), 1000))
+        patient_id = request.args.get('patient_id')
+        vitals_alerts = vitals_store.recent_alerts(limit, [patient_id] if patient_id else None)
+        alerts = vitals_alerts + list(db.get_health_alerts() or []) # Assuming this function exists
         return jsonify({'success': True, 'alerts': alerts}), 200
     except Exception as e:
         logger.error(f"Error getting health alerts: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch health alerts.'}), 500
 
+def ensure_vitals_series(patient_id):
+    """Build a patient's time series on first use from the vitals store and legacy per-record vitals_data.
+
+    The series store runs this once per patient across processes, under that
+    patient's own lock, so the database fetch never holds up other patients.
+    """
+    def load_history():
+        legacy = [
+            {**record['vitals_data'], 'patient_id': patient_id, 'timestamp': record.get('record_date')}
+            for record in (db.get_medical_records(patient_id) or [])
+            if record.get('record_type') == 'Vitals' and isinstance(record.get('vitals_data'), dict)
+        ]
+        if legacy:
+            accepted, _ = validate_vitals_batch(legacy)
+            vitals_store.insert_frame(accepted)
+        return vitals_store.query(patient_id)
+
+    vitals_series.ensure_patient(patient_id, load_history)
+
+def store_vitals_readings(readings):
+    """Validate and store a batch of vitals readings and run the alert rules over it.
+
+    Returns (stored DataFrame, rejected list, new alerts).
+    """
+    accepted, rejected = validate_vitals_batch(readings)
+    # Backfill first, so a patient's history is in the series before any of these readings
+    for patient_id in accepted['patient_id'].unique():
+        ensure_vitals_series(patient_id)
+    # Serialized so the rule engine sees each patient's readings in order. Only readings the
+    # store did not already hold go into the series: retries and readings the backfill just
+    # copied (a legacy record created for this very reading) would otherwise be counted twice
+    with vitals_ingest_lock:
+        vitals_series.append_frame(vitals_store.insert_frame(accepted))
+        alerts = vitals_store.insert_alerts(vitals_rules.evaluate(accepted))
+    for alert in alerts:
+        logger.warning(f"Vitals alert for patient {alert['patient_id']}: {alert['message']} (value {alert['value']}).")
+    if alerts:
+        # The feed publishes them here now and in other workers on their next poll
+        alert_feed.poll_now()
+    return accepted, rejected, alerts
+
+@app.route('/api/vitals/bulk', methods=['POST', 'OPTIONS'])
+@idempotent
+def bulk_ingest_vitals():
+    """Ingest many timestamped vitals readings at once: {'readings': [{patient_id, timestamp, heart_rate, ...}]}."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    started = time.perf_counter()
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can add vitals.'}), 403
+
+        data = request.get_json(silent=True) or {}
+        readings = data.get('readings')
+        if not isinstance(readings, list) or not all(isinstance(r, dict) for r in readings):
+            return jsonify({'error': 'readings must be a list of objects.'}), 400
+        if len(readings) > app.config['VITALS_BULK_MAX_READINGS']:
+            return jsonify({'error': f"At most {app.config['VITALS_BULK_MAX_READINGS']} readings per request."}), 413
+
+        accepted, rejected, alerts = store_vitals_readings(readings)
+        elapsed = time.perf_counter() - started
+        latency_metrics.record('vitals_bulk_ingest_ms', elapsed * 1000.0)
+        return jsonify({
+            'success': True,
+            'accepted': len(accepted),
+            'rejected_count': len(rejected),
+            'rejected': rejected[:100],
+            'alerts': alerts,
+            'elapsed_ms': round(elapsed * 1000.0, 2),
+            'readings_per_sec': round(len(readings) / elapsed, 1) if elapsed > 0 else None
+        }), 200 if not rejected else 207
+    except Exception as e:
+        logger.error(f"Error ingesting vitals: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to ingest vitals.'}), 500
+
+@app.route('/api/vitals/ingest-stats', methods=['GET'])
+def get_vitals_ingest_stats():
+    """Vitals store size and ingestion throughput."""
+    try:
+        return jsonify({
+            'success': True,
+            'store': vitals_store.stats(),
+            'latency': latency_metrics.summary('vitals_bulk_ingest_ms')
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting vitals ingest stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch vitals ingest stats.'}), 500
+
 # ==================== ERROR HANDLERS ====================
 
 @app.errorhandler(404)
@@ -1365,6 +2613,9 @@ def gemini_voice_audio():
         recognizer = sr.Recognizer()
         with sr.AudioFile(audio_file) as source:
             audio_data = recognizer.record(source)
+        if speech_recognizer is not None:
+            text = speech_recognizer.transcribe_pcm(audio_data.get_raw_data(convert_rate=speech_recognizer.sample_rate, convert_width=2))
+        else:
             text = recognizer.recognize_google(audio_data) # Using Google Web Speech API for example
         
         response = f"Gemini assistant processed your audio: '{text}'. (Placeholder response)"
@@ -1373,6 +2624,43 @@ def gemini_voice_audio():
         logger.error(f"Gemini voice audio processing error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to process audio for Gemini.'}), 500
 
+@app.route('/api/gemini/voice-stream', methods=['POST'])
+def gemini_voice_stream():
+    """Stream raw 16-bit mono PCM in the request body (chunked); transcripts come back as Server-Sent Events while audio arrives."""
+    if speech_recognizer is None:
+        return jsonify({'error': 'Streaming speech recognition is not enabled (set SPEECH_RECOGNIZER=offline).'}), 503
+
+    sample_rate = request.args.get('sample_rate', type=int) or speech_recognizer.sample_rate
+    if sample_rate != speech_recognizer.sample_rate:
+        return jsonify({'error': f'Audio must be 16-bit mono PCM at {speech_recognizer.sample_rate} Hz.'}), 400
+
+    return Response(stream_with_context(stream_voice_events(request.stream)),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def stream_voice_events(audio_stream):
+    """Yield 'partial' and 'final' transcript events as the body is read, then a 'result' event."""
+    try:
+        transcription = speech_recognizer.create_stream()
+        max_bytes = app.config['SPEECH_STREAM_MAX_SECONDS'] * speech_recognizer.sample_rate * 2
+        received = 0
+        while received < max_bytes:
+            chunk = audio_stream.read(min(app.config['SPEECH_STREAM_READ_SIZE'], max_bytes - received))
+            if not chunk:
+                break
+            received += len(chunk)
+            for event in transcription.feed(chunk):
+                yield format_sse({'text': event['text']}, event=event['type'])
+
+        result = transcription.finish()
+        for event in result.pop('events'):
+            yield format_sse({'text': event['text']}, event=event['type'])
+        result['truncated'] = received >= max_bytes
+        result['response'] = f"Gemini assistant processed your audio: '{result['text']}'. (Placeholder response)"
+        yield format_sse(result, event='result')
+    except Exception as e:
+        logger.error(f"Streaming voice recognition error: {str(e)}", exc_info=True)
+        yield format_sse({'error': 'Failed to process audio stream.'}, event='error')
+
 
 # ==================== USER PROFILE ROUTES ====================
 
@@ -1581,21 +2869,22 @@ def get_doctor_appointments():
         doctor_id = user_session['id']
         time_range = request.args.get('time_range', 'today') # 'today', 'upcoming', 'past'
 
-        appointments = []
-        # Corrected: Need to handle the complex query in supabase_client.py if embedding users from two foreign keys
         # For now, simplifying to just fetch consultations, frontend will resolve patient names.
+        start, end = None, None # None means no lower / upper limit
         if time_range == 'today':
-            today_start = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = datetime.now(pytz.utc).replace(hour=23, minute=59, second=59, microsecond=999999)
-            appointments = db.get_doctor_appointments(doctor_id, today_start.isoformat(), today_end.isoformat())
+            start = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            end = datetime.now(pytz.utc).replace(hour=23, minute=59, second=59, microsecond=999999)
         elif time_range == 'upcoming':
-            now = datetime.now(pytz.utc)
-            appointments = db.get_doctor_appointments(doctor_id, now.isoformat(), None) # None for end_date means no upper limit
+            start = datetime.now(pytz.utc)
         elif time_range == 'past':
-            now = datetime.now(pytz.utc)
-            appointments = db.get_doctor_appointments(doctor_id, None, now.isoformat()) # None for start_date means no lower limit
-        else:
-            appointments = db.get_doctor_appointments(doctor_id) # Get all if invalid range
+            end = datetime.now(pytz.utc)
+        # Any other range returns everything
+
+        try:
+            appointments = appointment_index.range(doctor_id, start and start.timestamp(), end and end.timestamp())
+        except Exception as e:
+            app.logger.warning(f"Appointment index unavailable for doctor {doctor_id}, querying the database: {e}")
+            appointments = db.get_doctor_appointments(doctor_id, start and start.isoformat(), end and end.isoformat())
 
         return jsonify({'success': True, 'appointments': appointments}), 200
 
@@ -1654,18 +2943,163 @@ def get_doctor_urgent_cases():
         app.logger.error(f"Error fetching urgent cases for doctor: {e}", exc_info=True)
         return jsonify({'error': 'Failed to fetch urgent cases'}), 500
 
+def stream_doctor_events(doctor_id, last_event_id):
+    """SSE generator for one doctor's dashboard: replay or snapshot, then live events with heartbeats."""
+    subscription, resumed = event_hub.subscribe(doctor_id, last_event_id)
+    try:
+        yield format_sse({'last_event_id': last_event_id, 'resumed': resumed}, event='hello', retry=app.config['EVENT_RETRY_MS'])
+        if not resumed:
+            # First connection, or the client missed more than the replay buffer holds: send full state.
+            # The snapshot carries the current event id so a client reconnecting afterwards resumes from here.
+            snapshot_id = event_hub.last_event_id()
+            yield format_sse({
+                'alerts': vitals_store.recent_alerts(100) + list(db.get_health_alerts() or []),
+                'urgent_cases': db.get_urgent_cases_for_doctor(doctor_id),
+            }, event='snapshot', event_id=snapshot_id)
+        while True:
+            item = subscription.get(timeout=app.config['SSE_HEARTBEAT_INTERVAL'])
+            if subscription.overflowed:
+                # Too slow to keep up: end the stream; EventSource reconnects with Last-Event-ID and replays
+                yield format_sse({'reason': 'client fell behind'}, event='overflow')
+                return
+            if item is None:
+                yield format_sse_comment('heartbeat')
+                continue
+            yield format_sse(item['data'], event=item['event'], event_id=item['id'])
+    except Exception as e:
+        logger.error(f"Error in event stream for doctor {doctor_id}: {str(e)}", exc_info=True)
+        yield format_sse({'error': 'Event stream failed'}, event='error')
+    finally:
+        event_hub.unsubscribe(subscription)
+
+@app.route('/api/doctor/events/ticket', methods=['POST', 'OPTIONS'])
+def issue_doctor_event_ticket():
+    """Exchange the bearer token for a short-lived, single-use ticket to open the event stream with."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can subscribe to alerts.'}), 403
+
+        ticket = event_stream_tickets.issue(user_session['id'])
+        return jsonify({'success': True, 'ticket': ticket, 'expires_in': app.config['EVENT_TICKET_TTL']}), 200
+    except Exception as e:
+        logger.error(f"Error issuing doctor event stream ticket: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to issue event stream ticket.'}), 500
+
+@app.route('/api/doctor/events', methods=['GET', 'OPTIONS'])
+def doctor_event_stream():
+    """Server-Sent Events feed of new health alerts and urgent-case changes, replacing polling of both endpoints.
+
+    EventSource cannot set headers, so it passes ?ticket= from
+    /api/doctor/events/ticket instead of its bearer token. Tickets are
+    single-use: to reconnect, the client fetches a new one and passes the
+    last id it saw as ?last_event_id=. Tickets and alerts are shared through
+    SQLite, so any worker can serve the stream; a reconnect landing on another
+    worker gets a fresh snapshot, and clients should dedupe alerts by alert_id.
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if auth_header:
+            token = auth_header.split(" ")[1]
+            user_session = db.get_user_by_token(token)
+            if not user_session or user_session.get('role') != 'doctor':
+                return jsonify({'error': 'Permission denied. Only doctors can subscribe to alerts.'}), 403
+            doctor_id = user_session['id']
+        elif request.args.get('ticket'):
+            doctor_id = event_stream_tickets.redeem(request.args.get('ticket'))
+            if doctor_id is None:
+                return jsonify({'error': 'Event stream ticket is invalid, expired or already used.'}), 401
+        else:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        return Response(stream_with_context(stream_doctor_events(doctor_id, last_event_id)),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+    except Exception as e:
+        logger.error(f"Error opening doctor event stream: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to open event stream.'}), 500
+
+@app.route('/api/doctor/events/stats', methods=['GET'])
+def doctor_event_stats():
+    """Subscriber, replay-buffer and overflow counters of the doctor event hub."""
+    try:
+        return jsonify({'success': True, 'stats': event_hub.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting doctor event stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch event stats.'}), 500
+
 @app.route('/api/doctor/ai-insights', methods=['GET', 'OPTIONS'])
 def get_doctor_ai_insights():
+    """The doctor's patients ranked by model risk, as precomputed by the last completed nightly scoring run."""
+    if request.method == 'OPTIONS':
+        return '', 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can view AI insights.'}), 403
+
+        limit = max(1, min(request.args.get('limit', default=50, type=int), 500))
+        run, insights = risk_store.doctor_rankings(user_session['id'], limit)
+        return jsonify({'success': True, 'insights': insights, 'run': run}), 200
+    except Exception as e:
+        app.logger.error(f"Error fetching AI insights for doctor: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch AI insights'}), 500
+
+@app.route('/api/doctor/ai-insights/refresh', methods=['POST', 'OPTIONS'])
+def refresh_doctor_ai_insights():
+    """Start (or resume) a risk scoring run now instead of waiting for the nightly one."""
     if request.method == 'OPTIONS':
         return '', 200
-    # TODO: Replace with real logic
-    return jsonify({'insights': []}), 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can refresh AI insights.'}), 403
+
+        if risk_scoring_job.running:
+            return jsonify({'error': 'A risk scoring run is already in progress.'}), 409
+        threading.Thread(target=risk_scoring_job.run, name='risk-scoring-manual', daemon=True).start()
+        return jsonify({'success': True, 'message': 'Risk scoring started.'}), 202
+    except Exception as e:
+        app.logger.error(f"Error starting risk scoring: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to start risk scoring'}), 500
 @app.route('/api/doctor/performance-metrics', methods=['GET', 'OPTIONS'])
 def get_doctor_performance_metrics():
+    """Completed consultations, no-show rate, median time to completion and records authored over 7/30/90 days."""
     if request.method == 'OPTIONS':
         return '', 200
-    # TODO: Replace with real logic
-    return jsonify({'metrics': []}), 200
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required', 'redirect': '/auth/login'}), 401
+
+        token = auth_header.split(" ")[1]
+        user_session = db.get_user_by_token(token)
+        if not user_session or user_session.get('role') != 'doctor':
+            return jsonify({'error': 'Permission denied. Only doctors can view performance metrics.'}), 403
+
+        return jsonify({'success': True, 'metrics': doctor_metrics.metrics(user_session['id'])}), 200
+    except Exception as e:
+        app.logger.error(f"Error fetching doctor performance metrics: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to fetch performance metrics'}), 500
 
 @app.route('/api/patients', methods=['POST'])
 def add_patient():
@@ -1702,6 +3136,7 @@ def add_patient():
         }
         new_patient = db.create_user(patient_data)
         if new_patient:
+            track_write(analytics_rollups, 'user_created', new_patient)
             return jsonify({'success': True, 'patient': new_patient}), 201
         else:
             return jsonify({'error': 'Failed to add patient.'}), 500
@@ -0,0 +1,225 @@
+"""
+Vectorized anemia screening over conjunctiva photos, and the tool that fits its classifier.
+
+Fit and evaluate the pallor feature classifier from a folder with one
+sub-folder per label (Anemic/ and Non-Anemic/, or Normal/):
+
+    python -m backend.anemia_batch --images data/conjunctiva --output models/anemia_features.joblib
+
+The held-out metrics are printed and saved next to the model as
+<output>.metrics.json. The app loads ANEMIA_FEATURE_MODEL_PATH, which
+defaults to that output path.
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import cv2
+import joblib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FEATURE_NAMES = ['erythema_index', 'redness_ratio', 'a_star', 'lightness', 'tissue_fraction']
+POSITIVE_LABELS = ('anemic', 'anemia')
+NEGATIVE_LABELS = ('non-anemic', 'non_anemic', 'nonanemic', 'normal', 'healthy')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class BatchAnemiaDetector:
+    """Vectorized conjunctival pallor screening over many eye photos at once.
+
+    Each image is first cropped to the region where the lower palpebral
+    conjunctiva sits in a screening photo and resized to a common ROI size.
+    All ROIs are then stacked into one (N, H, W, 3) array. Colour and pallor
+    features are computed with numpy over the whole batch in one pass, with
+    no per-image Python loop over pixels.
+
+    Classification needs a trained joblib feature model over these features
+    (e.g. scikit-learn with predict_proba), fitted with this module's CLI.
+    There is no uncalibrated fallback: without a model, available is False
+    and detect_batch raises, so the endpoint reports the service as
+    unavailable instead of returning guesses as diagnoses.
+    """
+
+    def __init__(self, roi_size=(128, 64), roi_box=(0.45, 0.9, 0.15, 0.85), min_tissue_fraction=0.05,
+                 feature_model_path=None):
+        self.roi_size = roi_size  # (width, height) every ROI is resized to
+        self.roi_box = roi_box  # (top, bottom, left, right) as fractions of the image
+        self.min_tissue_fraction = min_tissue_fraction
+        self.feature_model = None
+        if feature_model_path and not os.path.exists(feature_model_path):
+            logger.info(f"No anemia feature model at {feature_model_path}; fit one with python -m backend.anemia_batch.")
+        elif feature_model_path:
+            try:
+                self.feature_model = joblib.load(feature_model_path)
+            except Exception as e:
+                logger.warning(f"Could not load anemia feature model {feature_model_path}; batch screening is disabled: {e}")
+
+    @property
+    def available(self):
+        return self.feature_model is not None
+
+    def crop_roi(self, image):
+        """Crop the conjunctiva region and resize it to the common ROI size."""
+        height, width = image.shape[:2]
+        top, bottom, left, right = self.roi_box
+        roi = image[int(height * top):max(int(height * bottom), int(height * top) + 1),
+                    int(width * left):max(int(width * right), int(width * left) + 1)]
+        return cv2.resize(roi, self.roi_size, interpolation=cv2.INTER_AREA)
+
+    def extract_features(self, rois):
+        """Compute pallor features for a stacked (N, H, W, 3) uint8 BGR ROI batch -> (N, F) float32."""
+        n, h, w, _ = rois.shape
+        bgr = rois.astype(np.float32)
+        b, g, r = bgr[..., 0], bgr[..., 1], bgr[..., 2]
+
+        # Conjunctival tissue is red-dominant; ignore sclera, lashes and skin
+        tissue = (r > g * 1.1) & (r > b * 1.1) & (r > 40)
+        tissue_count = tissue.sum(axis=(1, 2))
+        safe_count = np.maximum(tissue_count, 1)
+
+        def masked_mean(values):
+            return (values * tissue).sum(axis=(1, 2)) / safe_count
+
+        # One cvtColor call converts the whole batch: (N*H, W, 3) is a valid image
+        lab = cv2.cvtColor(rois.reshape(n * h, w, 3), cv2.COLOR_BGR2LAB).reshape(n, h, w, 3).astype(np.float32)
+
+        erythema_index = masked_mean(100.0 * (np.log1p(r) - np.log1p(g)))
+        redness_ratio = masked_mean(r / np.maximum(r + g + b, 1.0))
+        a_star = masked_mean(lab[..., 1] - 128.0)
+        lightness = masked_mean(lab[..., 0] * (100.0 / 255.0))
+        tissue_fraction = tissue_count / float(h * w)
+
+        return np.stack([erythema_index, redness_ratio, a_star, lightness, tissue_fraction], axis=1).astype(np.float32)
+
+    def predict_proba(self, features):
+        """Probability of anemia for each feature row."""
+        if self.feature_model is None:
+            raise RuntimeError('No anemia feature model is loaded.')
+        return self.feature_model.predict_proba(features)[:, 1]
+
+    def detect_batch(self, images):
+        """Screen a list of decoded BGR images. Returns one result dict per input, in order.
+
+        Entries that are None (undecodable uploads) get an error result.
+        """
+        results = [None] * len(images)
+        valid = [i for i, image in enumerate(images) if image is not None]
+        for i in range(len(images)):
+            if images[i] is None:
+                results[i] = {'success': False, 'type': 'eye', 'error': 'Could not decode image.'}
+        if not valid:
+            return results
+
+        rois = np.stack([self.crop_roi(images[i]) for i in valid])
+        features = self.extract_features(rois)
+        probabilities = self.predict_proba(features)
+        roi_detected = features[:, 4] >= self.min_tissue_fraction
+
+        for row, i in enumerate(valid):
+            if not roi_detected[row]:
+                results[i] = {'success': False, 'type': 'eye', 'roi_detected': False,
+                              'error': 'Conjunctiva region not detected. Pull down the lower eyelid and retake the photo.'}
+                continue
+            anemic = probabilities[row] >= 0.5
+            results[i] = {
+                'success': True,
+                'type': 'eye',
+                'prediction': 'Anemic' if anemic else 'Non-Anemic',
+                'confidence': round(float(probabilities[row] if anemic else 1.0 - probabilities[row]) * 100, 2),
+                'roi_detected': True,
+                'features': {name: round(float(features[row, j]), 4) for j, name in enumerate(FEATURE_NAMES)}
+            }
+        return results
+
+
+def load_labelled_features(detector, directory, working_size=224):
+    """Pallor features and labels (1 = anemic) for the photos in directory's label sub-folders.
+
+    Photos where no conjunctiva is detected are skipped, as the endpoint
+    would reject them too.
+    """
+    features, labels = [], []
+    for folder in sorted(os.listdir(directory)):
+        path = os.path.join(directory, folder)
+        if not os.path.isdir(path):
+            continue
+        name = folder.lower()
+        if name in POSITIVE_LABELS:
+            label = 1
+        elif name in NEGATIVE_LABELS:
+            label = 0
+        else:
+            raise ValueError(f"Unknown label folder '{folder}'; expected one of {POSITIVE_LABELS + NEGATIVE_LABELS}.")
+        rois = []
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(path, file_name), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            scale = working_size / float(max(image.shape[:2]))
+            if scale < 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            rois.append(detector.crop_roi(image))
+        if not rois:
+            continue
+        batch = detector.extract_features(np.stack(rois))
+        batch = batch[batch[:, 4] >= detector.min_tissue_fraction]
+        features.append(batch)
+        labels.extend([label] * len(batch))
+    if not features:
+        raise ValueError(f"No usable photos under {directory}.")
+    return np.concatenate(features), np.asarray(labels)
+
+
+def fit_feature_model(features, labels, test_size=0.25, seed=0):
+    """Fit a scaled logistic regression over the pallor features. Returns (model, held-out metrics)."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import confusion_matrix, roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    def build():
+        return make_pipeline(StandardScaler(), LogisticRegression(class_weight='balanced', max_iter=1000))
+
+    x_train, x_test, y_train, y_test = train_test_split(features, labels, test_size=test_size, stratify=labels, random_state=seed)
+    probabilities = build().fit(x_train, y_train).predict_proba(x_test)[:, 1]
+    tn, fp, fn, tp = confusion_matrix(y_test, probabilities >= 0.5, labels=[0, 1]).ravel()
+    metrics = {
+        'train_images': int(len(y_train)),
+        'test_images': int(len(y_test)),
+        'accuracy': round(float((tp + tn) / len(y_test)), 4),
+        'sensitivity': round(float(tp / (tp + fn)), 4) if tp + fn else None,
+        'specificity': round(float(tn / (tn + fp)), 4) if tn + fp else None,
+        'roc_auc': round(float(roc_auc_score(y_test, probabilities)), 4),
+    }
+    # The served model is refitted on every photo once the held-out numbers are known
+    return build().fit(features, labels), metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit and evaluate the anemia pallor feature classifier.')
+    parser.add_argument('--images', required=True, help='Folder with one sub-folder per label (Anemic/, Non-Anemic/)')
+    parser.add_argument('--output', default=os.path.join('models', 'anemia_features.joblib'))
+    parser.add_argument('--test-size', type=float, default=0.25)
+    parser.add_argument('--working-size', type=int, default=224)
+    args = parser.parse_args()
+
+    detector = BatchAnemiaDetector()
+    features, labels = load_labelled_features(detector, args.images, args.working_size)
+    model, metrics = fit_feature_model(features, labels, test_size=args.test_size)
+    metrics['features'] = FEATURE_NAMES
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    joblib.dump(model, args.output)
+    with open(args.output + '.metrics.json', 'w') as f:
+        json.dump(metrics, f, indent=2)
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == '__main__':
+    main()
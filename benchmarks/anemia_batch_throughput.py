@@ -0,0 +1,97 @@
+"""
+Throughput benchmark for BatchAnemiaDetector.
+
+Runs N synthetic eye photos (or a folder of real ones) through ROI cropping
+and pallor feature extraction one image per call, then in vectorized
+batches, and reports images per second for each. With --feature-model the
+trained classifier is included and the full screening path is timed.
+
+    python benchmarks/anemia_batch_throughput.py --count 1000 --batch-size 256
+    python benchmarks/anemia_batch_throughput.py --images data/conjunctiva --feature-model models/anemia_features.joblib
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.anemia_batch import BatchAnemiaDetector  # noqa: E402
+from utils.image_utils import downscale_image  # noqa: E402
+
+
+def synthetic_images(count, size=(480, 640), seed=0):
+    """Sclera-white frames with a pink conjunctiva band of varying redness."""
+    rng = np.random.default_rng(seed)
+    height, width = size
+    images = []
+    for _ in range(count):
+        image = np.full((height, width, 3), 225, dtype=np.uint8)
+        redness = rng.uniform(140, 230)
+        band = image[int(height * 0.55):int(height * 0.85), int(width * 0.2):int(width * 0.8)]
+        band[...] = (rng.uniform(90, 130), rng.uniform(90, 140), redness)
+        noise = rng.integers(-12, 12, size=image.shape, dtype=np.int16)
+        images.append(np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return images
+
+
+def load_images(directory, working_size):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(downscale_image(image, working_size))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--images', help='Optional folder of real photos instead of synthetic ones')
+    parser.add_argument('--working-size', type=int, default=224)
+    parser.add_argument('--feature-model', help='Trained joblib classifier over pallor features')
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.working_size) if args.images else [
+        downscale_image(image, args.working_size) for image in synthetic_images(args.count)
+    ]
+    detector = BatchAnemiaDetector(feature_model_path=args.feature_model)
+    if detector.available:
+        run = detector.detect_batch
+    else:
+        def run(batch):
+            return detector.extract_features(np.stack([detector.crop_roi(image) for image in batch]))
+    run(images[:8])  # warm-up
+
+    started = time.perf_counter()
+    for image in images:
+        run([image])
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = []
+    for i in range(0, len(images), args.batch_size):
+        results.extend(run(images[i:i + args.batch_size]))
+    batched_seconds = time.perf_counter() - started
+
+    report = {
+        'images': len(images),
+        'batch_size': args.batch_size,
+        'stage': 'screening' if detector.available else 'features_only',
+        'per_image_calls_images_per_s': round(len(images) / single_seconds, 1),
+        'batched_images_per_s': round(len(images) / batched_seconds, 1),
+        'speedup': round(single_seconds / batched_seconds, 2),
+    }
+    if detector.available:
+        report['anemic_fraction'] = round(sum(r.get('prediction') == 'Anemic' for r in results) / len(results), 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
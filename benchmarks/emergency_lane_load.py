@@ -0,0 +1,152 @@
+"""
+Load test for the emergency priority lane.
+
+Serves a stand-in WSGI app from a fixed pool of server threads, as a
+threaded gunicorn worker would. AI requests spend most of their time in
+slow model calls; emergency requests are a short database write. The
+test measures emergency latency in three runs:
+  * idle: no AI load
+  * saturated without lanes: the AI endpoints are hammered
+  * saturated with lanes: the same load, behind PriorityLaneMiddleware
+
+Lane limits default to the shipped configuration (SERVER_THREADS=8,
+EMERGENCY_RESERVED_THREADS=2, HEAVY_MAX_CONCURRENT=4, HEAVY_MAX_QUEUED=1).
+
+    python benchmarks/emergency_lane_load.py --server-threads 8 --ai-clients 32 --duration 10
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.priority_lanes import PriorityLaneMiddleware  # noqa: E402
+from utils.metrics import LatencyMetrics  # noqa: E402
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """Handles connections on a fixed number of threads; the rest wait in the pool's queue."""
+
+    daemon_threads = True
+    request_queue_size = 256
+    pool_size = 8
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, '_pool'):
+            self._pool = ThreadPoolExecutor(max_workers=self.pool_size)
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def make_app(ai_ms, emergency_ms):
+    matrix = np.random.default_rng(0).random((256, 256))
+
+    def app(environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith('/api/ai/'):
+            time.sleep(ai_ms / 1000.0)  # remote model call / GIL-releasing inference
+            matrix @ matrix
+        else:
+            time.sleep(emergency_ms / 1000.0)  # alert insert
+        body = b'{"success": true}'
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    return app
+
+
+def ai_client(url, stop, counts):
+    while not stop.is_set():
+        try:
+            with urllib.request.urlopen(url, data=b'{}', timeout=60) as response:
+                response.read()
+            counts['ok'] += 1
+        except urllib.error.HTTPError as e:
+            counts['rejected' if e.code == 503 else 'error'] += 1
+            time.sleep(float(e.headers.get('Retry-After', 1)) / 10.0)
+        except Exception:
+            counts['error'] += 1
+
+
+def run_scenario(args, use_lanes, ai_load):
+    metrics = LatencyMetrics()
+    app = make_app(args.ai_ms, args.emergency_ms)
+    lanes = None
+    if use_lanes:
+        lanes = app = PriorityLaneMiddleware(
+            app, heavy_prefixes=('/api/ai/',), server_threads=args.server_threads, reserved_threads=args.reserved_threads,
+            heavy_max_concurrent=args.heavy_concurrent, heavy_max_queued=args.heavy_queued,
+            heavy_queue_timeout=args.heavy_queue_timeout, metrics=LatencyMetrics()
+        )
+
+    PooledWSGIServer.pool_size = args.server_threads
+    server = make_server('127.0.0.1', 0, app, server_class=PooledWSGIServer, handler_class=QuietHandler)
+    base = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop = threading.Event()
+    counts = {'ok': 0, 'rejected': 0, 'error': 0}
+    clients = [threading.Thread(target=ai_client, args=(f"{base}/api/ai/symptom-analysis", stop, counts), daemon=True)
+               for _ in range(args.ai_clients if ai_load else 0)]
+    for client in clients:
+        client.start()
+    time.sleep(1.0 if ai_load else 0.0)  # let the AI load build up
+
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        with urllib.request.urlopen(f"{base}/api/emergency/alert", data=b'{}', timeout=60) as response:
+            response.read()
+        metrics.record('emergency_ms', (time.perf_counter() - started) * 1000.0)
+        time.sleep(args.emergency_interval_ms / 1000.0)
+
+    stop.set()
+    server.shutdown()
+    summary = metrics.summary('emergency_ms')
+    return {
+        'emergency_ms': {k: summary[k] for k in ('count', 'p50', 'p99', 'max')},
+        'ai_requests_per_s': round(counts['ok'] / (args.duration + (1.0 if ai_load else 0.0)), 1),
+        'ai_rejected': counts['rejected'],
+        'lanes': lanes.stats()['heavy'] if lanes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server-threads', type=int, default=8)
+    parser.add_argument('--ai-clients', type=int, default=32)
+    parser.add_argument('--ai-ms', type=float, default=500)
+    parser.add_argument('--emergency-ms', type=float, default=5)
+    parser.add_argument('--emergency-interval-ms', type=float, default=50)
+    # Lane defaults are the shipped config.py defaults
+    parser.add_argument('--reserved-threads', type=int, default=2)
+    parser.add_argument('--heavy-concurrent', type=int, default=4)
+    parser.add_argument('--heavy-queued', type=int, default=1)
+    parser.add_argument('--heavy-queue-timeout', type=float, default=5)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'idle': run_scenario(args, use_lanes=True, ai_load=False),
+        'saturated_without_lanes': run_scenario(args, use_lanes=False, ai_load=True),
+        'saturated_with_lanes': run_scenario(args, use_lanes=True, ai_load=True),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
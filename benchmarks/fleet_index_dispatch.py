@@ -0,0 +1,130 @@
+"""
+Benchmark for FleetSpatialIndex.
+
+Places N ambulances across a metro-sized box, then measures:
+  * position updates per second (units moving a few hundred metres)
+  * k-nearest-available queries per second with a capability filter,
+    compared with a linear scan over every unit
+  * query latency while another thread streams position updates
+
+    python benchmarks/fleet_index_dispatch.py --units 10000 --updates 200000 --queries 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fleet_index import FleetSpatialIndex, haversine_km  # noqa: E402
+from utils.metrics import LatencyMetrics  # noqa: E402
+
+CAPABILITIES = [['medical'], ['medical', 'cardiac'], ['medical', 'accident'], ['medical', 'cardiac', 'accident']]
+EMERGENCY_TYPES = ['medical', 'cardiac', 'accident']
+
+
+def random_point(rng, box):
+    lat0, lng0, span = box
+    return lat0 + rng.random() * span, lng0 + rng.random() * span
+
+
+def linear_scan(units, lat, lng, k, capability):
+    candidates = [
+        (haversine_km(lat, lng, u['lat'], u['lng']), unit_id)
+        for unit_id, u in units.items() if u['available'] and capability in u['capabilities']
+    ]
+    candidates.sort()
+    return [unit_id for _, unit_id in candidates[:k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--units', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--span-deg', type=float, default=0.6, help='Side of the service area in degrees (~65 km)')
+    parser.add_argument('--cell-deg', type=float, default=0.01)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    box = (40.45, -74.25, args.span_deg)
+    index = FleetSpatialIndex(args.cell_deg)
+    shadow = {}
+    for unit_id in range(args.units):
+        lat, lng = random_point(rng, box)
+        capabilities = rng.choice(CAPABILITIES)
+        available = rng.random() < 0.6
+        index.upsert(unit_id, lat, lng, capabilities=capabilities, available=available)
+        shadow[unit_id] = {'lat': lat, 'lng': lng, 'capabilities': set(capabilities), 'available': available}
+
+    moves = []
+    for _ in range(args.updates):
+        unit_id = rng.randrange(args.units)
+        moves.append((unit_id, shadow[unit_id]['lat'] + rng.uniform(-0.003, 0.003), shadow[unit_id]['lng'] + rng.uniform(-0.003, 0.003)))
+    started = time.perf_counter()
+    for unit_id, lat, lng in moves:
+        index.update_position(unit_id, lat, lng)
+    update_seconds = time.perf_counter() - started
+    for unit_id, lat, lng in moves:
+        shadow[unit_id]['lat'], shadow[unit_id]['lng'] = lat, lng
+
+    queries = [(random_point(rng, box), rng.choice(EMERGENCY_TYPES)) for _ in range(args.queries)]
+    started = time.perf_counter()
+    results = [index.nearest(lat, lng, k=args.k, capability=capability) for (lat, lng), capability in queries]
+    index_seconds = time.perf_counter() - started
+
+    scan_queries = queries[:max(1, args.queries // 20)]
+    started = time.perf_counter()
+    mismatches = 0
+    for ((lat, lng), capability), found in zip(scan_queries, results):
+        if linear_scan(shadow, lat, lng, args.k, capability) != [u['unit_id'] for u in found]:
+            mismatches += 1
+    scan_seconds = (time.perf_counter() - started) / len(scan_queries) * args.queries
+
+    # Queries while a writer streams position updates as fast as it can
+    stop = threading.Event()
+    written = [0]
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            unit_id, lat, lng = moves[i % len(moves)]
+            index.update_position(unit_id, lat, lng)
+            written[0] += 1
+            i += 1
+
+    metrics = LatencyMetrics(window=args.queries)
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    started = time.perf_counter()
+    for (lat, lng), capability in queries:
+        query_started = time.perf_counter()
+        index.nearest(lat, lng, k=args.k, capability=capability)
+        metrics.record('query_ms', (time.perf_counter() - query_started) * 1000.0)
+    contended_seconds = time.perf_counter() - started
+    stop.set()
+    thread.join()
+
+    latency = metrics.summary('query_ms')
+    print(json.dumps({
+        'units': args.units,
+        'position_updates_per_s': round(args.updates / update_seconds),
+        'index_queries_per_s': round(args.queries / index_seconds),
+        'linear_scan_queries_per_s': round(args.queries / scan_seconds),
+        'speedup': round(scan_seconds / index_seconds, 1),
+        'mismatches_vs_linear_scan': mismatches,
+        'under_update_load': {
+            'updates_per_s': round(written[0] / contended_seconds),
+            'query_p50_ms': latency['p50'],
+            'query_p99_ms': latency['p99'],
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Offline accuracy comparison and latency/memory benchmark: float32 Keras image
+model vs. its quantized TFLite export(s), on a fixed image set.
+
+    python benchmarks/image_model_quantization.py --images data/eval \
+        --float-model models/image_model.h5 \
+        --quantized models/image_model_int8.tflite models/image_model_fp16.tflite
+
+If the image directory has one sub-folder per label (e.g. data/eval/Normal/...),
+accuracy against those labels is reported too; otherwise only agreement with
+the float32 model is reported. Each engine runs in its own process so peak
+RSS is measured independently.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_models.quantization import list_images, load_preprocessed_images  # noqa: E402
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _run_engine(engine, model_path, paths, input_size, batch_size, num_threads, result_queue):
+    from ai_models.batched_image_analyzer import load_keras_model
+    from ai_models.quantization import load_tflite_model
+
+    images = np.stack(load_preprocessed_images(paths, input_size))
+    rss_before_load = _peak_rss_mb()
+
+    started = time.perf_counter()
+    loader = load_keras_model(model_path) if engine == 'float32' else load_tflite_model(model_path, num_threads)
+    model = loader()
+    load_seconds = time.perf_counter() - started
+
+    # Warm up once so graph tracing / tensor allocation is not counted
+    model(images[:1])
+
+    single_latencies = []
+    for image in images:
+        started = time.perf_counter()
+        model(image[np.newaxis])
+        single_latencies.append((time.perf_counter() - started) * 1000.0)
+
+    outputs = []
+    started = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        outputs.append(np.asarray(model(images[i:i + batch_size])))
+    batched_seconds = time.perf_counter() - started
+
+    result_queue.put({
+        'engine': engine,
+        'model_path': model_path,
+        'model_size_mb': round(os.path.getsize(model_path) / (1024 * 1024), 3),
+        'load_seconds': round(load_seconds, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'model_rss_mb': round(_peak_rss_mb() - rss_before_load, 1),
+        'latency_ms_batch1': {
+            'p50': round(float(np.percentile(single_latencies, 50)), 3),
+            'p95': round(float(np.percentile(single_latencies, 95)), 3),
+        },
+        f'throughput_images_per_s_batch{batch_size}': round(len(images) / batched_seconds, 1),
+        'scores': np.concatenate(outputs).reshape(len(images), -1).tolist(),
+    })
+
+
+def run_engine(engine, model_path, paths, args):
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_run_engine, args=(engine, model_path, paths, args.input_size, args.batch_size, args.num_threads, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def as_probabilities(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    if scores.shape[1] == 1:
+        scores = np.hstack([1.0 - scores, scores])
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Fixed evaluation image set')
+    parser.add_argument('--float-model', required=True)
+    parser.add_argument('--quantized', nargs='+', required=True, help='One or more .tflite exports')
+    parser.add_argument('--labels', default='Normal,Abnormal', help='Comma-separated class labels, in model output order')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--input-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--num-threads', type=int, default=0)
+    args = parser.parse_args()
+
+    listed = list_images(args.images, args.limit)
+    # load_preprocessed_images skips unreadable files; drop them here so the score rows,
+    # the ground truth and every engine cover exactly the same images
+    paths = [p for p in listed if cv2.imread(p, cv2.IMREAD_COLOR) is not None]
+    if not paths:
+        sys.exit(f"No readable images found under {args.images}")
+    labels = [label.strip() for label in args.labels.split(',')]
+    # Ground truth comes from the parent folder name, when it is one of the labels
+    truth = [labels.index(os.path.basename(os.path.dirname(p))) if os.path.basename(os.path.dirname(p)) in labels else None for p in paths]
+    has_truth = all(t is not None for t in truth)
+
+    reports = [run_engine('float32', args.float_model, paths, args)]
+    reports += [run_engine('tflite', path, paths, args) for path in args.quantized]
+
+    reference = as_probabilities(reports[0]['scores'])
+    for report in reports:
+        probabilities = as_probabilities(report.pop('scores'))
+        predicted = probabilities.argmax(axis=1)
+        report['top1_agreement_with_float32'] = round(float((predicted == reference.argmax(axis=1)).mean()), 4)
+        report['mean_abs_prob_diff_vs_float32'] = round(float(np.abs(probabilities - reference).mean()), 5)
+        if has_truth:
+            report['accuracy'] = round(float((predicted == np.asarray(truth)).mean()), 4)
+
+    print(json.dumps({'images': len(paths), 'skipped_unreadable': len(listed) - len(paths), 'results': reports}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
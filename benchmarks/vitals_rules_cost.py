@@ -0,0 +1,74 @@
+"""
+Cost of evaluating the vitals alert rules.
+
+Generates synthetic ward readings (mostly normal, with occasional desaturation,
+hypertensive and tachycardic episodes) for many patients. Feeds them through
+VitalsRuleEngine in ingestion-sized batches and reports the evaluation cost
+per 10k readings for each batch size.
+
+    python benchmarks/vitals_rules_cost.py --readings 200000 --patients 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vitals_rules import VitalsRuleEngine  # noqa: E402
+from services.vitals_store import VITAL_FIELDS  # noqa: E402
+
+
+def synthetic_readings(count, patients, seed=0):
+    rng = np.random.default_rng(seed)
+    patient_ids = rng.integers(0, patients, count)
+    frame = pd.DataFrame({
+        'patient_id': [f"patient-{p}" for p in patient_ids],
+        'ts': 1704067200000 + np.arange(count, dtype=np.int64) * 1000,
+        'heart_rate': rng.normal(80, 12, count),
+        'blood_pressure_systolic': rng.normal(125, 18, count),
+        'blood_pressure_diastolic': rng.normal(80, 10, count),
+        'temperature': rng.normal(37.0, 0.6, count),
+        'oxygen_saturation': np.clip(rng.normal(96, 3, count), 70, 100),
+        'respiratory_rate': rng.normal(16, 4, count),
+    })
+    # Monitors do not report every vital every time
+    for field in VITAL_FIELDS:
+        frame.loc[rng.random(count) < 0.2, field] = np.nan
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=200000)
+    parser.add_argument('--patients', type=int, default=500)
+    parser.add_argument('--batch-sizes', default='100,1000,10000,50000')
+    args = parser.parse_args()
+
+    frame = synthetic_readings(args.readings, args.patients)
+    results = []
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        engine = VitalsRuleEngine()
+        alerts = 0
+        started = time.perf_counter()
+        for offset in range(0, len(frame), batch_size):
+            alerts += len(engine.evaluate(frame.iloc[offset:offset + batch_size]))
+        seconds = time.perf_counter() - started
+        results.append({
+            'batch_size': batch_size,
+            'ms_per_10k_readings': round(seconds / len(frame) * 10000 * 1000, 2),
+            'readings_per_s': round(len(frame) / seconds),
+            'alerts': alerts,
+        })
+
+    print(json.dumps({'readings': len(frame), 'patients': args.patients, 'rules': len(VitalsRuleEngine().rules),
+                      'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@ class Config:
     PINATA_API_KEY = os.environ.get('PINATA_API_KEY')
     PINATA_SECRET_KEY = os.environ.get('PINATA_SECRET_KEY')
     PINATA_GATEWAY_URL = os.environ.get('PINATA_GATEWAY_URL') or 'https://gateway.pinata.cloud'
+    PINATA_PIN_FILE_URL = os.environ.get('PINATA_PIN_FILE_URL') or 'https://api.pinata.cloud/pinning/pinFileToIPFS'  # Used for streamed uploads when IPFSService has no pin_file()
     
     # AI Model Configuration
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
@@ -24,12 +25,141 @@ class Config:
     # File Upload Configuration
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max file size
+
+    # Resumable Upload Configuration
+    RESUMABLE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'resumable')
+    RESUMABLE_UPLOAD_CHUNK_SIZE = int(os.environ.get('RESUMABLE_UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024))  # 5MB suggested chunk size
+    RESUMABLE_UPLOAD_MAX_SIZE = int(os.environ.get('RESUMABLE_UPLOAD_MAX_SIZE', 500 * 1024 * 1024))  # 500MB max assembled file
+    RESUMABLE_UPLOAD_SESSION_TTL = int(os.environ.get('RESUMABLE_UPLOAD_SESSION_TTL', 24 * 3600))  # Seconds of inactivity before a session expires
     
+    # Image Diagnosis Configuration
+    IMAGE_WORKING_SIZE = int(os.environ.get('IMAGE_WORKING_SIZE', 224))  # Uploads are downscaled so the shorter side matches this
+    IMAGE_INFERENCE_ENGINE = os.environ.get('IMAGE_INFERENCE_ENGINE', 'default')  # 'default' (ImageAnalyzer), 'batched' (float32 Keras) or 'tflite' (quantized)
+    IMAGE_MODEL_PATH = os.environ.get('IMAGE_MODEL_PATH', 'models/image_model.h5')
+    IMAGE_TFLITE_MODEL_PATH = os.environ.get('IMAGE_TFLITE_MODEL_PATH', 'models/image_model_int8.tflite')  # See ai_models/quantization.py
+    IMAGE_MODEL_LABELS = [label.strip() for label in os.environ.get('IMAGE_MODEL_LABELS', 'Normal,Abnormal').split(',')]
+    IMAGE_MODEL_INPUT_SIZE = int(os.environ.get('IMAGE_MODEL_INPUT_SIZE', 224))
+    IMAGE_BATCH_MAX_SIZE = int(os.environ.get('IMAGE_BATCH_MAX_SIZE', 16))
+    IMAGE_BATCH_MAX_WAIT_MS = float(os.environ.get('IMAGE_BATCH_MAX_WAIT_MS', 5))  # How long the inference thread waits to fill a batch
+    IMAGE_INFERENCE_TIMEOUT = float(os.environ.get('IMAGE_INFERENCE_TIMEOUT', 30))
+    IMAGE_MODEL_VERSION = os.environ.get('IMAGE_MODEL_VERSION', '')  # Bump to invalidate cached diagnoses
+    IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get('IMAGE_CACHE_MAX_ENTRIES', 1024))
+    IMAGE_CACHE_HAMMING_THRESHOLD = int(os.environ.get('IMAGE_CACHE_HAMMING_THRESHOLD', 4))  # Max differing pHash bits (of 64) for a cache hit
+    IMAGE_CACHE_EXACT_TYPES = os.environ.get('IMAGE_CACHE_EXACT_TYPES', 'eye_anemia')  # Colour-dependent diagnosis types; cached only for byte-identical uploads
+    TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))  # 0 lets TensorFlow decide
+    TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0))
+
+    # Anemia Screening (batch) Configuration
+    ANEMIA_BATCH_SIZE = int(os.environ.get('ANEMIA_BATCH_SIZE', 256))  # Images per vectorized pass
+    ANEMIA_MAX_IMAGES_PER_REQUEST = int(os.environ.get('ANEMIA_MAX_IMAGES_PER_REQUEST', 1000))
+    ANEMIA_FEATURE_MODEL_PATH = os.environ.get('ANEMIA_FEATURE_MODEL_PATH', os.path.join('models', 'anemia_features.joblib'))  # Fitted with python -m backend.anemia_batch; screening returns 503 until it exists
+
+    # OCR Configuration
+    OCR_ENGINE = os.environ.get('OCR_ENGINE', 'parallel')  # 'parallel' (page-parallel process pool; needs a WSGI server or `flask run`, else falls back) or 'default' (OCRProcessor)
+    OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', os.cpu_count() or 1))
+    OCR_MAX_PAGES = int(os.environ.get('OCR_MAX_PAGES', 50))  # Pages beyond this are skipped and the result marked truncated
+    OCR_DOCUMENT_TIMEOUT = float(os.environ.get('OCR_DOCUMENT_TIMEOUT', 120))  # Seconds per document
+    OCR_PAGE_TIMEOUT = float(os.environ.get('OCR_PAGE_TIMEOUT', 60))  # Seconds per Tesseract call
+    OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+    OCR_LANG = os.environ.get('OCR_LANG', 'eng')
+    OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', os.path.join('cache', 'ocr_cache.sqlite3'))  # Shared by all worker processes
+    OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+    # Search Index Configuration
+    SEARCH_INDEX_DIR = os.environ.get('SEARCH_INDEX_DIR', os.path.join('cache', 'search_index'))
+    SEARCH_INDEX_COMPACT_AFTER = int(os.environ.get('SEARCH_INDEX_COMPACT_AFTER', 5000))  # Journal entries before a new snapshot is written
+
+    # Scan Preview (tile pyramid) Configuration
+    TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', os.path.join('cache', 'tiles'))
+    TILE_SIZE = int(os.environ.get('TILE_SIZE', 256))
+    TILE_WORKERS = int(os.environ.get('TILE_WORKERS', 2))  # Background threads building pyramids
+    TILE_MAX_QUEUED = int(os.environ.get('TILE_MAX_QUEUED', 32))  # Uploads waiting for a worker before previews are skipped
+    TILE_CACHE_MAX_MB = int(os.environ.get('TILE_CACHE_MAX_MB', 5120))  # Least recently viewed pyramids are evicted above this
+
+    # Symptom Analysis Cache Configuration
+    SYMPTOM_CACHE_MAX_ENTRIES = int(os.environ.get('SYMPTOM_CACHE_MAX_ENTRIES', 1024))
+    SYMPTOM_CACHE_TTL = int(os.environ.get('SYMPTOM_CACHE_TTL', 3600))  # Seconds a predictor result is reused
+    SYMPTOM_ANALYSIS_TIMEOUT = float(os.environ.get('SYMPTOM_ANALYSIS_TIMEOUT', 60))  # How long coalesced requests wait for the shared call
+    SYMPTOM_STREAM_WORKERS = int(os.environ.get('SYMPTOM_STREAM_WORKERS', 8))  # Threads running non-streaming predictor calls for SSE clients
+    SYMPTOM_STREAM_ENGINE = os.environ.get('SYMPTOM_STREAM_ENGINE', 'none')  # 'none' streams heartbeats then the predictor's result; 'gemini' adds a Gemini text preview (a second model call) before it
+    GEMINI_SYMPTOM_MODEL = os.environ.get('GEMINI_SYMPTOM_MODEL', 'gemini-pro')
+    SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))  # Seconds between keep-alive comments on idle streams
+
+    # Speech Recognition Configuration
+    SPEECH_RECOGNIZER = os.environ.get('SPEECH_RECOGNIZER', 'google')  # 'google' (Web Speech API) or 'offline' (Vosk, streaming)
+    SPEECH_MODEL_PATH = os.environ.get('SPEECH_MODEL_PATH', os.path.join('models', 'vosk-model-small-en-us'))
+    SPEECH_SAMPLE_RATE = int(os.environ.get('SPEECH_SAMPLE_RATE', 16000))  # Streamed audio must be 16-bit mono PCM at this rate
+    SPEECH_VAD_AGGRESSIVENESS = int(os.environ.get('SPEECH_VAD_AGGRESSIVENESS', 2))  # 0 (keeps most audio) to 3 (drops most non-speech)
+    SPEECH_ENERGY_THRESHOLD = int(os.environ.get('SPEECH_ENERGY_THRESHOLD', 300))  # RMS gate used when webrtcvad is not installed
+    SPEECH_STREAM_MAX_SECONDS = int(os.environ.get('SPEECH_STREAM_MAX_SECONDS', 120))  # Audio beyond this is ignored
+    SPEECH_STREAM_READ_SIZE = int(os.environ.get('SPEECH_STREAM_READ_SIZE', 8000))  # Bytes read from the request body per step (250ms at 16kHz)
+
+    # Vitals Store Configuration
+    VITALS_DB_PATH = os.environ.get('VITALS_DB_PATH', os.path.join('data', 'vitals.sqlite3'))
+    VITALS_BULK_MAX_READINGS = int(os.environ.get('VITALS_BULK_MAX_READINGS', 50000))  # Per bulk ingestion request
+    VITALS_SERIES_DIR = os.environ.get('VITALS_SERIES_DIR', os.path.join('data', 'vitals_series'))  # Memory-mapped per-patient segments
+    VITALS_SEGMENT_CAPACITY = int(os.environ.get('VITALS_SEGMENT_CAPACITY', 65536))  # Readings per segment file
+    TRENDS_DEFAULT_WIDTH = int(os.environ.get('TRENDS_DEFAULT_WIDTH', 800))  # Points per series when the client sends no width
+    TRENDS_MAX_WIDTH = int(os.environ.get('TRENDS_MAX_WIDTH', 4000))
+    VITALS_RULES_PATH = os.environ.get('VITALS_RULES_PATH')  # Optional JSON list of alert rules; built-in defaults otherwise
+    VITALS_ALERT_COOLDOWN_MS = int(os.environ.get('VITALS_ALERT_COOLDOWN_MS', 15 * 60 * 1000))  # Repeat alerts per patient and rule are suppressed this long
+
+    # Idempotency Configuration
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 3600))  # Seconds a stored response is replayed for duplicates
+    IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', 10000))
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 2))  # Seconds an in-flight duplicate waits before getting 409 "still processing"
+    IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 120))  # An unfinished claim expires after this, so a crashed request does not block its key
+    IDEMPOTENCY_DB_PATH = os.environ.get('IDEMPOTENCY_DB_PATH', os.path.join('data', 'idempotency.sqlite3'))  # Shared by all worker processes
+
+    # Doctor Event Stream Configuration
+    EVENT_REPLAY_BUFFER = int(os.environ.get('EVENT_REPLAY_BUFFER', 2000))  # Recent events kept for Last-Event-ID resume
+    EVENT_SUBSCRIBER_QUEUE = int(os.environ.get('EVENT_SUBSCRIBER_QUEUE', 256))  # Undelivered events per client before it is disconnected
+    EVENT_RETRY_MS = int(os.environ.get('EVENT_RETRY_MS', 3000))  # Reconnect delay suggested to EventSource clients
+    EVENT_TICKET_TTL = int(os.environ.get('EVENT_TICKET_TTL', 30))  # Seconds a single-use event stream ticket stays valid
+    EVENT_TICKETS_DB_PATH = os.environ.get('EVENT_TICKETS_DB_PATH', os.path.join('data', 'event_tickets.sqlite3'))  # Shared by all worker processes
+    ALERT_FEED_POLL_SECONDS = float(os.environ.get('ALERT_FEED_POLL_SECONDS', 2))  # How soon alerts stored by another worker reach this worker's event streams
+    URGENT_CASES_REFRESH_SECONDS = float(os.environ.get('URGENT_CASES_REFRESH_SECONDS', 60))  # Background re-check for connected doctors
+
+    # Analytics Rollup Configuration
+    ANALYTICS_RECONCILE_SECONDS = float(os.environ.get('ANALYTICS_RECONCILE_SECONDS', 3600))  # Full recompute that corrects incremental drift
+    ANALYTICS_ROLLUP_DAYS = int(os.environ.get('ANALYTICS_ROLLUP_DAYS', 90))  # Days of per-day consultation counts returned
+
+    # Doctor Performance Metrics Configuration
+    DOCTOR_METRICS_SNAPSHOT_PATH = os.environ.get('DOCTOR_METRICS_SNAPSHOT_PATH', os.path.join('data', 'doctor_metrics.json'))
+    DOCTOR_METRICS_RETENTION_DAYS = int(os.environ.get('DOCTOR_METRICS_RETENTION_DAYS', 90))  # Longest window served; older day buckets are compacted away
+    DOCTOR_METRICS_SNAPSHOT_SECONDS = int(os.environ.get('DOCTOR_METRICS_SNAPSHOT_SECONDS', 300))  # Snapshot cadence; compaction runs with the first snapshot of each day
+    DOCTOR_METRICS_RECONCILE_SECONDS = float(os.environ.get('DOCTOR_METRICS_RECONCILE_SECONDS', 3600))  # Rebuild from the database, which also picks up other workers' writes
+
+    # Risk Scoring Configuration
+    RISK_SCORES_DB_PATH = os.environ.get('RISK_SCORES_DB_PATH', os.path.join('data', 'risk_scores.sqlite3'))
+    RISK_SCORING_CHUNK_SIZE = int(os.environ.get('RISK_SCORING_CHUNK_SIZE', 5000))  # Patients scored per vectorized pass and per checkpoint
+    RISK_SCORING_HOUR_UTC = int(os.environ.get('RISK_SCORING_HOUR_UTC', 2))  # When the nightly run starts
+    RISK_SCORING_LEASE_SECONDS = int(os.environ.get('RISK_SCORING_LEASE_SECONDS', 900))  # A run whose last chunk is older than this may be taken over by another process
+
+    # Appointment Calendar Configuration
+    APPOINTMENT_DEFAULT_MINUTES = int(os.environ.get('APPOINTMENT_DEFAULT_MINUTES', 30))  # Length assumed when a consultation has no duration_minutes
+    APPOINTMENT_INDEX_MAX_AGE = float(os.environ.get('APPOINTMENT_INDEX_MAX_AGE', 300))  # Seconds before a doctor's calendar is reloaded for reads; booking checks always reload
+    APPOINTMENT_LOCK_DIR = os.environ.get('APPOINTMENT_LOCK_DIR', os.path.join('data', 'appointment_locks'))  # Per-doctor lock files serializing bookings across worker processes
+
     # Encryption Configuration
     ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY') # This should be loaded from .env
     
     # Emergency Service Configuration
     EMERGENCY_NOTIFICATION_URL = os.environ.get('EMERGENCY_NOTIFICATION_URL')
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 12))  # Request threads per worker process (gunicorn --threads / waitress threads)
+    EMERGENCY_RESERVED_THREADS = int(os.environ.get('EMERGENCY_RESERVED_THREADS', 2))  # Server threads heavy and streaming traffic can never take
+    EMERGENCY_LATENCY_SLO_MS = float(os.environ.get('EMERGENCY_LATENCY_SLO_MS', 250))
+    FLEET_GRID_CELL_DEG = float(os.environ.get('FLEET_GRID_CELL_DEG', 0.01))  # Spatial index cell size (~1.1 km of latitude)
+    FLEET_MAX_SEARCH_KM = float(os.environ.get('FLEET_MAX_SEARCH_KM', 100))  # Units farther than this are never dispatched
+    FLEET_BASIC_EMERGENCY_TYPES = [t for t in os.environ.get('FLEET_BASIC_EMERGENCY_TYPES', 'basic,medical').split(',') if t]  # Types a unit without listed capabilities may serve
+    EMERGENCY_DISPATCH_TOKEN = os.environ.get('EMERGENCY_DISPATCH_TOKEN')  # Service token for fleet position/availability feeds (dispatcher users may also call them)
+    HEAVY_REQUEST_PREFIXES = [p for p in os.environ.get('HEAVY_REQUEST_PREFIXES', '/api/ai/,/api/ml-diagnosis,/api/gemini/').split(',') if p]
+    HEAVY_MAX_CONCURRENT = int(os.environ.get('HEAVY_MAX_CONCURRENT', 4))  # Heavy requests running at once
+    HEAVY_MAX_QUEUED = int(os.environ.get('HEAVY_MAX_QUEUED', 1))  # Waiting requests hold a server thread too; limits are fitted to SERVER_THREADS - EMERGENCY_RESERVED_THREADS
+    HEAVY_QUEUE_TIMEOUT = float(os.environ.get('HEAVY_QUEUE_TIMEOUT', 5))  # Seconds a heavy request waits for a slot before a 503
+    STREAM_REQUEST_PREFIXES = [p for p in os.environ.get('STREAM_REQUEST_PREFIXES', '/api/gemini/voice-stream').split(',') if p]  # Long-lived sessions, capped apart from heavy requests
+    STREAM_MAX_CONCURRENT = int(os.environ.get('STREAM_MAX_CONCURRENT', 1))  # Live streaming sessions at once; no queue
+    EVENT_MAX_CONNECTIONS = int(os.environ.get('EVENT_MAX_CONNECTIONS', 4))  # Open /api/doctor/events streams per worker; each holds a server thread
     
     # Database Configuration
     DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -0,0 +1,312 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _day(value):
+    """YYYY-MM-DD (UTC) of an ISO 8601 timestamp or datetime, or None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value[:10] or None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date().isoformat()
+
+
+def _overlay(template, live):
+    """template with the values of live that it has keys for, when they have the same type."""
+    return {**template, **{key: value for key, value in live.items()
+                           if key in template and isinstance(value, type(template[key]))}}
+
+
+def _consultation_key(consultation):
+    return consultation.get('status') or 'unknown', _day(consultation.get('scheduled_at') or consultation.get('created_at'))
+
+
+class _Counts:
+    """The counters plus, per tracked id, the bucket it is counted in.
+
+    Knowing where each user, record and consultation is counted makes every
+    change idempotent: creating something already counted, or deleting
+    something not counted, changes nothing. That is what lets reconcile()
+    replay writes onto a fresh load without knowing whether the load
+    already saw them.
+    """
+
+    def __init__(self):
+        self.users_by_role = Counter()
+        self.consultations_by_status = Counter()
+        self.consultations_by_day = {}  # day -> Counter of status
+        self.records_by_type = Counter()
+        self.users = {}  # user id -> role
+        self.records = {}  # record id -> record_type
+        self.consultations = {}  # consultation id -> (status, day), so updates can move a consultation between buckets
+
+    def user_created(self, user):
+        user_id, role = user.get('id'), user.get('role') or 'unknown'
+        if user_id is not None:
+            if user_id in self.users:
+                return False
+            self.users[user_id] = role
+        self.users_by_role[role] += 1
+        return True
+
+    def record_created(self, record):
+        record_id, record_type = record.get('id'), record.get('record_type') or 'unknown'
+        if record_id is not None:
+            if record_id in self.records:
+                return False
+            self.records[record_id] = record_type
+        self.records_by_type[record_type] += 1
+        return True
+
+    def record_updated(self, old_record, new_record):
+        record_id = new_record.get('id', old_record.get('id'))
+        old_type = self.records.get(record_id) or old_record.get('record_type') or 'unknown'
+        new_type = new_record.get('record_type') or 'unknown'
+        if record_id is not None:
+            self.records[record_id] = new_type
+        if old_type == new_type:
+            return False
+        self.records_by_type[old_type] -= 1
+        self.records_by_type[new_type] += 1
+        return True
+
+    def record_deleted(self, record):
+        record_id = record.get('id')
+        if record_id is not None:
+            if record_id not in self.records:
+                return False
+            record_type = self.records.pop(record_id)
+        else:
+            record_type = record.get('record_type') or 'unknown'
+        self.records_by_type[record_type] -= 1
+        return True
+
+    def consultation_saved(self, consultation, changes=None):
+        consultation = {**(changes or {}), **(consultation or {})}
+        consultation_id = consultation.get('id')
+        previous = self.consultations.get(consultation_id)
+        if previous is not None:
+            status, day = previous
+            consultation.setdefault('status', status)
+            consultation.setdefault('scheduled_at', day)
+        key = _consultation_key(consultation)
+        if previous == key:
+            return False
+        if previous is not None:
+            self._count_consultation(previous, -1)
+        elif changes is not None:
+            # An update to a consultation we have never seen: its old bucket is unknown until the next reconcile
+            logger.info(f"Analytics rollups: update to untracked consultation {consultation_id}.")
+        self._count_consultation(key)
+        if consultation_id is not None:
+            self.consultations[consultation_id] = key
+        return True
+
+    def _count_consultation(self, key, sign=1):
+        status, day = key
+        self.consultations_by_status[status] += sign
+        if day:
+            bucket = self.consultations_by_day.setdefault(day, Counter())
+            bucket[status] += sign
+            if not +bucket:
+                del self.consultations_by_day[day]
+
+    def totals(self):
+        return {
+            'users_by_role': +self.users_by_role,
+            'consultations_by_status': +self.consultations_by_status,
+            'records_by_type': +self.records_by_type,
+        }
+
+
+class AnalyticsRollups:
+    """Dashboard counters kept up to date by the write paths instead of aggregated per request.
+
+    Counts kept: users by role, consultations by status and by day, and
+    medical records by type. Each create, update or delete in app.py applies
+    a +1/-1 delta. Reads return a payload built once per change, so they do
+    not depend on table sizes.
+
+    reconcile() recomputes everything from a loader that returns
+    (users, consultations, records). It runs in the background at start-up
+    and every interval seconds. It logs any drift it finds and replaces the
+    incremental state. Writes that land while the loader is reading are
+    logged and replayed onto the fresh counts before the swap. Replaying is
+    idempotent per id, so a write the loader already saw is not counted
+    twice. Until the first reconcile succeeds, ready is False.
+
+    template_loaders maps a payload name ('dashboard', 'consultations') to
+    the existing aggregation whose response schema it must keep. Each
+    reconcile stores that aggregation's payload as a template, and reads
+    return the template with the live counts substituted for the keys it
+    has. Callers therefore see one schema whether or not the rollups are
+    ready. Fields the rollups do not count stay as of the last reconcile.
+
+    Counts are per process: a write handled by another worker shows up here
+    only after this process's next reconcile.
+    """
+
+    def __init__(self, loader=None, interval=3600.0, days=90, template_loaders=None):
+        self.loader = loader
+        self.template_loaders = dict(template_loaders or {})
+        self._templates = {}
+        self.interval = interval
+        self.days = days
+        self.ready = False
+        self._counts = _Counts()
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._pending = None  # writes applied while a reconcile is loading, as (method name, args)
+        self._writes = 0
+        self._payloads = {}
+        self._reconciled_at = None
+        self._last_drift = None
+        if loader is not None:
+            threading.Thread(target=self._run, name='analytics-reconcile', daemon=True).start()
+
+    # ---------- write paths ----------
+
+    def user_created(self, user):
+        self._apply('user_created', user)
+
+    def record_created(self, record):
+        self._apply('record_created', record)
+
+    def record_updated(self, old_record, new_record):
+        self._apply('record_updated', old_record, new_record)
+
+    def record_deleted(self, record):
+        self._apply('record_deleted', record)
+
+    def consultation_saved(self, consultation, changes=None):
+        """Count a created or updated consultation. changes is the partial update when consultation lacks fields."""
+        self._apply('consultation_saved', consultation, changes)
+
+    def _apply(self, name, *args):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((name, args))
+            if getattr(self._counts, name)(*args):
+                self._changed()
+
+    # ---------- reads ----------
+
+    def dashboard(self):
+        return self._payload('dashboard', self._build_dashboard)
+
+    def consultation_metrics(self):
+        return self._payload('consultations', self._build_consultation_metrics)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'reconciled_at': self._reconciled_at,
+                'last_drift': self._last_drift,
+                'tracked_consultations': len(self._counts.consultations),
+                'writes_since_start': self._writes,
+            }
+
+    def _payload(self, name, build):
+        with self._lock:
+            payload = self._payloads.get(name)
+            if payload is None:
+                payload = build()
+                if name in self._templates:
+                    payload = _overlay(self._templates[name], payload)
+                self._payloads[name] = payload
+            return payload
+
+    def _build_dashboard(self):
+        counts = self._counts
+        return {
+            'total_patients': counts.users_by_role.get('patient', 0),
+            'total_doctors': counts.users_by_role.get('doctor', 0),
+            'users_by_role': dict(+counts.users_by_role),
+            'total_consultations': sum((+counts.consultations_by_status).values()),
+            'consultations_by_status': dict(+counts.consultations_by_status),
+            'total_records': sum((+counts.records_by_type).values()),
+            'records_by_type': dict(+counts.records_by_type),
+            'reconciled_at': self._reconciled_at,
+        }
+
+    def _build_consultation_metrics(self):
+        counts = self._counts
+        by_status = +counts.consultations_by_status
+        total = sum(by_status.values())
+        since = (datetime.now(timezone.utc) - timedelta(days=self.days)).date().isoformat()
+        return {
+            'total': total,
+            'by_status': dict(by_status),
+            'completion_rate': round(by_status.get('completed', 0) / total, 4) if total else None,
+            'by_day': {day: dict(+bucket) for day, bucket in sorted(counts.consultations_by_day.items()) if day >= since},
+            'reconciled_at': self._reconciled_at,
+        }
+
+    def _changed(self):
+        self._writes += 1
+        self._payloads.clear()
+
+    # ---------- reconciliation ----------
+
+    def reconcile(self):
+        """Recompute every counter from the loader, replay writes made meanwhile, and swap it in. Returns the drift found."""
+        with self._reconcile_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                users, consultations, records = self.loader()
+                fresh = _Counts()
+                for user in users or []:
+                    fresh.user_created(user)
+                for consultation in consultations or []:
+                    fresh.consultation_saved(consultation)
+                for record in records or []:
+                    fresh.record_created(record)
+                templates = {name: load() or {} for name, load in self.template_loaders.items()}
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+
+            with self._lock:
+                for name, args in self._pending:
+                    getattr(fresh, name)(*args)
+                self._pending = None
+                old, new = self._counts.totals(), fresh.totals()
+                drift = {
+                    name: {key: new[name].get(key, 0) - old[name].get(key, 0)
+                           for key in set(old[name]) | set(new[name]) if new[name].get(key, 0) != old[name].get(key, 0)}
+                    for name in new
+                }
+                drift = {name: diff for name, diff in drift.items() if diff}
+                if drift and self.ready:
+                    logger.warning(f"Analytics rollups drifted from a full recompute, corrected: {drift}")
+                self._counts = fresh
+                self._templates = templates
+                self._payloads.clear()
+                self._reconciled_at = datetime.now(timezone.utc).isoformat()
+                self._last_drift = drift
+                self.ready = True
+                return drift
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.reconcile()
+                logger.info(f"Analytics rollups reconciled in {time.monotonic() - started:.2f}s.")
+            except Exception as e:
+                logger.warning(f"Analytics rollup reconcile failed: {e}")
+            # Retry sooner until the first successful load
+            time.sleep(self.interval if self.ready else min(self.interval, 60))
@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+INACTIVE_STATUSES = ('cancelled', 'canceled')
+# Every indexed appointment carries these keys, whether it came from the database or from a write in this process
+APPOINTMENT_FIELDS = ('id', 'doctor_id', 'patient_id', 'scheduled_at', 'duration_minutes', 'status', 'reason')
+
+
+def parse_timestamp(value):
+    """Epoch seconds from an ISO 8601 string or datetime (naive means UTC), or None."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class _Calendar:
+    """One doctor's appointments in a sorted start-time array, plus each appointment's end and payload."""
+
+    def __init__(self):
+        self.starts = []
+        self.ids = []
+        self.items = {}  # str(consultation id) -> (start, end, appointment)
+        self.max_duration = 0.0
+        self.loaded_at = time.monotonic()
+
+    def add(self, appointment_id, start, end, appointment):
+        self.remove(appointment_id)
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ids.insert(position, appointment_id)
+        self.items[appointment_id] = (start, end, appointment)
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, appointment_id):
+        item = self.items.pop(appointment_id, None)
+        if item is None:
+            return
+        position = bisect_left(self.starts, item[0])
+        while self.ids[position] != appointment_id:
+            position += 1
+        del self.starts[position]
+        del self.ids[position]
+
+
+class AppointmentIndex:
+    """Per-doctor in-memory calendar of consultations for range queries and double-booking checks.
+
+    Each doctor's appointments sit in an array sorted by start time, so a
+    today/upcoming/past query is two binary searches plus the slice it
+    returns. An overlap check binary-searches the window
+    [start - longest appointment, end). Only appointments starting in that
+    window can overlap the new one, so the check stays logarithmic in the
+    size of the calendar.
+
+    A doctor's calendar is loaded from the database on first use (cold
+    start). It is reloaded once it is older than max_age, which picks up
+    consultations written by other processes. Writes in this process
+    update it directly. Cancelled consultations are still returned by range
+    queries but never count as conflicts.
+
+    Reads may be up to max_age stale; booking checks may not. booking()
+    also takes a lock file per doctor under lock_dir, so the check and the
+    insert are serialized across worker processes, and conflicts(...,
+    fresh=True) reloads the calendar from the database while that lock is
+    held.
+
+    Rows from the loader and payloads from writes are normalized to one
+    shape: every APPOINTMENT_FIELDS key is present, doctor_id names the
+    calendar the appointment is in, and scheduled_at is UTC ISO 8601. A
+    partial update to a consultation the index does not hold would leave a
+    partial entry, so it drops that doctor's calendar to be reloaded instead.
+    """
+
+    def __init__(self, loader, default_minutes=30, max_age=300.0, lock_dir=None):
+        self.loader = loader
+        self.default_minutes = default_minutes
+        self.max_age = max_age
+        self.lock_dir = lock_dir
+        self._calendars = {}
+        self._lock = threading.Lock()
+        self._doctor_locks = {}
+        self._counts = {'loads': 0, 'queries': 0, 'conflict_checks': 0}
+
+    @contextmanager
+    def booking(self, doctor_id):
+        """Hold across a conflict check and the insert it guards, so two requests (in any worker) cannot take one slot."""
+        with self._doctor_lock(doctor_id):
+            if self.lock_dir is None:
+                yield
+                return
+            name = hashlib.sha256(str(doctor_id).encode('utf-8')).hexdigest()[:32]
+            with file_lock(os.path.join(self.lock_dir, f'{name}.lock')):
+                yield
+
+    def _doctor_lock(self, doctor_id):
+        with self._lock:
+            return self._doctor_locks.setdefault(doctor_id, threading.RLock())
+
+    def interval(self, appointment):
+        """(start, end) in epoch seconds; end uses duration_minutes, or the default length."""
+        start = parse_timestamp(appointment.get('scheduled_at'))
+        if start is None:
+            return None
+        try:
+            minutes = float(appointment.get('duration_minutes') or self.default_minutes)
+        except (TypeError, ValueError):
+            minutes = self.default_minutes
+        return start, start + minutes * 60.0
+
+    @staticmethod
+    def _normalize(appointment, doctor_id, start):
+        entry = dict.fromkeys(APPOINTMENT_FIELDS)
+        entry.update(appointment)
+        entry['doctor_id'] = doctor_id
+        entry['scheduled_at'] = datetime.fromtimestamp(start, timezone.utc).isoformat()
+        return entry
+
+    # ---------- reads ----------
+
+    def range(self, doctor_id, start=None, end=None):
+        """Appointments with scheduled_at in [start, end] (epoch seconds; None means unbounded), by start time."""
+        calendar = self._calendar(doctor_id)
+        with self._lock:
+            self._counts['queries'] += 1
+            lo = 0 if start is None else bisect_left(calendar.starts, start)
+            hi = len(calendar.starts) if end is None else bisect_right(calendar.starts, end)
+            return [calendar.items[appointment_id][2] for appointment_id in calendar.ids[lo:hi]]
+
+    def get(self, doctor_id, appointment_id):
+        calendar = self._calendar(doctor_id)
+        with self._lock:
+            item = calendar.items.get(str(appointment_id))
+            return item[2] if item else None
+
+    def find(self, appointment_id, doctor_id=None):
+        """An appointment in whichever calendar holds it: doctor_id's (loaded if needed) first, then any loaded one."""
+        if doctor_id is not None:
+            found = self.get(doctor_id, appointment_id)
+            if found is not None:
+                return found
+        with self._lock:
+            for calendar in self._calendars.values():
+                item = calendar.items.get(str(appointment_id))
+                if item is not None:
+                    return item[2]
+        return None
+
+    def conflicts(self, doctor_id, start, end, exclude_id=None, fresh=False):
+        """Active appointments overlapping [start, end). fresh=True reloads the calendar first; hold booking() for it."""
+        exclude_id = None if exclude_id is None else str(exclude_id)
+        calendar = self._calendar(doctor_id, reload=fresh)
+        with self._lock:
+            self._counts['conflict_checks'] += 1
+            lo = bisect_left(calendar.starts, start - calendar.max_duration)
+            hi = bisect_left(calendar.starts, end)
+            found = []
+            for appointment_id in calendar.ids[lo:hi]:
+                other_start, other_end, appointment = calendar.items[appointment_id]
+                if appointment_id == exclude_id or other_end <= start:
+                    continue
+                if (appointment.get('status') or '').lower() in INACTIVE_STATUSES:
+                    continue
+                found.append(appointment)
+            return found
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counts,
+                'doctors': len(self._calendars),
+                'appointments': sum(len(c.items) for c in self._calendars.values()),
+            }
+
+    # ---------- writes ----------
+
+    def upsert(self, appointment, doctor_id=None):
+        """Add or move a consultation. Partial updates are merged into what the index already holds."""
+        if appointment.get('id') is None:
+            return
+        appointment_id = str(appointment['id'])
+        with self._lock:
+            owner = appointment.get('doctor_id') or doctor_id
+            for calendar_owner, calendar in self._calendars.items():
+                if appointment_id in calendar.items:
+                    appointment = {**calendar.items[appointment_id][2], **appointment}
+                    if owner is not None and owner != calendar_owner:
+                        calendar.remove(appointment_id)  # reassigned to another doctor
+                    owner = owner or calendar_owner
+                    break
+            else:
+                if appointment.get('patient_id') is None or appointment.get('scheduled_at') is None:
+                    # A partial update to an appointment we do not hold; reload rather than index a fragment
+                    self._calendars.pop(owner, None)
+                    return
+            calendar = self._calendars.get(owner)
+            if calendar is None:
+                return  # not loaded yet; its first load reads this consultation from the database
+            bounds = self.interval(appointment)
+            if bounds is None:
+                calendar.remove(appointment_id)
+                return
+            calendar.add(appointment_id, bounds[0], bounds[1], self._normalize(appointment, owner, bounds[0]))
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._calendars.clear()
+            else:
+                self._calendars.pop(doctor_id, None)
+
+    def _calendar(self, doctor_id, reload=False):
+        with self._lock:
+            calendar = self._calendars.get(doctor_id)
+            if not reload and calendar is not None and time.monotonic() - calendar.loaded_at < self.max_age:
+                return calendar
+        # Loaded outside the index lock so one doctor's cold start does not stall everyone else's reads
+        with self._doctor_lock(doctor_id):
+            with self._lock:
+                calendar = self._calendars.get(doctor_id)
+                if not reload and calendar is not None and time.monotonic() - calendar.loaded_at < self.max_age:
+                    return calendar
+            appointments = self.loader(doctor_id) or []
+            calendar = _Calendar()
+            for appointment in appointments:
+                bounds = self.interval(appointment)
+                if bounds is not None and appointment.get('id') is not None:
+                    calendar.add(str(appointment['id']), bounds[0], bounds[1], self._normalize(appointment, doctor_id, bounds[0]))
+            with self._lock:
+                self._calendars[doctor_id] = calendar
+                self._counts['loads'] += 1
+            return calendar
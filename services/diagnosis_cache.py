@@ -0,0 +1,157 @@
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def perceptual_hash(image, hash_size=8, highfreq_factor=4):
+    """64-bit DCT perceptual hash (pHash) of a BGR or grayscale image array.
+
+    Re-encoding, mild resizing or recompression flips at most a few bits, so
+    near-duplicates are found by Hamming distance rather than equality.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    size = hash_size * highfreq_factor
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    # Skip the DC term when picking the threshold; it only reflects overall brightness
+    median = np.median(low_freq.ravel()[1:])
+    bits = (low_freq > median).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def content_hash(image_bytes):
+    """SHA-256 hex digest of the encoded upload, for diagnosis types that must match exactly."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ImageDiagnosisCache:
+    """Bounded LRU cache of image diagnosis results keyed by diagnosis type and image hash.
+
+    Most types are keyed by pHash and match near-duplicates within
+    hamming_threshold bits. pHash is computed on grayscale, so types whose
+    verdict depends on colour (exact_types, e.g. eye_anemia pallor) are keyed
+    by content_hash() instead and only match byte-identical uploads.
+
+    Near-duplicate lookup splits the 64-bit hash into hamming_threshold + 1
+    segments. Two hashes within the threshold must agree exactly on at least
+    one segment, so only entries sharing a segment value are compared.
+
+    Entries are tied to a model version per diagnosis type; when the version
+    reported for a type changes, everything cached for that type is dropped.
+    """
+
+    def __init__(self, max_entries=1024, hamming_threshold=4, exact_types=('eye_anemia',)):
+        self.max_entries = max_entries
+        self.hamming_threshold = hamming_threshold
+        self.exact_types = frozenset(exact_types)
+        self._entries = OrderedDict()  # (diagnosis_type, hash) -> result, in LRU order
+        self._buckets = {}  # (diagnosis_type, segment, segment value) -> set of pHashes
+        self._segments = self._segment_masks(hamming_threshold)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_exact(self, diagnosis_type):
+        """True if diagnosis_type is keyed by content_hash() rather than perceptual_hash()."""
+        return diagnosis_type in self.exact_types
+
+    def get(self, diagnosis_type, model_version, image_hash):
+        """Return a cached result for a perceptually identical image, or None."""
+        with self._lock:
+            self._check_version(diagnosis_type, model_version)
+
+            key = (diagnosis_type, image_hash)
+            if key not in self._entries:
+                key = None if self.is_exact(diagnosis_type) else self._find_near_duplicate(diagnosis_type, image_hash)
+            if key is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(self._entries[key])
+
+    def put(self, diagnosis_type, model_version, image_hash, result):
+        with self._lock:
+            self._check_version(diagnosis_type, model_version)
+            key = (diagnosis_type, image_hash)
+            if key not in self._entries:
+                self._index(key)
+            self._entries[key] = copy.deepcopy(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._unindex(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hamming_threshold': self.hamming_threshold,
+                'exact_types': sorted(self.exact_types),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _check_version(self, diagnosis_type, model_version):
+        if self._versions.get(diagnosis_type) == model_version:
+            return
+        if diagnosis_type in self._versions:
+            logger.info(f"Model version for '{diagnosis_type}' changed; invalidating cached diagnoses.")
+        stale = [key for key in self._entries if key[0] == diagnosis_type]
+        for key in stale:
+            del self._entries[key]
+            self._unindex(key)
+        self._versions[diagnosis_type] = model_version
+
+    @staticmethod
+    def _segment_masks(hamming_threshold, bits=64):
+        count = max(1, min(hamming_threshold + 1, bits))
+        bounds = [round(i * bits / count) for i in range(count + 1)]
+        return [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+
+    def _index(self, key):
+        if self.hamming_threshold <= 0 or not isinstance(key[1], int):
+            return
+        for segment, (shift, mask) in enumerate(self._segments):
+            self._buckets.setdefault((key[0], segment, (key[1] >> shift) & mask), set()).add(key[1])
+
+    def _unindex(self, key):
+        if self.hamming_threshold <= 0 or not isinstance(key[1], int):
+            return
+        for segment, (shift, mask) in enumerate(self._segments):
+            bucket_key = (key[0], segment, (key[1] >> shift) & mask)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key[1])
+                if not bucket:
+                    del self._buckets[bucket_key]
+
+    def _find_near_duplicate(self, diagnosis_type, image_hash):
+        if self.hamming_threshold <= 0 or not isinstance(image_hash, int):
+            return None
+        best_key, best_distance = None, self.hamming_threshold + 1
+        for segment, (shift, mask) in enumerate(self._segments):
+            for candidate in self._buckets.get((diagnosis_type, segment, (image_hash >> shift) & mask), ()):
+                distance = bin(candidate ^ image_hash).count('1')
+                if distance < best_distance:
+                    best_key, best_distance = (diagnosis_type, candidate), distance
+        return best_key
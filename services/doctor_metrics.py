@@ -0,0 +1,436 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_STATUSES = ('completed',)
+NO_SHOW_STATUSES = ('no_show', 'no-show', 'noshow', 'missed')
+
+
+def _parse_time(value):
+    """Aware UTC datetime from an ISO 8601 string or datetime, or None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _outcome(status):
+    status = (status or '').strip().lower()
+    if status in COMPLETED_STATUSES:
+        return 'completed'
+    if status in NO_SHOW_STATUSES:
+        return 'no_show'
+    return None
+
+
+class QuantileSketch:
+    """Log-bucketed histogram: quantiles within relative_accuracy, mergeable, and bounded by max_bins.
+
+    A value x lands in bin ceil(log_gamma(x)), so every bin spans a fixed
+    ratio and the bin's midpoint is within relative_accuracy of any value
+    in it. When there are more than max_bins bins, the lowest ones are
+    folded together. That keeps high quantiles accurate and costs precision
+    only at the very bottom.
+    """
+
+    def __init__(self, relative_accuracy=0.02, max_bins=512):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value, weight=1):
+        if value <= 0:
+            self.zeros += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + weight
+            if self.bins[key] <= 0:
+                del self.bins[key]
+        self.count += weight
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def merge(self, other):
+        for key, n in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q):
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1) if self.bins else 0.0
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        overflow = keys[:len(keys) - self.max_bins + 1]
+        folded = sum(self.bins.pop(key) for key in overflow)
+        self.bins[overflow[-1]] = self.bins.get(overflow[-1], 0) + folded
+
+    def to_dict(self):
+        return {'bins': [[k, n] for k, n in self.bins.items()], 'zeros': self.zeros, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data, relative_accuracy=0.02, max_bins=512):
+        sketch = cls(relative_accuracy, max_bins)
+        sketch.bins = {int(k): n for k, n in data.get('bins', [])}
+        sketch.zeros = data.get('zeros', 0)
+        sketch.count = data.get('count', 0)
+        return sketch
+
+
+class _DayBucket:
+    __slots__ = ('completed', 'no_show', 'records', 'delay')
+
+    def __init__(self):
+        self.completed = 0
+        self.no_show = 0
+        self.records = 0
+        self.delay = QuantileSketch()
+
+    def to_dict(self):
+        return {'completed': self.completed, 'no_show': self.no_show, 'records': self.records, 'delay': self.delay.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        bucket = cls()
+        bucket.completed, bucket.no_show, bucket.records = data['completed'], data['no_show'], data['records']
+        bucket.delay = QuantileSketch.from_dict(data['delay'])
+        return bucket
+
+
+def _try_lock(path):
+    """Open path and take an exclusive, non-blocking lock on it. Returns the open file, or None if another process holds it."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    f = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return f
+    except OSError:
+        f.close()
+        return None
+
+
+class _MetricsState:
+    """Day buckets plus what each consultation and record was counted as, so every change can be undone."""
+
+    def __init__(self):
+        self.days = {}  # doctor_id -> {day: _DayBucket}
+        self.consultations = {}  # consultation id -> {'doctor_id', 'scheduled_at', 'outcome', 'day', 'delay'}
+        self.records = {}  # record id -> [doctor_id, day]
+
+    def consultation_saved(self, consultation, doctor_id, now):
+        consultation_id = consultation.get('id')
+        state = self.consultations.get(consultation_id) if consultation_id is not None else None
+        if state is None:
+            state = {'doctor_id': None, 'scheduled_at': None, 'outcome': None, 'day': None, 'delay': None}
+        state['doctor_id'] = consultation.get('doctor_id') or state['doctor_id'] or doctor_id
+        state['scheduled_at'] = consultation.get('scheduled_at') or state['scheduled_at']
+        outcome = _outcome(consultation.get('status')) if 'status' in consultation else state['outcome']
+        if state['doctor_id'] is None:
+            outcome = None  # Nothing to attribute it to; a later update that names the doctor counts it
+        if outcome != state['outcome']:
+            if state['outcome'] is not None:
+                self._apply(state, -1)
+            state['outcome'], state['day'], state['delay'] = outcome, None, None
+            if outcome is not None:
+                finished = _parse_time(consultation.get('completed_at') or consultation.get('updated_at')) or now
+                state['day'] = finished.date().isoformat()
+                scheduled = _parse_time(state['scheduled_at'])
+                if outcome == 'completed' and scheduled is not None:
+                    state['delay'] = max((finished - scheduled).total_seconds() / 60.0, 0.0)
+                self._apply(state, 1)
+        if consultation_id is not None:
+            self.consultations[consultation_id] = state
+
+    def record_created(self, record, now):
+        doctor_id, record_id = record.get('uploaded_by_id'), record.get('id')
+        if doctor_id is None or (record_id is not None and record_id in self.records):
+            return
+        day = (_parse_time(record.get('uploaded_at') or record.get('created_at')) or now).date().isoformat()
+        self._bucket(doctor_id, day).records += 1
+        if record_id is not None:
+            self.records[record_id] = [doctor_id, day]
+
+    def record_deleted(self, record):
+        counted = self.records.pop(record.get('id'), None)
+        if counted is not None:
+            doctor_id, day = counted
+            self._bucket(doctor_id, day).records -= 1
+
+    def compact(self, cutoff, today):
+        for doctor_id in list(self.days):
+            buckets = self.days[doctor_id]
+            for day in [d for d in buckets if d < cutoff]:
+                del buckets[day]
+            if not buckets:
+                del self.days[doctor_id]
+        # A consultation whose outcome fell out of the window can no longer be corrected in it
+        for consultation_id in [c for c, s in self.consultations.items()
+                                if (s['day'] or (s['scheduled_at'] or '')[:10] or today) < cutoff]:
+            del self.consultations[consultation_id]
+        for record_id in [r for r, (_, day) in self.records.items() if day < cutoff]:
+            del self.records[record_id]
+
+    def _apply(self, state, sign):
+        bucket = self._bucket(state['doctor_id'], state['day'])
+        if state['outcome'] == 'completed':
+            bucket.completed += sign
+            if state['delay'] is not None:
+                bucket.delay.add(state['delay'], sign)
+        else:
+            bucket.no_show += sign
+
+    def _bucket(self, doctor_id, day):
+        return self.days.setdefault(doctor_id, {}).setdefault(day, _DayBucket())
+
+    def to_dict(self):
+        return {
+            # Pairs rather than objects so non-string doctor, consultation and record ids survive the round trip
+            'days': [[d, {day: b.to_dict() for day, b in buckets.items()}] for d, buckets in self.days.items()],
+            'consultations': [[c, dict(s)] for c, s in self.consultations.items()],
+            'records': [[r, list(counted)] for r, counted in self.records.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.days = {d: {day: _DayBucket.from_dict(b) for day, b in buckets.items()} for d, buckets in data['days']}
+        state.consultations = {c: s for c, s in data['consultations']}
+        state.records = {r: counted for r, counted in data.get('records', [])}
+        return state
+
+
+class DoctorMetricsEngine:
+    """Per-doctor performance metrics over sliding day windows, maintained on writes.
+
+    Each doctor has one bucket per UTC day. A bucket holds completed and
+    no-show counts, records authored, and a quantile sketch of the minutes
+    from scheduled_at to completion. A window query merges at most
+    retention_days buckets, so it never depends on how much history there
+    is.
+
+    Each consultation's last counted outcome, and the day each record was
+    counted on, are remembered. A repeated update is therefore a no-op, a
+    corrected status (e.g. completed back to scheduled) takes its count
+    back out, and a deleted record is subtracted again.
+
+    Every process only sees the writes it served, so reconcile() rebuilds
+    the state from a loader returning (consultations, records): at start-up
+    and then every reconcile_interval seconds. Writes made while it loads
+    are replayed onto the rebuilt state. The snapshot on disk is only a
+    warm start until the first reconcile. It has a single writer: the
+    process holding the lock file beside it. Other processes (the reloader
+    parent, other workers) never overwrite it. Once per day, before a
+    snapshot, compact() drops buckets and state older than the retention,
+    so memory stays bounded by doctors × retention_days.
+    """
+
+    def __init__(self, snapshot_path=None, retention_days=90, snapshot_interval=300, loader=None, reconcile_interval=3600.0):
+        self.snapshot_path = snapshot_path
+        self.retention_days = retention_days
+        self.snapshot_interval = snapshot_interval
+        self.loader = loader
+        self.reconcile_interval = reconcile_interval
+        self._state = _MetricsState()
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._pending = None  # writes applied while a reconcile is loading, as (method name, args)
+        self._writer_lock = None
+        self._compacted_at = None
+        self._reconciled_at = None
+        self._load()
+        if snapshot_interval:
+            threading.Thread(target=self._run, name='doctor-metrics-compaction', daemon=True).start()
+        if loader is not None:
+            threading.Thread(target=self._run_reconcile, name='doctor-metrics-reconcile', daemon=True).start()
+
+    # ---------- write paths ----------
+
+    def consultation_saved(self, consultation, doctor_id=None, now=None):
+        """Count a consultation's outcome when it first becomes completed or no-show, and undo it if that changes."""
+        self._write('consultation_saved', consultation, doctor_id, now or datetime.now(timezone.utc))
+
+    def record_created(self, record, now=None):
+        self._write('record_created', record, now or datetime.now(timezone.utc))
+
+    def record_deleted(self, record):
+        self._write('record_deleted', record)
+
+    def _write(self, name, *args):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((name, args))
+            getattr(self._state, name)(*args)
+
+    # ---------- reads ----------
+
+    def metrics(self, doctor_id, windows=(7, 30, 90), today=None):
+        """Completed consultations, no-show rate, median minutes to completion and records authored per window."""
+        today = today or datetime.now(timezone.utc).date()
+        result = {}
+        with self._lock:
+            buckets = self._state.days.get(doctor_id, {})
+            for days in windows:
+                since = (today - timedelta(days=min(days, self.retention_days) - 1)).isoformat()
+                completed = no_show = records = 0
+                delay = QuantileSketch()
+                for day, bucket in buckets.items():
+                    if day >= since:
+                        completed += bucket.completed
+                        no_show += bucket.no_show
+                        records += bucket.records
+                        delay.merge(bucket.delay)
+                median = delay.quantile(0.5)
+                p90 = delay.quantile(0.9)
+                result[f'{days}d'] = {
+                    'consultations_completed': completed,
+                    'no_shows': no_show,
+                    'no_show_rate': round(no_show / (completed + no_show), 4) if completed + no_show else None,
+                    'median_minutes_to_completion': round(median, 1) if median is not None else None,
+                    'p90_minutes_to_completion': round(p90, 1) if p90 is not None else None,
+                    'records_authored': records,
+                }
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'doctors': len(self._state.days),
+                'day_buckets': sum(len(days) for days in self._state.days.values()),
+                'tracked_consultations': len(self._state.consultations),
+                'tracked_records': len(self._state.records),
+                'compacted_at': self._compacted_at,
+                'reconciled_at': self._reconciled_at,
+                'snapshot_writer': self._writer_lock is not None,
+            }
+
+    # ---------- reconciliation ----------
+
+    def reconcile(self, now=None):
+        """Rebuild every bucket from the loader, replay writes made meanwhile, and swap it in."""
+        now = now or datetime.now(timezone.utc)
+        with self._reconcile_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                consultations, records = self.loader()
+                fresh = _MetricsState()
+                for consultation in consultations or []:
+                    fresh.consultation_saved(consultation, None, now)
+                for record in records or []:
+                    fresh.record_created(record, now)
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                for name, args in self._pending:
+                    getattr(fresh, name)(*args)
+                self._pending = None
+                fresh.compact(self._cutoff(now.date()), now.date().isoformat())
+                self._state = fresh
+                self._reconciled_at = datetime.now(timezone.utc).isoformat()
+
+    def _run_reconcile(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.reconcile()
+                logger.info(f"Doctor metrics reconciled in {time.monotonic() - started:.2f}s.")
+                delay = self.reconcile_interval
+            except Exception as e:
+                logger.warning(f"Doctor metrics reconcile failed: {e}")
+                delay = min(self.reconcile_interval, 60)  # Retry sooner until the database is reachable
+            time.sleep(delay)
+
+    # ---------- compaction ----------
+
+    def compact(self, today=None):
+        """Drop state older than the retention window, then snapshot the rest."""
+        today = today or datetime.now(timezone.utc).date()
+        with self._lock:
+            self._state.compact(self._cutoff(today), today.isoformat())
+            self._compacted_at = datetime.now(timezone.utc).isoformat()
+        self.save()
+
+    def _cutoff(self, today):
+        return (today - timedelta(days=self.retention_days - 1)).isoformat()
+
+    def save(self):
+        if not self.snapshot_path:
+            return
+        if self._writer_lock is None:
+            # Retried on every save, so another process takes over once the writer exits
+            self._writer_lock = _try_lock(self.snapshot_path + '.lock')
+            if self._writer_lock is None:
+                return
+        with self._lock:
+            snapshot = {**self._state.to_dict(), 'compacted_at': self._compacted_at}
+        with open(self.snapshot_path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+
+    def _load(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self._state = _MetricsState.from_dict(snapshot)
+            self._compacted_at = snapshot.get('compacted_at')
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Doctor metrics snapshot unreadable, starting empty: {e}")
+
+    def _run(self):
+        compacted_on = None
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                today = datetime.now(timezone.utc).date()
+                if today != compacted_on:
+                    self.compact(today)
+                    compacted_on = today
+                else:
+                    self.save()
+            except Exception as e:
+                logger.warning(f"Doctor metrics snapshot failed: {e}")
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BROADCAST = '*'
+
+
+class Subscription:
+    """One connected screen: a bounded queue of events plus an overflow flag."""
+
+    def __init__(self, doctor_id, max_queue):
+        self.doctor_id = doctor_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next event dict, or None when nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    """In-process fan-out of dashboard events to SSE subscribers, keyed by doctor.
+
+    Each worker process has its own hub. Events that originate in shared
+    storage reach every worker's hub through a feed such as AlertFeed rather
+    than being published only where they happened.
+
+    Every event gets an id '<epoch>-<sequence>': the epoch is fixed when the
+    hub is created and the sequence increases by one per event. Events go
+    either to one doctor or to every doctor (BROADCAST) and are kept in a
+    bounded replay buffer, so a client reconnecting with Last-Event-ID
+    receives what it missed. An id from another epoch (issued before a
+    restart, or by another worker process) cannot be resumed from, so that client
+    gets a fresh snapshot instead of a replay that skips events. Each subscriber has a bounded queue. A client that falls that
+    far behind is marked overflowed and disconnected instead of blocking
+    publishers or growing memory. It then resumes from the replay buffer
+    on reconnect.
+    """
+
+    def __init__(self, replay_size=1000, max_queue=256):
+        self.max_queue = max_queue
+        self._buffer = deque(maxlen=replay_size)
+        self._subscribers = {}  # doctor_id -> set of Subscription
+        self.epoch = format(time.time_ns() // 1000, 'x')
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self._counts = {'published': 0, 'delivered': 0, 'overflows': 0}
+
+    def publish(self, event, data, doctor_id=BROADCAST):
+        with self._lock:
+            item = {'seq': self._next_seq, 'id': self._format_id(self._next_seq), 'event': event, 'data': data, 'doctor_id': doctor_id}
+            self._next_seq += 1
+            self._buffer.append(item)
+            self._counts['published'] += 1
+            if doctor_id == BROADCAST:
+                targets = [s for subs in self._subscribers.values() for s in subs]
+            else:
+                targets = list(self._subscribers.get(doctor_id, ()))
+            for subscription in targets:
+                self._offer(subscription, item)
+            return item['id']
+
+    def subscribe(self, doctor_id, last_event_id=None):
+        """Register a subscriber. Returns (subscription, resumed): resumed is False when the client must resync.
+
+        Replay and registration happen under one lock, so no event published in
+        between is lost or duplicated.
+        """
+        subscription = Subscription(doctor_id, self.max_queue)
+        with self._lock:
+            resumed = False
+            last_seq = self._parse_id(last_event_id)
+            if last_seq is not None:
+                oldest = self._buffer[0]['seq'] if self._buffer else self._next_seq
+                # Resumable only if nothing after last_event_id has already fallen out of the buffer
+                if oldest <= last_seq + 1 and last_seq < self._next_seq:
+                    resumed = True
+                    for item in self._buffer:
+                        if item['seq'] > last_seq and item['doctor_id'] in (BROADCAST, doctor_id):
+                            self._offer(subscription, item)
+            self._subscribers.setdefault(doctor_id, set()).add(subscription)
+        return subscription, resumed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscribers.get(subscription.doctor_id)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscribers[subscription.doctor_id]
+
+    def connected_doctors(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def last_event_id(self):
+        with self._lock:
+            return self._format_id(self._next_seq - 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counts,
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'doctors': len(self._subscribers),
+                'replay_buffer': len(self._buffer),
+                'last_event_id': self._format_id(self._next_seq - 1),
+            }
+
+    def _format_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def _parse_id(self, event_id):
+        """Sequence number of an id from this hub's epoch, else None."""
+        epoch, _, seq = str(event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _offer(self, subscription, item):
+        if subscription.overflowed:
+            return
+        try:
+            subscription.queue.put_nowait(item)
+            self._counts['delivered'] += 1
+        except queue.Full:
+            subscription.overflowed = True
+            self._counts['overflows'] += 1
+            logger.info(f"Event subscriber for doctor {subscription.doctor_id} fell behind; disconnecting it to resume later.")
+
+
+class StreamTickets:
+    """Short-lived, single-use tickets for opening an event stream.
+
+    EventSource cannot send an Authorization header. Instead of putting the
+    bearer token in the URL, where it ends up in proxy and access logs, the
+    client exchanges it for a ticket and opens the stream with ?ticket=. A
+    ticket is valid for ttl seconds and only once. Tickets are kept in SQLite
+    (only their hashes), so the stream may be opened on a different worker
+    process from the one that issued the ticket.
+    """
+
+    def __init__(self, db_path, ttl=30.0, busy_timeout=5.0):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stream_tickets (
+                    ticket_hash TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _hash(ticket):
+        return hashlib.sha256(str(ticket).encode('utf-8')).hexdigest()
+
+    def issue(self, user_id):
+        ticket = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stream_tickets WHERE expires_at <= ?', (now,))
+            conn.execute('INSERT INTO stream_tickets VALUES (?, ?, ?)', (self._hash(ticket), str(user_id), now + self.ttl))
+        return ticket
+
+    def redeem(self, ticket):
+        """The user a ticket was issued to, or None if it is unknown, expired or already used."""
+        ticket_hash = self._hash(ticket)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT user_id, expires_at FROM stream_tickets WHERE ticket_hash = ?', (ticket_hash,)).fetchone()
+                if row is not None:
+                    conn.execute('DELETE FROM stream_tickets WHERE ticket_hash = ?', (ticket_hash,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+
+class AlertFeed:
+    """Publishes alerts stored by any worker process to this process's hub.
+
+    A background thread polls the shared store every interval seconds, or at
+    once after poll_now() (e.g. when this process has just stored alerts).
+    It follows the store's cursor from the newest alert present at startup,
+    so every worker publishes each alert exactly once to its own
+    subscribers. on_alerts, if given, is called with each new batch.
+    """
+
+    def __init__(self, hub, last_cursor, fetch_after, interval=2.0, on_alerts=None):
+        self.hub = hub
+        self.fetch_after = fetch_after
+        self.interval = interval
+        self.on_alerts = on_alerts
+        self._cursor = last_cursor()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='alert-feed', daemon=True)
+        self._thread.start()
+
+    def poll_now(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Alert feed poll failed: {e}")
+
+    def poll(self):
+        while True:
+            rows = self.fetch_after(self._cursor)
+            if not rows:
+                return
+            alerts = []
+            for cursor, alert in rows:
+                self.hub.publish('alert', alert)
+                alerts.append(alert)
+                self._cursor = cursor
+            if self.on_alerts is not None:
+                self.on_alerts(alerts)
+
+
+class UrgentCasesWatcher:
+    """Pushes a doctor's urgent cases to the hub whenever they change.
+
+    Refreshes run on a background thread and query only doctors with an open
+    connection. They happen every interval seconds, or sooner when
+    invalidate() is called, e.g. after a consultation update or a critical
+    vitals alert. Invalidations within debounce seconds are coalesced into
+    one query per doctor. An event is published only if the result differs
+    from the last one sent.
+    """
+
+    def __init__(self, hub, fetch_urgent_cases, interval=60.0, debounce=1.0):
+        self.hub = hub
+        self.fetch_urgent_cases = fetch_urgent_cases
+        self.interval = interval
+        self.debounce = debounce
+        self._digests = {}
+        self._dirty = set()
+        self._all_dirty = False
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='urgent-cases-watcher', daemon=True)
+        self._thread.start()
+
+    def invalidate(self, doctor_id=None):
+        """Schedule a refresh for one doctor, or for every connected doctor when doctor_id is None."""
+        with self._lock:
+            if doctor_id is None:
+                self._all_dirty = True
+            else:
+                self._dirty.add(doctor_id)
+        self._wakeup.set()
+
+    def forget(self, doctor_id):
+        """Drop the last-sent digest so the next refresh publishes even if nothing changed."""
+        with self._lock:
+            self._digests.pop(doctor_id, None)
+
+    def _run(self):
+        while True:
+            woken = self._wakeup.wait(timeout=self.interval)
+            if woken:
+                self._wakeup.wait(timeout=self.debounce)  # let a burst of invalidations settle
+            self._wakeup.clear()
+            connected = set(self.hub.connected_doctors())
+            with self._lock:
+                doctors = connected if (self._all_dirty or not woken) else (self._dirty & connected)
+                self._dirty.clear()
+                self._all_dirty = False
+                for doctor_id in list(self._digests):
+                    if doctor_id not in connected:
+                        del self._digests[doctor_id]
+            for doctor_id in doctors:
+                self.refresh(doctor_id)
+
+    def refresh(self, doctor_id):
+        try:
+            cases = self.fetch_urgent_cases(doctor_id) or []
+        except Exception as e:
+            logger.warning(f"Urgent case refresh failed for doctor {doctor_id}: {e}")
+            return
+        digest = hashlib.sha256(json.dumps(cases, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        with self._lock:
+            if self._digests.get(doctor_id) == digest:
+                return
+            self._digests[doctor_id] = digest
+        self.hub.publish('urgent_cases', {'urgent_cases': cases}, doctor_id=doctor_id)
@@ -0,0 +1,218 @@
+import math
+import threading
+import time
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+BASIC = 'basic'  # Capability of a unit reported without any
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_coordinates(location):
+    """(lat, lng) from {'lat', 'lng'} / {'latitude', 'longitude'} dicts or a 'lat,lng' string, else None."""
+    try:
+        if isinstance(location, dict):
+            lat = location.get('lat', location.get('latitude'))
+            lng = location.get('lng', location.get('lon', location.get('longitude')))
+        elif isinstance(location, (list, tuple)) and len(location) == 2:
+            lat, lng = location
+        elif isinstance(location, str) and ',' in location:
+            lat, lng = location.split(',', 1)
+        else:
+            return None
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        return None
+    return lat, lng
+
+
+class FleetSpatialIndex:
+    """In-memory uniform grid over ambulance and hospital positions.
+
+    Units are bucketed into cell_size_deg x cell_size_deg cells, so a
+    position update is O(1): the unit moves between two cell sets. A
+    k-nearest query searches rings of cells outward from the caller. It
+    stops once the k-th best distance is closer than anything the next
+    ring could hold. The cost depends on local density, not fleet size.
+
+    A unit reported without capabilities is a basic unit. It serves only
+    basic_types (general medical calls), never a specialty emergency type
+    such as cardiac or neonatal that needs a listed capability.
+    """
+
+    def __init__(self, cell_size_deg=0.01, max_search_km=200.0, basic_types=('basic', 'medical')):
+        self.cell_size_deg = cell_size_deg
+        self.max_search_km = max_search_km
+        self.basic_types = frozenset(basic_types)
+        self._cells = {}  # (kind, row, col) -> set of unit ids
+        self._units = {}  # unit_id -> dict
+        self._lock = threading.Lock()
+        self._updates = 0
+
+    # ---------- updates ----------
+
+    def upsert(self, unit_id, lat, lng, kind='ambulance', capabilities=None, available=None):
+        """Add a unit or update its position and, when given, its capabilities and availability."""
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None:
+                unit = self._units[unit_id] = {
+                    'unit_id': unit_id, 'kind': kind, 'lat': lat, 'lng': lng,
+                    'capabilities': frozenset(capabilities or (BASIC,)), 'available': True if available is None else bool(available),
+                    'cell': None, 'updated_at': time.time(),
+                }
+            else:
+                if unit['kind'] != kind and unit['cell'] is not None:
+                    self._discard_from_cell(unit_id, unit['cell'])
+                    unit['cell'] = None
+                unit.update(kind=kind, lat=lat, lng=lng, updated_at=time.time())
+                if capabilities is not None:
+                    unit['capabilities'] = frozenset(capabilities or (BASIC,))
+                if available is not None:
+                    unit['available'] = bool(available)
+            self._place(unit)
+            self._updates += 1
+
+    def update_position(self, unit_id, lat, lng):
+        """Fast path for a moving unit. Returns False for unknown units."""
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None:
+                return False
+            unit['lat'], unit['lng'], unit['updated_at'] = lat, lng, time.time()
+            self._place(unit)
+            self._updates += 1
+            return True
+
+    def set_available(self, unit_id, available):
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit is None:
+                return False
+            unit['available'] = bool(available)
+            return True
+
+    def remove(self, unit_id):
+        with self._lock:
+            unit = self._units.pop(unit_id, None)
+            if unit is not None and unit['cell'] is not None:
+                self._discard_from_cell(unit_id, unit['cell'])
+
+    # ---------- queries ----------
+
+    def nearest(self, lat, lng, k=1, kind='ambulance', capability=None, available_only=True, max_distance_km=None):
+        """Up to k matching units ordered by distance, each with distance_km."""
+        with self._lock:
+            return [self._public(unit, distance) for distance, unit in
+                    self._search(lat, lng, k, kind, capability, available_only, max_distance_km)]
+
+    def reserve_nearest(self, lat, lng, capability=None, kind='ambulance', max_distance_km=None):
+        """Atomically pick the nearest available unit and mark it unavailable. Returns it, or None."""
+        with self._lock:
+            found = self._search(lat, lng, 1, kind, capability, True, max_distance_km)
+            if not found:
+                return None
+            distance, unit = found[0]
+            unit['available'] = False
+            return self._public(unit, distance)
+
+    def get(self, unit_id):
+        with self._lock:
+            unit = self._units.get(unit_id)
+            return self._public(unit) if unit else None
+
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for unit in self._units.values():
+                counts = kinds.setdefault(unit['kind'], {'total': 0, 'available': 0})
+                counts['total'] += 1
+                counts['available'] += unit['available']
+            return {'units': kinds, 'cells': len(self._cells), 'position_updates': self._updates}
+
+    # ---------- internals ----------
+
+    def _cell_of(self, kind, lat, lng):
+        return kind, int(math.floor(lat / self.cell_size_deg)), int(math.floor(lng / self.cell_size_deg))
+
+    def _place(self, unit):
+        cell = self._cell_of(unit['kind'], unit['lat'], unit['lng'])
+        if cell == unit['cell']:
+            return
+        if unit['cell'] is not None:
+            self._discard_from_cell(unit['unit_id'], unit['cell'])
+        self._cells.setdefault(cell, set()).add(unit['unit_id'])
+        unit['cell'] = cell
+
+    def _discard_from_cell(self, unit_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(unit_id)
+            if not members:
+                del self._cells[cell]
+
+    def _matches(self, unit, capability, available_only):
+        if available_only and not unit['available']:
+            return False
+        if capability is None or capability in unit['capabilities']:
+            return True
+        return capability in self.basic_types and BASIC in unit['capabilities']
+
+    def _search(self, lat, lng, k, kind, capability, available_only, max_distance_km):
+        limit_km = min(max_distance_km or self.max_search_km, self.max_search_km)
+        _, row, col = self._cell_of(kind, lat, lng)
+        # Smallest ground distance one cell step can cover near this latitude (longitude cells shrink toward the poles)
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + self.cell_size_deg * 2, 89.9))), 1e-6)
+        step_km = self.cell_size_deg * KM_PER_DEGREE_LAT * cos_lat
+        max_ring = int(limit_km / step_km) + 1
+
+        best = []  # sorted [(distance, unit)]
+        for ring in range(max_ring + 1):
+            # Everything in this ring is at least (ring - 1) steps away
+            if len(best) >= k and best[k - 1][0] <= (ring - 1) * step_km:
+                break
+            for cell_row, cell_col in self._ring_cells(row, col, ring):
+                members = self._cells.get((kind, cell_row, cell_col))
+                if not members:
+                    continue
+                for unit_id in members:
+                    unit = self._units[unit_id]
+                    if not self._matches(unit, capability, available_only):
+                        continue
+                    distance = haversine_km(lat, lng, unit['lat'], unit['lng'])
+                    if distance <= limit_km:
+                        best.append((distance, unit))
+            best.sort(key=lambda item: item[0])
+            del best[k:]
+        return best
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, col - ring
+            yield r, col + ring
+
+    @staticmethod
+    def _public(unit, distance=None):
+        result = {
+            'unit_id': unit['unit_id'], 'kind': unit['kind'], 'lat': unit['lat'], 'lng': unit['lng'],
+            'capabilities': sorted(unit['capabilities']), 'available': unit['available'],
+        }
+        if distance is not None:
+            result['distance_km'] = round(distance, 3)
+        return result
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStore:
+    """Idempotency keys and the responses they produced, shared by all worker processes.
+
+    Backed by SQLite in WAL mode, like the OCR cache. The first request with
+    a key claims it with an in-flight row that expires after lease seconds,
+    so a request that died mid-way does not block its key for good. Once it
+    finishes, its response is stored for ttl seconds, or the claim is
+    dropped if it should not be replayed (5xx), so a retry can run again.
+    A duplicate arriving on any worker sees the claim or the stored response.
+    At most max_keys keys are kept; the oldest stored responses go first.
+    """
+
+    CLAIMED = 'claimed'
+    PENDING = 'pending'
+    STORED = 'stored'
+
+    def __init__(self, db_path, ttl=24 * 3600, max_keys=10000, lease=120.0, busy_timeout=5.0):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lease = lease
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    status INTEGER,
+                    headers_json TEXT,
+                    body BLOB,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    def begin(self, scope, fingerprint):
+        """Claim scope, or report how it is held. Returns (state, record).
+
+        CLAIMED: this caller runs the request; record['owner'] goes to finish()
+        or abandon(). PENDING: another request is running it. STORED: record
+        holds the stored response (status, headers, body). record['fingerprint']
+        is always the body hash the key was first used with.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+                row = conn.execute(
+                    'SELECT fingerprint, status, headers_json, body FROM idempotency_keys WHERE scope = ?', (scope,)
+                ).fetchone()
+                if row is None:
+                    owner = secrets.token_hex(16)
+                    conn.execute('INSERT INTO idempotency_keys VALUES (?, ?, ?, NULL, NULL, NULL, ?)',
+                                 (scope, fingerprint, owner, now + self.lease))
+                    self._evict(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return self.CLAIMED, {'fingerprint': fingerprint, 'owner': owner}
+        return self._record(row)
+
+    def wait(self, scope, timeout, poll_interval=0.05):
+        """Poll a PENDING key for up to timeout seconds. Returns begin()-style (state, record), or (None, None) if it was dropped."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                row = conn.execute(
+                    'SELECT fingerprint, status, headers_json, body FROM idempotency_keys WHERE scope = ? AND expires_at > ?',
+                    (scope, time.time())
+                ).fetchone()
+            if row is None:
+                return None, None
+            state, record = self._record(row)
+            if state == self.STORED or time.monotonic() >= deadline:
+                return state, record
+            time.sleep(poll_interval)
+
+    def finish(self, scope, owner, status, headers, body):
+        """Store the response for a claimed key so duplicates replay it."""
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE idempotency_keys SET status = ?, headers_json = ?, body = ?, expires_at = ? WHERE scope = ? AND owner = ?',
+                (status, json.dumps(headers), sqlite3.Binary(body), time.time() + self.ttl, scope, owner)
+            )
+
+    def abandon(self, scope, owner):
+        """Drop a claim without storing a response, so the next attempt runs the request."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM idempotency_keys WHERE scope = ? AND owner = ? AND status IS NULL', (scope, owner))
+
+    def _evict(self, conn):
+        excess = conn.execute('SELECT COUNT(*) FROM idempotency_keys').fetchone()[0] - self.max_keys
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM idempotency_keys WHERE scope IN ('
+                'SELECT scope FROM idempotency_keys WHERE status IS NOT NULL ORDER BY expires_at LIMIT ?)',
+                (excess,)
+            )
+
+    def _record(self, row):
+        fingerprint, status, headers_json, body = row
+        if status is None:
+            return self.PENDING, {'fingerprint': fingerprint}
+        return self.STORED, {'fingerprint': fingerprint, 'status': status,
+                             'headers': [tuple(h) for h in json.loads(headers_json)], 'body': bytes(body)}
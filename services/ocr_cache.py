@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OCRResultCache:
+    """Persistent OCR result cache keyed by file content hash and OCR engine version.
+
+    Backed by SQLite in WAL mode, so it survives restarts and can be shared
+    by several worker processes. Each call opens its own short-lived
+    autocommit connection, which also makes it safe across Flask threads.
+    Total stored text is capped at max_bytes; least recently used entries
+    go first.
+    """
+
+    def __init__(self, db_path, max_bytes=256 * 1024 * 1024, busy_timeout=5.0):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    content_hash TEXT NOT NULL,
+                    engine_version TEXT NOT NULL,
+                    extracted_text TEXT NOT NULL,
+                    pages_json TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (content_hash, engine_version)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache (last_access)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, content_hash, engine_version):
+        """Return {'extracted_text', 'pages'} for a cached document, or None."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    'SELECT extracted_text, pages_json FROM ocr_cache WHERE content_hash = ? AND engine_version = ?',
+                    (content_hash, engine_version)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    'UPDATE ocr_cache SET last_access = ? WHERE content_hash = ? AND engine_version = ?',
+                    (time.time(), content_hash, engine_version)
+                )
+            return {'extracted_text': row[0], 'pages': json.loads(row[1]) if row[1] else None}
+        except sqlite3.Error as e:
+            # A cache failure should never fail the OCR request itself
+            logger.warning(f"OCR cache read failed: {e}")
+            return None
+
+    def put(self, content_hash, engine_version, extracted_text, pages=None):
+        pages_json = json.dumps(pages) if pages is not None else None
+        size = len(extracted_text.encode('utf-8')) + len(pages_json or '')
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                # IMMEDIATE takes the write lock up front so concurrent writers queue instead of deadlocking
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (content_hash, engine_version, extracted_text, pages_json, size, now, now)
+                    )
+                    self._evict(conn)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.warning(f"OCR cache write failed: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for content_hash, engine_version, size in conn.execute(
+                'SELECT content_hash, engine_version, size FROM ocr_cache ORDER BY last_access ASC'):
+            victims.append((content_hash, engine_version))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany('DELETE FROM ocr_cache WHERE content_hash = ? AND engine_version = ?', victims)
+        logger.info(f"Evicted {len(victims)} OCR cache entries ({freed} bytes).")
+
+    def stats(self):
+        with self._connect() as conn:
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()
+        return {'entries': count, 'bytes': total, 'max_bytes': self.max_bytes}
@@ -0,0 +1,254 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _ReleasingIterable:
+    """Wraps a WSGI response so an admission slot is held until the body has been fully sent."""
+
+    def __init__(self, iterable, release):
+        self._iterable = iterable
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._release()
+
+
+class PriorityLaneMiddleware:
+    """WSGI middleware that keeps server threads free for priority (emergency) requests.
+
+    In a threaded server every request, waiting or running, holds one of the
+    server's threads. So the only way to guarantee an emergency request a
+    thread is to stop other traffic from taking them all. Heavy paths (AI
+    inference, OCR, ...) go through a bounded admission queue: at most
+    heavy_max_concurrent run at once, at most heavy_max_queued wait (up to
+    heavy_queue_timeout) for a slot, and anything beyond that is shed with
+    503 and Retry-After. Long-lived streaming paths (live dictation) are
+    capped separately at stream_max_concurrent, with no queue, so one
+    session cannot hold a heavy slot for minutes. Open event feeds (SSE
+    dashboards, matched by exact path in event_paths) hold a thread for as
+    long as the page is open and get their own cap, event_max_connections.
+
+    Given server_threads, the limits are fitted so that heavy, streaming and
+    event requests together never use more than server_threads - reserved_threads.
+    The queue shrinks first, then the stream cap, then the event cap, then concurrency. Priority
+    requests then always find a free thread and run inline on it, with no
+    hand-off to another pool.
+    """
+
+    def __init__(self, wsgi_app, priority_prefixes=('/api/emergency/',), heavy_prefixes=(), stream_prefixes=(),
+                 event_paths=(), server_threads=None, reserved_threads=2, heavy_max_concurrent=4, heavy_max_queued=1,
+                 heavy_queue_timeout=5.0, stream_max_concurrent=1, event_max_connections=4, priority_slo_ms=250.0,
+                 metrics=None):
+        self.wsgi_app = wsgi_app
+        self.priority_prefixes = tuple(priority_prefixes)
+        self.heavy_prefixes = tuple(heavy_prefixes)
+        self.stream_prefixes = tuple(stream_prefixes)
+        self.event_paths = frozenset(event_paths)
+        self.server_threads = server_threads
+        self.reserved_threads = reserved_threads
+        self.heavy_max_concurrent = heavy_max_concurrent
+        self.heavy_max_queued = heavy_max_queued
+        self.stream_max_concurrent = stream_max_concurrent if self.stream_prefixes else 0
+        self.event_max_connections = event_max_connections if self.event_paths else 0
+        if server_threads:
+            self._fit_to_server()
+        self.heavy_queue_timeout = heavy_queue_timeout
+        self.priority_slo_ms = priority_slo_ms
+        self.metrics = metrics
+        self._heavy_slots = threading.BoundedSemaphore(max(self.heavy_max_concurrent, 1))
+        self._capped = {
+            'stream': (threading.BoundedSemaphore(max(self.stream_max_concurrent, 1)), self.stream_max_concurrent,
+                       'Too many live streaming sessions; please retry shortly.'),
+            'event': (threading.BoundedSemaphore(max(self.event_max_connections, 1)), self.event_max_connections,
+                      'Too many open event streams on this server; please retry shortly.'),
+        }
+        self._lock = threading.Lock()
+        self._heavy_running = 0
+        self._heavy_waiting = 0
+        self._capped_running = {'stream': 0, 'event': 0}
+        self._counts = {'priority': 0, 'priority_slo_met': 0, 'heavy_admitted': 0, 'heavy_rejected': 0,
+                        'stream_admitted': 0, 'stream_rejected': 0, 'event_admitted': 0, 'event_rejected': 0}
+
+    def _fit_to_server(self):
+        budget = max(self.server_threads - self.reserved_threads, 0)
+        requested = (self.heavy_max_concurrent, self.heavy_max_queued, self.stream_max_concurrent, self.event_max_connections)
+        overflow = sum(requested) - budget
+        if overflow <= 0:
+            return
+        cut = min(self.heavy_max_queued, overflow)
+        self.heavy_max_queued -= cut
+        overflow -= cut
+        cut = min(self.stream_max_concurrent, overflow)
+        self.stream_max_concurrent -= cut
+        overflow -= cut
+        cut = min(self.event_max_connections, overflow)
+        self.event_max_connections -= cut
+        overflow -= cut
+        self.heavy_max_concurrent -= min(self.heavy_max_concurrent, overflow)
+        logger.warning(
+            f"Heavy/stream/event limits (concurrent, queued, streams, event feeds) {requested} exceed the {budget} server "
+            f"threads not reserved for emergencies; using ({self.heavy_max_concurrent}, {self.heavy_max_queued}, "
+            f"{self.stream_max_concurrent}, {self.event_max_connections})."
+        )
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.priority_prefixes):
+            return self._call_priority(environ, start_response)
+        if self.stream_prefixes and path.startswith(self.stream_prefixes):
+            return self._call_capped('stream', environ, start_response)
+        if path in self.event_paths:
+            return self._call_capped('event', environ, start_response)
+        if self.heavy_prefixes and path.startswith(self.heavy_prefixes):
+            return self._call_heavy(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    # ---------- priority lane ----------
+
+    def _call_priority(self, environ, start_response):
+        received = time.perf_counter()
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            # Emergency responses are small JSON bodies; materialize them so the latency covers the whole response
+            body = [chunk for chunk in iterable]
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+        elapsed_ms = (time.perf_counter() - received) * 1000.0
+        with self._lock:
+            self._counts['priority'] += 1
+            if elapsed_ms <= self.priority_slo_ms:
+                self._counts['priority_slo_met'] += 1
+        if self.metrics is not None:
+            self.metrics.record('emergency_ms', elapsed_ms)
+        if elapsed_ms > self.priority_slo_ms:
+            logger.warning(f"Emergency request {environ.get('PATH_INFO')} took {elapsed_ms:.1f} ms (SLO {self.priority_slo_ms:.0f} ms).")
+        return body
+
+    # ---------- streaming and event lanes ----------
+
+    def _call_capped(self, lane, environ, start_response):
+        slots, limit, message = self._capped[lane]
+        acquired = limit > 0 and slots.acquire(blocking=False)
+        with self._lock:
+            self._counts[f'{lane}_admitted' if acquired else f'{lane}_rejected'] += 1
+            if acquired:
+                self._capped_running[lane] += 1
+        if not acquired:
+            return self._reject(start_response, message)
+
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                with self._lock:
+                    self._capped_running[lane] -= 1
+                slots.release()
+
+        try:
+            return _ReleasingIterable(self.wsgi_app(environ, start_response), release)
+        except Exception:
+            release()
+            raise
+
+    # ---------- heavy lane admission ----------
+
+    def _call_heavy(self, environ, start_response):
+        if self.heavy_max_concurrent <= 0:
+            with self._lock:
+                self._counts['heavy_rejected'] += 1
+            return self._reject(start_response)
+        # A free slot is taken without queueing; only when all are busy does the request wait
+        acquired = self._heavy_slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                if self._heavy_waiting >= self.heavy_max_queued:
+                    self._counts['heavy_rejected'] += 1
+                    return self._reject(start_response)
+                self._heavy_waiting += 1
+            acquired = self._heavy_slots.acquire(timeout=self.heavy_queue_timeout)
+            with self._lock:
+                self._heavy_waiting -= 1
+        with self._lock:
+            if not acquired:
+                self._counts['heavy_rejected'] += 1
+            else:
+                self._counts['heavy_admitted'] += 1
+                self._heavy_running += 1
+        if not acquired:
+            return self._reject(start_response)
+
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                with self._lock:
+                    self._heavy_running -= 1
+                self._heavy_slots.release()
+
+        try:
+            return _ReleasingIterable(self.wsgi_app(environ, start_response), release)
+        except Exception:
+            release()
+            raise
+
+    @staticmethod
+    def _reject(start_response, message='Server is busy with AI requests; please retry shortly.'):
+        body = json.dumps({'error': message}).encode('utf-8')
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', '1'),
+        ])
+        return [body]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            running, waiting = self._heavy_running, self._heavy_waiting
+            streams, events = self._capped_running['stream'], self._capped_running['event']
+        summary = self.metrics.summary('emergency_ms') if self.metrics is not None else None
+        return {
+            'priority': {
+                'requests': counts['priority'],
+                'slo_ms': self.priority_slo_ms,
+                'slo_attainment': round(counts['priority_slo_met'] / counts['priority'], 4) if counts['priority'] else None,
+                'latency_ms': summary,
+            },
+            'heavy': {
+                'running': running,
+                'waiting': waiting,
+                'max_concurrent': self.heavy_max_concurrent,
+                'max_queued': self.heavy_max_queued,
+                'admitted': counts['heavy_admitted'],
+                'rejected': counts['heavy_rejected'],
+            },
+            'stream': {
+                'running': streams,
+                'max_concurrent': self.stream_max_concurrent,
+                'admitted': counts['stream_admitted'],
+                'rejected': counts['stream_rejected'],
+            },
+            'event': {
+                'running': events,
+                'max_connections': self.event_max_connections,
+                'admitted': counts['event_admitted'],
+                'rejected': counts['event_rejected'],
+            },
+            'server_threads': self.server_threads,
+            'reserved_threads': self.reserved_threads,
+        }
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_text(value):
+    """Case-fold and collapse whitespace so trivially different inputs share a key."""
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def symptom_cache_key(symptoms, duration, severity, medical_history, vital_signs):
+    """Stable cache key for a symptom-analysis request."""
+    history = sorted({normalize_text(item) for item in (medical_history or []) if normalize_text(item)})
+    vitals = {str(k): normalize_text(v) for k, v in (vital_signs or {}).items() if v not in (None, '')}
+    payload = json.dumps(
+        [normalize_text(symptoms), normalize_text(duration), normalize_text(severity), history, vitals],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CoalescingCache:
+    """Bounded LRU/TTL result cache that also coalesces concurrent identical requests.
+
+    The first caller for a key runs compute(); callers that arrive while it
+    is running wait on the same Future and share its result (or exception),
+    so only one model call is ever in flight per key. Falsy results and
+    exceptions are not cached.
+    """
+
+    HIT = 'HIT'
+    MISS = 'MISS'
+    COALESCED = 'COALESCED'
+
+    def __init__(self, max_entries=512, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._counts = {self.HIT: 0, self.MISS: 0, self.COALESCED: 0}
+
+    def get_or_compute(self, key, compute, timeout=None, should_cache=None):
+        """Return (value, outcome) where outcome is HIT, MISS or COALESCED.
+
+        should_cache(value) can veto storing a result; callers already
+        waiting on it still receive it.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counts[self.HIT] += 1
+                return entry[1], self.HIT
+            if entry:
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._counts[self.COALESCED] += 1
+                owner = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self._counts[self.MISS] += 1
+                owner = True
+
+        if not owner:
+            return future.result(timeout=timeout), self.COALESCED
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if value and (should_cache is None or should_cache(value)):
+                self._store(key, value)
+        future.set_result(value)
+        return value, self.MISS
+
+    def get(self, key):
+        """Cached value for key, or None. Does not wait on in-flight computations."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counts[self.HIT] += 1
+                return entry[1]
+            return None
+
+    def put(self, key, value):
+        if not value:
+            return
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'hits': self._counts[self.HIT],
+                'misses': self._counts[self.MISS],
+                'coalesced': self._counts[self.COALESCED],
+            }
@@ -0,0 +1,488 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Feature order and encoding for each model, mirroring the single-row preparation in /api/ml-diagnosis
+HEART_FEATURES = ["age", "sex", "cp", "trestbps", "chol", "fbs", "restecg", "thalach", "exang", "oldpeak", "slope", "ca", "thal"]
+HEART_INT_FEATURES = ["sex", "fbs", "exang", "ca", "thal", "cp", "restecg", "slope"]
+CANCER_FEATURES = ['Age', 'Gender', 'BMI', 'Smoking', 'GeneticRisk', 'PhysicalActivity', 'AlcoholIntake', 'CancerHistory']
+CANCER_FLAG_FEATURES = ['Smoking', 'GeneticRisk', 'CancerHistory']
+DIABETES_FEATURES = ['AGE', 'GENDER', 'UREA', 'CR', 'HBA1C', 'CHOL', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
+KIDNEY_FEATURES = ['gravity', 'ph', 'osmo', 'cond', 'urea', 'calc']
+
+# ml-diagnosis model_name -> key used in stored scores
+RISK_MODELS = {
+    'heart_disease': 'heart',
+    'cancer_prediction': 'cancer',
+    'diabetes_prediction': 'diabetes',
+    'kidney_stone_detection': 'kidney',
+}
+
+NEGATIVE_LABELS = {'n', 'no', 'negative', '0'}
+
+
+def _numeric(frame, column, default=0.0):
+    if column not in frame:
+        return np.full(len(frame), default, dtype=np.float64)
+    return pd.to_numeric(frame[column], errors='coerce').fillna(default).to_numpy(dtype=np.float64)
+
+
+def _lease_holder_alive(holder):
+    """False when holder is a process on this host that no longer exists; True when alive or unknown.
+
+    Owners are '<host>-<pid>-<nonce>'. A restarted server, even one that got
+    the same pid (as PID 1 in a container does), no longer counts as the
+    holder, so it can resume its own run without waiting out the lease.
+    """
+    try:
+        host, pid, _ = holder.rsplit('-', 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return True
+    if host != socket.gethostname() or os.name != 'posix':
+        return True
+    if pid == os.getpid():
+        return False  # Our pid, but not our owner id: an earlier incarnation of this process
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _positive_index(model, class_encoder=None):
+    """Column of predict_proba that means 'has the condition'."""
+    classes = list(getattr(model, 'classes_', [0, 1]))
+    labels = class_encoder.inverse_transform(classes) if class_encoder is not None else classes
+    positives = [i for i, label in enumerate(labels) if str(label).strip().lower() not in NEGATIVE_LABELS]
+    return positives or [len(classes) - 1]
+
+
+class RiskModels:
+    """The joblib models and scalers loaded in app.py, applied to many patients per call.
+
+    Each prepare_* builds the whole chunk's feature matrix with column
+    operations, using the same defaults as /api/ml-diagnosis (0 for a
+    missing or unparseable value). One transform and one predict_proba then
+    cover the chunk. A model whose artifacts failed to load is skipped.
+    """
+
+    def __init__(self, heart_model=None, heart_scaler=None, cancer_model=None, cancer_scaler=None,
+                 diabetes_model=None, diabetes_scaler=None, diabetes_class_encoder=None, diabetes_gender_encoder=None,
+                 kidney_model=None, kidney_scaler=None):
+        self.models = {}
+        if heart_model is not None and heart_scaler is not None:
+            self.models['heart'] = (heart_model, heart_scaler, self.prepare_heart, _positive_index(heart_model))
+        if cancer_model is not None and cancer_scaler is not None:
+            self.models['cancer'] = (cancer_model, cancer_scaler, self.prepare_cancer, _positive_index(cancer_model))
+        if all(x is not None for x in (diabetes_model, diabetes_scaler, diabetes_class_encoder, diabetes_gender_encoder)):
+            self.diabetes_gender_encoder = diabetes_gender_encoder
+            self.models['diabetes'] = (diabetes_model, diabetes_scaler, self.prepare_diabetes,
+                                       _positive_index(diabetes_model, diabetes_class_encoder))
+        if kidney_model is not None and kidney_scaler is not None:
+            self.models['kidney'] = (kidney_model, kidney_scaler, self.prepare_kidney, _positive_index(kidney_model))
+
+    def prepare_heart(self, frame):
+        columns = {}
+        for feature in HEART_FEATURES:
+            values = _numeric(frame, feature)
+            columns[feature] = values.astype(np.int64) if feature in HEART_INT_FEATURES else values
+        return pd.DataFrame(columns, columns=HEART_FEATURES)
+
+    def prepare_cancer(self, frame):
+        columns = {feature: _numeric(frame, feature) for feature in CANCER_FEATURES}
+        gender = frame['Gender'] if 'Gender' in frame else pd.Series([None] * len(frame))
+        columns['Gender'] = (gender.astype(str).str.lower() == 'female').astype(int).to_numpy()
+        for feature in CANCER_FLAG_FEATURES:
+            flags = frame[feature] if feature in frame else pd.Series([None] * len(frame))
+            columns[feature] = flags.map(lambda v: 1 if v and not pd.isna(v) else 0).to_numpy()
+        return pd.DataFrame(columns, columns=CANCER_FEATURES)
+
+    def prepare_diabetes(self, frame):
+        columns = {feature: _numeric(frame, feature) for feature in DIABETES_FEATURES}
+        encoder = self.diabetes_gender_encoder
+        gender = (frame['GENDER'] if 'GENDER' in frame else pd.Series([None] * len(frame))).map(lambda v: 'Male' if v is None or pd.isna(v) else str(v))
+        # Unseen labels would make transform() raise for the whole chunk; treat them like a missing value
+        known = set(getattr(encoder, 'classes_', []))
+        if known:
+            gender = gender.where(gender.isin(known), 'Male' if 'Male' in known else sorted(known)[0])
+        columns['GENDER'] = encoder.transform(gender.to_numpy())
+        return pd.DataFrame(columns, columns=DIABETES_FEATURES)
+
+    def prepare_kidney(self, frame):
+        return pd.DataFrame({feature: _numeric(frame, feature) for feature in KIDNEY_FEATURES}, columns=KIDNEY_FEATURES)
+
+    def score(self, key, frame):
+        """Probability of the condition for each row of frame (raw inputs), as a float array."""
+        model, scaler, prepare, positive = self.models[key]
+        probabilities = model.predict_proba(scaler.transform(prepare(frame)))
+        return probabilities[:, positive].sum(axis=1)
+
+
+class RiskScoreStore:
+    """SQLite tables behind the nightly risk-scoring job and the doctor AI insights.
+
+    risk_inputs keeps the latest structured input per patient and model, as
+    submitted to /api/ml-diagnosis. It is the job's source. Each run gets its
+    own rows in risk_runs, risk_assignments, risk_scores and risk_rankings.
+    The cursor saved in risk_runs is committed with each chunk's scores, so
+    an interrupted run resumes exactly after its last finished chunk.
+
+    The 'running' row doubles as a cross-process lease. claim_run() takes it
+    under BEGIN IMMEDIATE, and every chunk renews its heartbeat. A lease
+    whose heartbeat is older than lease_seconds, or whose holder was a
+    process on this host that has exited, is stale, and another process
+    may take the run over. Readers only see the latest completed
+    run. The one before it is kept as well, so a reader that looked it up
+    just before a newer run was published can still read its rankings.
+    """
+
+    def __init__(self, db_path, busy_timeout=5.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS risk_inputs (
+                    patient_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (patient_id, model)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS risk_runs (
+                    run_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    cursor TEXT,
+                    rows INTEGER NOT NULL DEFAULT 0,
+                    seconds REAL NOT NULL DEFAULT 0,
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    owner TEXT,
+                    heartbeat_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS risk_assignments (
+                    run_id TEXT NOT NULL,
+                    doctor_id TEXT NOT NULL,
+                    patient_id TEXT NOT NULL,
+                    PRIMARY KEY (run_id, doctor_id, patient_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS risk_scores (
+                    run_id TEXT NOT NULL,
+                    patient_id TEXT NOT NULL,
+                    heart REAL,
+                    cancer REAL,
+                    diabetes REAL,
+                    kidney REAL,
+                    overall REAL NOT NULL,
+                    top_model TEXT NOT NULL,
+                    PRIMARY KEY (run_id, patient_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS risk_rankings (
+                    run_id TEXT NOT NULL,
+                    doctor_id TEXT NOT NULL,
+                    rank INTEGER NOT NULL,
+                    patient_id TEXT NOT NULL,
+                    PRIMARY KEY (run_id, doctor_id, rank)
+                ) WITHOUT ROWID;
+            """)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(risk_runs)')}
+            for column, kind in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE risk_runs ADD COLUMN {column} {kind}')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    # ---------- inputs ----------
+
+    def record_inputs(self, patient_id, model_name, input_data):
+        """Remember a patient's latest input for one of the RISK_MODELS; other model names are ignored."""
+        model = RISK_MODELS.get(model_name)
+        if model is None or patient_id is None or not isinstance(input_data, dict):
+            return
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO risk_inputs VALUES (?, ?, ?, ?)',
+                         (str(patient_id), model, json.dumps(input_data, default=str), time.time()))
+
+    def input_chunk(self, after_patient_id, limit):
+        """Inputs of the next `limit` patients (by id) after after_patient_id: {model: DataFrame with a patient_id column}."""
+        with self._connect() as conn:
+            patients = [row[0] for row in conn.execute(
+                'SELECT DISTINCT patient_id FROM risk_inputs WHERE patient_id > ? ORDER BY patient_id LIMIT ?',
+                (after_patient_id or '', int(limit)))]
+            if not patients:
+                return [], {}
+            rows = conn.execute(
+                'SELECT patient_id, model, data FROM risk_inputs WHERE patient_id >= ? AND patient_id <= ?',
+                (patients[0], patients[-1])).fetchall()
+        by_model = {}
+        for patient_id, model, data in rows:
+            by_model.setdefault(model, []).append({**json.loads(data), 'patient_id': patient_id})
+        return patients, {model: pd.DataFrame.from_records(records) for model, records in by_model.items()}
+
+    # ---------- runs ----------
+
+    def claim_run(self, owner, lease_seconds, resume=True):
+        """Take the run lease for owner. Returns the run to work on, or None while another owner's lease is live.
+
+        An unfinished run is resumed (resume=True) or abandoned; otherwise a new run is started.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT run_id, cursor, rows, seconds, owner, heartbeat_at FROM risk_runs "
+                               "WHERE status = 'running' ORDER BY started_at DESC LIMIT 1").fetchone()
+            if row is not None:
+                run_id, cursor, rows, seconds, holder, heartbeat_at = row
+                if (holder != owner and heartbeat_at is not None and heartbeat_at > now - lease_seconds
+                        and _lease_holder_alive(holder)):
+                    return None
+                if resume:
+                    conn.execute("UPDATE risk_runs SET status = 'abandoned' WHERE status = 'running' AND run_id != ?", (run_id,))
+                    conn.execute('UPDATE risk_runs SET owner = ?, heartbeat_at = ? WHERE run_id = ?', (owner, now, run_id))
+                    return {'run_id': run_id, 'cursor': cursor, 'rows': rows, 'seconds': seconds}
+                conn.execute("UPDATE risk_runs SET status = 'abandoned' WHERE status = 'running'")
+            run_id = str(uuid.uuid4())
+            conn.execute('INSERT INTO risk_runs (run_id, status, started_at, owner, heartbeat_at) VALUES (?, ?, ?, ?, ?)',
+                         (run_id, 'running', now, owner, now))
+        return {'run_id': run_id, 'cursor': None, 'rows': 0, 'seconds': 0.0}
+
+    def active_run(self, lease_seconds):
+        """The running run whose lease is live, in any process, or None. Includes when the lease runs out."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT run_id, owner, heartbeat_at FROM risk_runs WHERE status = 'running' AND heartbeat_at > ? "
+                               "ORDER BY started_at DESC LIMIT 1", (time.time() - lease_seconds,)).fetchone()
+        if not row or not _lease_holder_alive(row[1]):
+            return None
+        return {'run_id': row[0], 'owner': row[1], 'lease_expires_at': row[2] + lease_seconds}
+
+    def has_assignments(self, run_id):
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM risk_assignments WHERE run_id = ? LIMIT 1', (run_id,)).fetchone() is not None
+
+    def add_assignments(self, run_id, owner, assignments):
+        with self._transaction() as conn:
+            self._renew(conn, run_id, owner)
+            conn.executemany('INSERT OR IGNORE INTO risk_assignments VALUES (?, ?, ?)',
+                             ((run_id, str(doctor_id), str(patient_id)) for doctor_id, patient_id in assignments))
+
+    def unfinished_run(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT run_id, cursor, rows, seconds FROM risk_runs WHERE status = 'running' "
+                               "ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(zip(('run_id', 'cursor', 'rows', 'seconds'), row)) if row else None
+
+    def save_chunk(self, run_id, owner, scores, cursor, rows, seconds):
+        """Write one chunk's scores and advance the run's cursor in the same transaction, renewing the lease."""
+        with self._transaction() as conn:
+            self._renew(conn, run_id, owner)
+            conn.executemany('INSERT OR REPLACE INTO risk_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)', scores)
+            conn.execute('UPDATE risk_runs SET cursor = ?, rows = rows + ?, seconds = seconds + ? WHERE run_id = ?',
+                         (cursor, rows, seconds, run_id))
+
+    def finish_run(self, run_id, owner):
+        """Rank each doctor's patients and publish the run. Keeps the previous completed run; drops older and abandoned ones."""
+        with self._transaction() as conn:
+            self._renew(conn, run_id, owner)
+            conn.execute("""
+                INSERT INTO risk_rankings (run_id, doctor_id, rank, patient_id)
+                SELECT a.run_id, a.doctor_id,
+                       ROW_NUMBER() OVER (PARTITION BY a.doctor_id ORDER BY s.overall DESC, s.patient_id),
+                       a.patient_id
+                FROM risk_assignments a JOIN risk_scores s ON s.run_id = a.run_id AND s.patient_id = a.patient_id
+                WHERE a.run_id = ?
+            """, (run_id,))
+            conn.execute("UPDATE risk_runs SET status = 'completed', finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+            previous = conn.execute("SELECT run_id FROM risk_runs WHERE status = 'completed' AND run_id != ? "
+                                    "ORDER BY finished_at DESC LIMIT 1", (run_id,)).fetchone()
+            keep = (run_id, previous[0] if previous else run_id)
+            old_runs = [row[0] for row in conn.execute(
+                "SELECT run_id FROM risk_runs WHERE status IN ('completed', 'abandoned') AND run_id NOT IN (?, ?)", keep)]
+            for table in ('risk_assignments', 'risk_scores', 'risk_rankings', 'risk_runs'):
+                conn.executemany(f'DELETE FROM {table} WHERE run_id = ?', ((old,) for old in old_runs))
+
+    def _renew(self, conn, run_id, owner):
+        cursor = conn.execute("UPDATE risk_runs SET heartbeat_at = ? WHERE run_id = ? AND owner = ? AND status = 'running'",
+                              (time.time(), run_id, owner))
+        if cursor.rowcount == 0:
+            raise RuntimeError(f'Lost the lease on risk scoring run {run_id} to another process.')
+
+    # ---------- reads ----------
+
+    def latest_run(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT run_id, rows, seconds, started_at, finished_at FROM risk_runs "
+                               "WHERE status = 'completed' ORDER BY finished_at DESC LIMIT 1").fetchone()
+        if not row:
+            return None
+        run = dict(zip(('run_id', 'rows', 'seconds', 'started_at', 'finished_at'), row))
+        run['rows_per_sec'] = round(run['rows'] / run['seconds'], 1) if run['seconds'] else None
+        return run
+
+    def doctor_rankings(self, doctor_id, limit=50):
+        """The latest completed run's patients for a doctor, highest risk first."""
+        run = self.latest_run()
+        if run is None:
+            return None, []
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT r.rank, r.patient_id, s.overall, s.top_model, s.heart, s.cancer, s.diabetes, s.kidney
+                FROM risk_rankings r JOIN risk_scores s ON s.run_id = r.run_id AND s.patient_id = r.patient_id
+                WHERE r.run_id = ? AND r.doctor_id = ? ORDER BY r.rank LIMIT ?
+            """, (run['run_id'], str(doctor_id), int(limit))).fetchall()
+        keys = ('rank', 'patient_id', 'risk_score', 'top_model', 'heart', 'cancer', 'diabetes', 'kidney')
+        return run, [dict(zip(keys, row)) for row in rows]
+
+
+class RiskScoringJob:
+    """Scores every patient with stored model inputs, chunk by chunk, and ranks them per doctor.
+
+    Patients are read in id order, chunk_size at a time. Each model scores
+    its rows of the chunk in one vectorized call. A patient's overall risk is
+    the highest of its model scores. run() resumes an interrupted run from
+    its saved cursor instead of starting over. Throughput (model rows per
+    second) is logged per chunk and recorded on the run. Every worker
+    process schedules the job, but only the one holding the store's run
+    lease scores; the others skip that night's run.
+    """
+
+    def __init__(self, store, models, load_assignments, chunk_size=5000, lease_seconds=900):
+        self.store = store
+        self.models = models
+        self.load_assignments = load_assignments
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._running = threading.Lock()
+
+    def run(self, resume=True):
+        """Score everything now. Returns the run summary, or None when another process holds the run lease."""
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError('A risk scoring run is already in progress.')
+        try:
+            run = self.store.claim_run(self.owner, self.lease_seconds, resume)
+            if run is None:
+                logger.info("Risk scoring: another process is already running the job; skipping.")
+                return None
+            return self._run(run)
+        finally:
+            self._running.release()
+
+    @property
+    def running(self):
+        return self._running.locked() or self.store.active_run(self.lease_seconds) is not None
+
+    def _run(self, run):
+        if run['cursor'] is not None:
+            logger.info(f"Resuming risk scoring run {run['run_id']} after patient {run['cursor']}.")
+        if not self.store.has_assignments(run['run_id']):
+            self.store.add_assignments(run['run_id'], self.owner, self.load_assignments())
+        cursor, total_rows, total_seconds = run['cursor'], run['rows'], run['seconds']
+        while True:
+            started = time.perf_counter()
+            patients, frames = self.store.input_chunk(cursor, self.chunk_size)
+            if not patients:
+                break
+            scores, rows = self._score_chunk(run['run_id'], patients, frames)
+            seconds = time.perf_counter() - started
+            cursor = patients[-1]
+            self.store.save_chunk(run['run_id'], self.owner, scores, cursor, rows, seconds)
+            total_rows += rows
+            total_seconds += seconds
+            logger.info(f"Risk scoring: {len(patients)} patients, {rows} model rows in {seconds:.2f}s "
+                        f"({rows / seconds if seconds else 0:.0f} rows/s).")
+        self.store.finish_run(run['run_id'], self.owner)
+        summary = {
+            'run_id': run['run_id'],
+            'rows': total_rows,
+            'seconds': round(total_seconds, 3),
+            'rows_per_sec': round(total_rows / total_seconds, 1) if total_seconds else None,
+        }
+        logger.info(f"Risk scoring run finished: {summary}")
+        return summary
+
+    def _score_chunk(self, run_id, patients, frames):
+        scores = pd.DataFrame(index=pd.Index(patients, name='patient_id'), columns=list(RISK_MODELS.values()), dtype=np.float64)
+        rows = 0
+        for key, frame in frames.items():
+            if key not in self.models.models or frame.empty:
+                continue
+            try:
+                scores.loc[frame['patient_id'].to_numpy(), key] = self.models.score(key, frame)
+                rows += len(frame)
+            except Exception as e:
+                logger.warning(f"Risk scoring: {key} model failed on a chunk of {len(frame)} rows: {e}")
+        scores = scores.dropna(how='all')
+        if scores.empty:
+            return [], rows
+        overall = scores.max(axis=1, skipna=True)
+        top_model = scores.idxmax(axis=1, skipna=True)
+        values = scores.astype(object).where(scores.notna(), None)
+        records = [
+            (run_id, patient_id, *values.loc[patient_id].tolist(), float(overall[patient_id]), top_model[patient_id])
+            for patient_id in scores.index
+        ]
+        return records, rows
+
+    def resume_unfinished(self):
+        """Finish an interrupted run. While another live process holds its lease, wait for the lease to run out and retry."""
+        while self.store.unfinished_run() is not None:
+            try:
+                if self.run() is not None:
+                    return
+            except Exception as e:
+                logger.error(f"Resuming risk scoring failed: {e}", exc_info=True)
+                return
+            active = self.store.active_run(self.lease_seconds)
+            if active is not None:
+                # The holder renews the lease with every chunk; if it finishes, unfinished_run() ends the loop
+                time.sleep(max(active['lease_expires_at'] - time.time(), 1.0))
+
+    def schedule_nightly(self, hour_utc=2):
+        """Run once a day at hour_utc on a daemon thread. A run interrupted by a restart is resumed right away."""
+        def loop():
+            self.resume_unfinished()
+            while True:
+                now = datetime.now(timezone.utc)
+                next_run = now.replace(hour=hour_utc, minute=0, second=0, microsecond=0)
+                if next_run <= now:
+                    next_run += timedelta(days=1)
+                time.sleep((next_run - now).total_seconds())
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.error(f"Nightly risk scoring failed: {e}", exc_info=True)
+
+        threading.Thread(target=loop, name='risk-scoring-nightly', daemon=True).start()
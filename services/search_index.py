@@ -0,0 +1,386 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset('a an and are as at be by for from has in is it of on or the to was were with'.split())
+
+# Field groups are indexed separately so a record's OCR text survives
+# metadata edits (and vice versa), and so each group can be weighted.
+GROUPS = ('record', 'ocr')
+GROUP_WEIGHTS = {'record': 1.0, 'ocr': 0.6}
+TITLE_BOOST = 2  # Title terms are counted this many times
+SNAPSHOT_MAGIC = b'MRSI2\n'
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [t for t in TOKEN_RE.findall(str(text).lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+class MedicalRecordSearchIndex:
+    """Incrementally maintained inverted index over medical record text, with BM25 ranking.
+
+    On disk the index is a snapshot (one file holding the document table and
+    the posting lists, delta- and varint-encoded, replaced atomically) and an
+    append-only journal of changes made since that snapshot. Every worker
+    process keeps its own copy in memory and shares the files: operations take
+    a lock file in index_dir (shared for reads, exclusive for writes) and first
+    catch up with whatever other processes wrote, reloading when the snapshot
+    was replaced and otherwise replaying the journal from where this process
+    last read it. Once the journal grows past compact_after entries it is
+    folded into a fresh snapshot.
+    """
+
+    def __init__(self, index_dir, compact_after=5000, k1=1.2, b=0.75):
+        self.index_dir = index_dir
+        self.compact_after = compact_after
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = {group: {} for group in GROUPS}  # group -> term -> {docnum: tf}
+        self._forward = {}  # docnum -> {group: {term: tf}}
+        self._lengths = {}  # docnum -> {group: token count}
+        self._docs = {}  # docnum -> {'record_id', 'patient_id'}
+        self._docnums = {}  # record_id -> docnum
+        self._next_docnum = 0
+        self._total_length = {group: 0 for group in GROUPS}
+        self._journal_entries = 0
+        self._journal_offset = 0  # Bytes of the journal already applied to this process's copy
+        self._snapshot_stamp = None
+        os.makedirs(index_dir, exist_ok=True)
+        with self._lock, file_lock(self._lock_path, shared=True):
+            self._sync()
+        logger.info(f"Search index loaded: {len(self._docs)} documents ({self._journal_entries} journal entries replayed).")
+
+    # ---------- public API ----------
+
+    def index_record(self, record):
+        """Index (or re-index) a record's title, description and type."""
+        if not record or not record.get('id'):
+            return
+        self._mutate(self._record_entry(record))
+
+    def index_ocr_text(self, record_id, patient_id, text):
+        """Attach OCR-extracted text to a record."""
+        self._mutate({'op': 'set', 'record_id': str(record_id), 'patient_id': patient_id,
+                      'group': 'ocr', 'tf': dict(Counter(tokenize(text)))})
+
+    def remove_record(self, record_id):
+        self._mutate({'op': 'delete', 'record_id': str(record_id)})
+
+    def search(self, query, patient_ids=None, limit=20):
+        """Rank records for query with BM25. patient_ids restricts results to those patients."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        allowed = set(patient_ids) if patient_ids is not None else None
+
+        with self._lock, file_lock(self._lock_path, shared=True):
+            self._sync()
+            n_docs = len(self._docs)
+            if n_docs == 0:
+                return []
+            scores = Counter()
+            for group in GROUPS:
+                postings = self._postings[group]
+                avg_length = (self._total_length[group] / n_docs) or 1.0
+                weight = GROUP_WEIGHTS[group]
+                for term in terms:
+                    docs = postings.get(term)
+                    if not docs:
+                        continue
+                    idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for docnum, tf in docs.items():
+                        if allowed is not None and self._docs[docnum]['patient_id'] not in allowed:
+                            continue
+                        length = self._lengths[docnum].get(group, 0)
+                        norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                        scores[docnum] += weight * idf * tf * (self.k1 + 1) / norm
+
+            return [
+                {'record_id': self._docs[docnum]['record_id'], 'patient_id': self._docs[docnum]['patient_id'], 'score': round(score, 4)}
+                for docnum, score in scores.most_common(limit)
+            ]
+
+    def rebuild(self, records):
+        """Replace the whole index with records (e.g. after a cold start) and snapshot it."""
+        with self._lock, file_lock(self._lock_path):
+            self._sync()
+            ocr = {self._docs[d]['record_id']: (self._docs[d]['patient_id'], self._forward[d].get('ocr'))
+                   for d in self._docs if self._forward[d].get('ocr')}
+            self._reset()
+            for record in records:
+                if record and record.get('id'):
+                    self._apply(self._record_entry(record))
+            # OCR text cannot be recovered from the database, so carry it over
+            for record_id, (patient_id, tf) in ocr.items():
+                if record_id in self._docnums:
+                    self._apply({'op': 'set', 'record_id': record_id, 'patient_id': patient_id, 'group': 'ocr', 'tf': tf})
+            self._compact()
+
+    def stats(self):
+        with self._lock, file_lock(self._lock_path, shared=True):
+            self._sync()
+            return {
+                'documents': len(self._docs),
+                'terms': {group: len(self._postings[group]) for group in GROUPS},
+                'journal_entries': self._journal_entries,
+            }
+
+    # ---------- mutation ----------
+
+    @staticmethod
+    def _record_entry(record):
+        tf = Counter()
+        for _ in range(TITLE_BOOST):
+            tf.update(tokenize(record.get('title')))
+        tf.update(tokenize(record.get('description')))
+        tf.update(tokenize(record.get('record_type')))
+        return {'op': 'set', 'record_id': str(record['id']), 'patient_id': record.get('patient_id'),
+                'group': 'record', 'tf': dict(tf)}
+
+    def _mutate(self, entry):
+        with self._lock, file_lock(self._lock_path):
+            self._sync()
+            self._apply(entry)
+            self._append_journal(entry)
+            if self._journal_entries >= self.compact_after:
+                self._compact()
+
+    def _apply(self, entry):
+        with self._lock:
+            if entry['op'] == 'delete':
+                docnum = self._docnums.pop(entry['record_id'], None)
+                if docnum is None:
+                    return
+                for group in GROUPS:
+                    self._clear_group(docnum, group)
+                del self._forward[docnum]
+                del self._lengths[docnum]
+                del self._docs[docnum]
+            else:
+                docnum = self._docnums.get(entry['record_id'])
+                if docnum is None:
+                    docnum = self._next_docnum
+                    self._next_docnum += 1
+                    self._docnums[entry['record_id']] = docnum
+                    self._forward[docnum] = {}
+                    self._lengths[docnum] = {}
+                    self._docs[docnum] = {'record_id': entry['record_id'], 'patient_id': entry.get('patient_id')}
+                if entry.get('patient_id'):
+                    self._docs[docnum]['patient_id'] = entry['patient_id']
+                group = entry['group']
+                self._clear_group(docnum, group)
+                tf = entry['tf']
+                self._forward[docnum][group] = tf
+                postings = self._postings[group]
+                for term, count in tf.items():
+                    postings.setdefault(term, {})[docnum] = count
+                self._lengths[docnum][group] = sum(tf.values())
+                self._total_length[group] += self._lengths[docnum][group]
+
+    def _clear_group(self, docnum, group):
+        previous = self._forward.get(docnum, {}).pop(group, None)
+        if not previous:
+            return
+        postings = self._postings[group]
+        for term in previous:
+            docs = postings.get(term)
+            if docs is not None:
+                docs.pop(docnum, None)
+                if not docs:
+                    del postings[term]
+        self._total_length[group] -= self._lengths[docnum].pop(group, 0)
+
+    def _reset(self):
+        self._postings = {group: {} for group in GROUPS}
+        self._forward = {}
+        self._lengths = {}
+        self._docs = {}
+        self._docnums = {}
+        self._next_docnum = 0
+        self._total_length = {group: 0 for group in GROUPS}
+
+    # ---------- persistence ----------
+
+    @property
+    def _journal_path(self):
+        return os.path.join(self.index_dir, 'journal.jsonl')
+
+    @property
+    def _snapshot_path(self):
+        return os.path.join(self.index_dir, 'snapshot.bin')
+
+    @property
+    def _lock_path(self):
+        return os.path.join(self.index_dir, '.lock')
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _sync(self):
+        """Catch up with snapshots and journal entries written by any process. Caller holds the file lock."""
+        stamp = self._stamp(self._snapshot_path)
+        if stamp != self._snapshot_stamp:
+            self._reset()
+            self._journal_entries = 0
+            self._journal_offset = 0
+            if stamp is not None:
+                self._load_snapshot()
+            self._snapshot_stamp = stamp
+        self._replay_journal()
+
+    def _replay_journal(self):
+        try:
+            f = open(self._journal_path, 'rb')
+        except FileNotFoundError:
+            self._journal_offset = 0
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < self._journal_offset:
+                # Truncated without a new snapshot (should not happen): start over from the snapshot
+                self._snapshot_stamp = None
+                f.close()
+                self._sync()
+                return
+            f.seek(self._journal_offset)
+            data = f.read()
+        # Only whole lines count; a torn final line is a writer that crashed mid-append
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Skipping unreadable search journal entry: {e}")
+                continue
+            self._journal_entries += 1
+        self._journal_offset += end
+
+    def _append_journal(self, entry):
+        with open(self._journal_path, 'ab') as f:
+            if f.tell() > self._journal_offset:
+                f.truncate(self._journal_offset)  # Drop the torn line _replay_journal skipped
+            f.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+            self._journal_offset = f.tell()
+        self._journal_entries += 1
+
+    def compact(self):
+        """Write a fresh snapshot and truncate the journal."""
+        with self._lock, file_lock(self._lock_path):
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        started = time.perf_counter()
+        header = json.dumps({'next_docnum': self._next_docnum,
+                             'docs': {str(d): [v['record_id'], v['patient_id']] for d, v in self._docs.items()}},
+                            separators=(',', ':')).encode('utf-8')
+        out = bytearray(SNAPSHOT_MAGIC)
+        _write_varint(out, len(header))
+        out += header
+        for group in GROUPS:
+            postings = self._postings[group]
+            _write_varint(out, len(postings))
+            for term, docs in postings.items():
+                encoded_term = term.encode('utf-8')
+                _write_varint(out, len(encoded_term))
+                out += encoded_term
+                _write_varint(out, len(docs))
+                previous = 0
+                for docnum in sorted(docs):
+                    _write_varint(out, docnum - previous)
+                    _write_varint(out, docs[docnum])
+                    previous = docnum
+
+        tmp_path = self._snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(out)
+            f.flush()
+            os.fsync(f.fileno())
+        # One rename publishes documents and postings together. A crash before the
+        # journal is truncated only means its entries are replayed again, which is idempotent.
+        os.replace(tmp_path, self._snapshot_path)
+        open(self._journal_path, 'wb').close()
+        self._snapshot_stamp = self._stamp(self._snapshot_path)
+        self._journal_offset = 0
+        self._journal_entries = 0
+        logger.info(f"Search index compacted: {len(self._docs)} documents, {len(out)} bytes "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    def _load_snapshot(self):
+        with open(self._snapshot_path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(SNAPSHOT_MAGIC):
+            logger.warning("Search index snapshot has an unknown format; starting from the journal alone.")
+            return
+        length, pos = _read_varint(data, len(SNAPSHOT_MAGIC))
+        meta = json.loads(data[pos:pos + length].decode('utf-8'))
+        pos += length
+        self._next_docnum = meta['next_docnum']
+        for docnum, (record_id, patient_id) in meta['docs'].items():
+            docnum = int(docnum)
+            self._docs[docnum] = {'record_id': record_id, 'patient_id': patient_id}
+            self._docnums[record_id] = docnum
+            self._forward[docnum] = {}
+            self._lengths[docnum] = {}
+
+        for group in GROUPS:
+            if pos >= len(data):
+                break
+            term_count, pos = _read_varint(data, pos)
+            postings = self._postings[group]
+            for _ in range(term_count):
+                length, pos = _read_varint(data, pos)
+                term = data[pos:pos + length].decode('utf-8')
+                pos += length
+                n, pos = _read_varint(data, pos)
+                docs = {}
+                docnum = 0
+                for _ in range(n):
+                    delta, pos = _read_varint(data, pos)
+                    tf, pos = _read_varint(data, pos)
+                    docnum += delta
+                    if docnum not in self._forward:
+                        continue
+                    docs[docnum] = tf
+                    self._forward[docnum].setdefault(group, {})[term] = tf
+                    self._lengths[docnum][group] = self._lengths[docnum].get(group, 0) + tf
+                    self._total_length[group] += tf
+                if docs:
+                    postings[term] = docs
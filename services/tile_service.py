@@ -0,0 +1,335 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RASTER_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+DICOM_EXTENSIONS = {'dcm'}
+
+
+def window_dicom_frame(pixels, dataset, window_center=None, window_width=None):
+    """Apply modality rescale and a VOI window to a DICOM frame, returning uint8."""
+    pixels = pixels.astype(np.float32)
+    slope = float(getattr(dataset, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(dataset, 'RescaleIntercept', 0) or 0)
+    pixels = pixels * slope + intercept
+
+    if window_center is None or window_width is None:
+        center = getattr(dataset, 'WindowCenter', None)
+        width = getattr(dataset, 'WindowWidth', None)
+        # Multi-valued window attributes list several presets; the first is the default
+        if center is not None and width is not None:
+            window_center = float(center[0] if hasattr(center, '__len__') and not isinstance(center, str) else center)
+            window_width = float(width[0] if hasattr(width, '__len__') and not isinstance(width, str) else width)
+    if window_center is None or window_width is None or window_width <= 0:
+        low, high = np.percentile(pixels, (0.5, 99.5))
+    else:
+        low, high = window_center - window_width / 2.0, window_center + window_width / 2.0
+
+    scaled = np.clip((pixels - low) / max(high - low, 1e-6), 0.0, 1.0) * 255.0
+    image = scaled.astype(np.uint8)
+    if getattr(dataset, 'PhotometricInterpretation', '') == 'MONOCHROME1':
+        image = 255 - image
+    return image
+
+
+class TilePyramidService:
+    """Builds multi-resolution tile pyramids and thumbnails for uploaded scans.
+
+    Pyramids live in a content-addressed cache: cache_dir/<sha256>/ holds a
+    manifest.json, thumb.jpg and frames/<frame>/<level>/<x>_<y>.jpg. Level 0
+    is full resolution and each level halves the previous one, down to a
+    single tile. Identical uploads share one pyramid. refs/<alias> maps a
+    record's IPFS hash to its content hash.
+
+    Queued jobs hold a spooled copy of the source on disk, not its bytes,
+    and at most max_queued jobs wait at once; further uploads get no
+    preview rather than growing the queue. After each build the least
+    recently read pyramids are evicted until the cache fits in
+    max_cache_bytes.
+    """
+
+    def __init__(self, cache_dir, tile_size=256, thumbnail_size=256, jpeg_quality=85, max_workers=2, max_frames=500,
+                 max_queued=32, max_cache_bytes=5 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.thumbnail_size = thumbnail_size
+        self.jpeg_quality = jpeg_quality
+        self.max_frames = max_frames
+        self.max_cache_bytes = max_cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tile-pyramid')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._in_progress = set()
+        self._lock = threading.Lock()
+        self._spool_dir = os.path.join(cache_dir, '.spool')
+        os.makedirs(os.path.join(cache_dir, 'refs'), exist_ok=True)
+        # Spooled sources of jobs that never ran (the process stopped) are not coming back
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+        os.makedirs(self._spool_dir, exist_ok=True)
+
+    # ---------- scheduling ----------
+
+    def schedule(self, source, filename, alias=None):
+        """Queue pyramid generation for an uploaded file, given its path or its bytes.
+
+        Returns the content hash, or None if the type is unsupported or the queue is full.
+        """
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if extension not in RASTER_EXTENSIONS | DICOM_EXTENSIONS:
+            return None
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            content_hash = hashlib.sha256(source).hexdigest()
+        else:
+            content_hash = self._hash_file(source)
+        if alias:
+            self._write_ref(alias, content_hash)
+
+        with self._lock:
+            if content_hash in self._in_progress or os.path.exists(self._manifest_path(content_hash)):
+                return content_hash
+            if not self._slots.acquire(blocking=False):
+                logger.warning(f"Tile queue full; no preview will be built for {content_hash}.")
+                return None
+            self._in_progress.add(content_hash)
+        try:
+            spool_path = self._spool(source, content_hash, extension)
+            self._executor.submit(self._build_safely, content_hash, spool_path, extension)
+        except Exception:
+            self._finished(content_hash)
+            raise
+        return content_hash
+
+    def _spool(self, source, content_hash, extension):
+        """Private copy of the source that outlives the caller's temp file; a hard link when possible."""
+        spool_path = os.path.join(self._spool_dir, f"{content_hash}.{extension}")
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            with open(spool_path, 'wb') as f:
+                f.write(source)
+            return spool_path
+        try:
+            os.link(source, spool_path)
+        except OSError:
+            shutil.copyfile(source, spool_path)
+        return spool_path
+
+    @staticmethod
+    def _hash_file(path, block_size=1024 * 1024):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def resolve(self, alias):
+        """Content hash for a record alias (its IPFS hash), or None."""
+        try:
+            with open(os.path.join(self.cache_dir, 'refs', self._safe_name(alias))) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def status(self, content_hash):
+        manifest = self.manifest(content_hash)
+        if manifest:
+            return manifest
+        with self._lock:
+            if content_hash in self._in_progress:
+                return {'status': 'pending'}
+        return None
+
+    def manifest(self, content_hash):
+        try:
+            with open(self._manifest_path(content_hash)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(content_hash)
+        return manifest
+
+    def tile_path(self, content_hash, frame, level, x, y):
+        path = os.path.join(self._pyramid_dir(content_hash), 'frames', str(frame), str(level), f"{x}_{y}.jpg")
+        return path if os.path.exists(path) else None
+
+    def thumbnail_path(self, content_hash):
+        path = os.path.join(self._pyramid_dir(content_hash), 'thumb.jpg')
+        return path if os.path.exists(path) else None
+
+    # ---------- building ----------
+
+    def _build_safely(self, content_hash, spool_path, extension):
+        try:
+            self._build(content_hash, spool_path, extension)
+            self._evict()
+        except Exception as e:
+            logger.error(f"Tile pyramid generation failed for {content_hash}: {e}", exc_info=True)
+        finally:
+            try:
+                os.remove(spool_path)
+            except OSError:
+                pass
+            self._finished(content_hash)
+
+    def _finished(self, content_hash):
+        with self._lock:
+            self._in_progress.discard(content_hash)
+        self._slots.release()
+
+    def _build(self, content_hash, spool_path, extension):
+        frames, source = self._decode(spool_path, extension)
+        if not frames:
+            logger.warning(f"No decodable frames for {content_hash}; skipping tile pyramid.")
+            return
+
+        # Build into a temp dir and rename, so readers never see a half-written pyramid
+        os.makedirs(self.cache_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.building-')
+        try:
+            levels = 0
+            for frame_index, frame in enumerate(frames):
+                levels = self._write_frame_tiles(frame, os.path.join(work_dir, 'frames', str(frame_index)))
+
+            middle = frames[len(frames) // 2]
+            cv2.imwrite(os.path.join(work_dir, 'thumb.jpg'), self._thumbnail(middle),
+                        [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+
+            height, width = frames[0].shape[:2]
+            manifest = {
+                'status': 'ready',
+                'content_hash': content_hash,
+                'source': source,
+                'width': width,
+                'height': height,
+                'frames': len(frames),
+                'tile_size': self.tile_size,
+                'levels': levels,
+                'format': 'jpg',
+            }
+            with open(os.path.join(work_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+
+            target = self._pyramid_dir(content_hash)
+            if os.path.exists(target):
+                return
+            os.replace(work_dir, target)
+            work_dir = None
+            logger.info(f"Built tile pyramid for {content_hash}: {len(frames)} frame(s), {levels} level(s).")
+        finally:
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _decode(self, path, extension):
+        if extension in DICOM_EXTENSIONS:
+            try:
+                import pydicom
+            except ImportError:
+                logger.warning("pydicom is not installed; DICOM previews are disabled.")
+                return [], 'dicom'
+            dataset = pydicom.dcmread(path)
+            pixels = dataset.pixel_array
+            samples = int(getattr(dataset, 'SamplesPerPixel', 1))
+            # Multi-frame data has a leading frame axis; colour data a trailing sample axis
+            if pixels.ndim == 2 or (pixels.ndim == 3 and samples > 1):
+                pixels = pixels[np.newaxis]
+            frames = []
+            for frame in pixels[:self.max_frames]:
+                if samples > 1:
+                    frames.append(cv2.cvtColor(frame.astype(np.uint8), cv2.COLOR_RGB2BGR))
+                else:
+                    frames.append(window_dicom_frame(frame, dataset))
+            return frames, 'dicom'
+
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            return [], 'image'
+        if image.dtype != np.uint8:
+            image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        if image.ndim == 3 and image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return [image], 'image'
+
+    def _write_frame_tiles(self, image, frame_dir):
+        level = 0
+        while True:
+            height, width = image.shape[:2]
+            level_dir = os.path.join(frame_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            for y in range(0, (height + self.tile_size - 1) // self.tile_size):
+                for x in range(0, (width + self.tile_size - 1) // self.tile_size):
+                    tile = image[y * self.tile_size:(y + 1) * self.tile_size, x * self.tile_size:(x + 1) * self.tile_size]
+                    cv2.imwrite(os.path.join(level_dir, f"{x}_{y}.jpg"), tile, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if width <= self.tile_size and height <= self.tile_size:
+                return level + 1
+            image = cv2.resize(image, (max(1, width // 2), max(1, height // 2)), interpolation=cv2.INTER_AREA)
+            level += 1
+
+    def _thumbnail(self, image):
+        height, width = image.shape[:2]
+        scale = min(1.0, self.thumbnail_size / max(height, width))
+        return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    # ---------- cache size ----------
+
+    def _touch(self, content_hash):
+        """Mark a pyramid as recently read; eviction goes by the manifest's mtime."""
+        try:
+            os.utime(self._manifest_path(content_hash))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Remove least recently read pyramids until the cache fits in max_cache_bytes."""
+        if not self.max_cache_bytes:
+            return
+        pyramids = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith('.') or entry.name == 'refs':
+                continue
+            size = 0
+            for root, _, files in os.walk(entry.path):
+                for name in files:
+                    try:
+                        size += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+            try:
+                read_at = os.path.getmtime(os.path.join(entry.path, 'manifest.json'))
+            except OSError:
+                read_at = 0.0
+            pyramids.append((read_at, entry.name, entry.path, size))
+            total += size
+        for _, name, path, size in sorted(pyramids):
+            if total <= self.max_cache_bytes:
+                break
+            with self._lock:
+                if name in self._in_progress:
+                    continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted tile pyramid {name} ({size} bytes) to keep the tile cache under its limit.")
+
+    # ---------- paths ----------
+
+    def _pyramid_dir(self, content_hash):
+        return os.path.join(self.cache_dir, self._safe_name(content_hash))
+
+    def _manifest_path(self, content_hash):
+        return os.path.join(self._pyramid_dir(content_hash), 'manifest.json')
+
+    def _write_ref(self, alias, content_hash):
+        with open(os.path.join(self.cache_dir, 'refs', self._safe_name(alias)), 'w') as f:
+            f.write(content_hash)
+
+    @staticmethod
+    def _safe_name(name):
+        return ''.join(c for c in str(name) if c.isalnum() or c in '-_')
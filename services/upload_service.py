@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Raised when a resumable upload request cannot be honoured."""
+    pass
+
+
+class ResumableUploadService:
+    """Resumable, chunked uploads assembled on disk.
+
+    A client creates a session with the final file size, PUTs chunks at byte
+    offsets (in any order, retrying as often as needed), queries which ranges
+    the server already holds, and finally asks for the session to be finalized.
+
+    Session metadata and received ranges live in SQLite (WAL mode) beside the
+    .part files, so a session survives restarts and any worker process can
+    take the next chunk. A chunk that overlaps bytes already received must
+    carry the same bytes; otherwise it is rejected, so a received byte never
+    changes. That keeps the SHA-256, computed incrementally as the contiguous
+    prefix grows, valid. Each process keeps its own running hash and catches
+    up from disk when another process wrote the chunks.
+    """
+
+    def __init__(self, storage_dir, chunk_size=5 * 1024 * 1024, max_file_size=500 * 1024 * 1024, session_ttl=24 * 3600,
+                 busy_timeout=30.0):
+        self.storage_dir = storage_dir
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.session_ttl = session_ttl
+        self.busy_timeout = busy_timeout
+        self.db_path = os.path.join(storage_dir, 'sessions.sqlite3')
+        self._hashers = {}  # upload_id -> {'lock', 'hasher', 'hashed_upto'}; this process's running hash
+        self._lock = threading.Lock()
+        os.makedirs(self.storage_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    upload_id TEXT PRIMARY KEY,
+                    owner_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    total_size INTEGER NOT NULL,
+                    metadata_json TEXT NOT NULL,
+                    ranges_json TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions (updated_at)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- session lifecycle ----------
+
+    def create_session(self, owner_id, filename, total_size, metadata=None):
+        """Create a new upload session and pre-allocate its data file."""
+        if total_size <= 0:
+            raise UploadError('total_size must be a positive integer.')
+        if total_size > self.max_file_size:
+            raise UploadError(f'File exceeds the maximum resumable upload size of {self.max_file_size} bytes.')
+
+        self.expire_sessions()
+
+        upload_id = uuid.uuid4().hex
+        with open(self._data_path(upload_id), 'wb') as f:
+            f.truncate(total_size)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO upload_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (upload_id, str(owner_id), filename, total_size, json.dumps(metadata or {}), '[]', now, now)
+            )
+        logger.info(f"Created upload session {upload_id} for {filename} ({total_size} bytes).")
+        return self.describe(self.get_session(upload_id, owner_id))
+
+    def get_session(self, upload_id, owner_id):
+        """Return the session for upload_id if it exists and belongs to owner_id."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
+        if not row or row[1] != str(owner_id):
+            return None
+        return self._session(row)
+
+    def write_chunk(self, session, offset, data):
+        """Write a chunk at the given byte offset and advance the running hash."""
+        if offset < 0 or offset + len(data) > session['total_size']:
+            raise UploadError('Chunk falls outside the declared file size.')
+        if not data:
+            raise UploadError('Empty chunk.')
+
+        upload_id = session['upload_id']
+        end = offset + len(data)
+        # The write lock spans the overlap check, the file write and the range update, so two
+        # workers cannot both pass the check with different bytes for the same range
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT * FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
+                if row is None:
+                    raise UploadError('Upload session not found.')
+                session = self._session(row)
+                with open(session['data_path'], 'r+b') as f:
+                    for r_start, r_end in session['ranges']:
+                        start, stop = max(r_start, offset), min(r_end, end)
+                        if start >= stop:
+                            continue
+                        f.seek(start)
+                        if f.read(stop - start) != data[start - offset:stop - offset]:
+                            raise UploadError(f'Chunk conflicts with bytes already received at offset {start}.')
+                    f.seek(offset)
+                    f.write(data)
+                session['ranges'] = self._merge_range(session['ranges'], offset, end)
+                session['updated_at'] = time.time()
+                conn.execute(
+                    'UPDATE upload_sessions SET ranges_json = ?, updated_at = ? WHERE upload_id = ?',
+                    (json.dumps(session['ranges']), session['updated_at'], upload_id)
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        self._advance_hash(session)
+        return self.describe(session)
+
+    def finalize(self, session, expected_sha256=None):
+        """Verify the upload is complete and return (data_path, sha256 hex digest).
+
+        The caller owns the returned file and is responsible for calling
+        discard() once it has been handed off.
+        """
+        session = self.get_session(session['upload_id'], session['owner_id']) or session
+        if self._received_bytes(session['ranges']) != session['total_size']:
+            raise UploadError('Upload is incomplete.')
+        digest = self._advance_hash(session).hexdigest()
+        if expected_sha256 and expected_sha256.lower() != digest:
+            raise UploadError('Checksum mismatch; the assembled file does not match the expected SHA-256.')
+        return session['data_path'], digest
+
+    def discard(self, upload_id):
+        """Drop a session and delete its data file."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        data_path = self._data_path(upload_id)
+        if os.path.exists(data_path):
+            try:
+                os.remove(data_path)
+            except OSError as e:
+                logger.warning(f"Could not remove upload data for {upload_id}: {e}")
+
+    def expire_sessions(self):
+        """Remove sessions that have not seen activity within the TTL, and .part files no session owns."""
+        cutoff = time.time() - self.session_ttl
+        with self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                'SELECT upload_id FROM upload_sessions WHERE updated_at < ?', (cutoff,))]
+        for upload_id in expired:
+            logger.info(f"Expiring stale upload session {upload_id}.")
+            self.discard(upload_id)
+
+        with self._connect() as conn:
+            live = {row[0] for row in conn.execute('SELECT upload_id FROM upload_sessions')}
+        with self._lock:
+            for upload_id in [u for u in self._hashers if u not in live]:
+                del self._hashers[upload_id]  # finished or expired in another process
+        for entry in os.scandir(self.storage_dir):
+            upload_id, extension = os.path.splitext(entry.name)
+            if extension != '.part' or upload_id in live:
+                continue
+            try:
+                # Age check so a session being created right now keeps its file
+                if entry.stat().st_mtime < cutoff:
+                    logger.info(f"Removing orphaned upload data {entry.name}.")
+                    os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not remove orphaned upload data {entry.name}: {e}")
+
+    def describe(self, session):
+        """Public, JSON-serializable view of a session."""
+        return {
+            'upload_id': session['upload_id'],
+            'filename': session['filename'],
+            'total_size': session['total_size'],
+            'received_bytes': self._received_bytes(session['ranges']),
+            'received_ranges': [list(r) for r in session['ranges']],
+            'chunk_size': self.chunk_size,
+            'complete': self._received_bytes(session['ranges']) == session['total_size'],
+        }
+
+    # ---------- helpers ----------
+
+    def _data_path(self, upload_id):
+        return os.path.join(self.storage_dir, f"{upload_id}.part")
+
+    def _session(self, row):
+        upload_id, owner_id, filename, total_size, metadata_json, ranges_json, created_at, updated_at = row
+        return {
+            'upload_id': upload_id,
+            'owner_id': owner_id,
+            'filename': filename,
+            'total_size': total_size,
+            'metadata': json.loads(metadata_json),
+            'data_path': self._data_path(upload_id),
+            'ranges': [tuple(r) for r in json.loads(ranges_json)],  # Sorted, merged [start, end) byte ranges
+            'created_at': created_at,
+            'updated_at': updated_at,
+        }
+
+    @staticmethod
+    def _merge_range(ranges, start, end):
+        merged = []
+        for r_start, r_end in sorted(ranges + [(start, end)]):
+            if merged and r_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+            else:
+                merged.append((r_start, r_end))
+        return merged
+
+    @staticmethod
+    def _received_bytes(ranges):
+        return sum(end - start for start, end in ranges)
+
+    def _advance_hash(self, session):
+        # Only the contiguous prefix starting at byte 0 can be hashed; anything
+        # past a gap is picked up once the gap is filled. Received bytes never
+        # change, so a hash over a prefix stays valid whoever wrote it.
+        upload_id = session['upload_id']
+        with self._lock:
+            state = self._hashers.setdefault(upload_id, {'lock': threading.Lock(), 'hasher': hashlib.sha256(), 'hashed_upto': 0})
+        with state['lock']:
+            ranges = session['ranges']
+            if ranges and ranges[0][0] == 0 and ranges[0][1] > state['hashed_upto']:
+                contiguous_end = ranges[0][1]
+                with open(session['data_path'], 'rb') as f:
+                    f.seek(state['hashed_upto'])
+                    remaining = contiguous_end - state['hashed_upto']
+                    while remaining > 0:
+                        block = f.read(min(remaining, 1024 * 1024))
+                        if not block:
+                            break
+                        state['hasher'].update(block)
+                        remaining -= len(block)
+                state['hashed_upto'] = contiguous_end
+            return state['hasher'].copy()
+
+
+class MultipartFileBody:
+    """multipart/form-data request body that streams one file from disk.
+
+    Pass it as requests' data= with content_type as the Content-Type header.
+    It has a length, so the request carries a Content-Length and the file is
+    read in blocks as it is sent rather than loaded into memory.
+    """
+
+    def __init__(self, path, filename, field='file', block_size=1024 * 1024):
+        self.path = path
+        self.block_size = block_size
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        safe_name = filename.replace('"', '')
+        self._head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{safe_name}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        self._tail = f'\r\n--{boundary}--\r\n'.encode()
+        self._size = os.path.getsize(path)
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                yield block
+        yield self._tail
@@ -0,0 +1,194 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from services.vitals_store import VITAL_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# 'threshold' rules fire when `field op value` holds for `consecutive` readings in a row;
+# 'delta' rules fire when a reading moves by at least `change` from the previous one within window_ms.
+DEFAULT_VITALS_RULES = [
+    {'id': 'spo2_low', 'type': 'threshold', 'field': 'oxygen_saturation', 'op': '<', 'value': 90, 'consecutive': 2,
+     'severity': 'critical', 'message': 'SpO2 below 90% for 2 consecutive readings'},
+    {'id': 'systolic_crisis', 'type': 'threshold', 'field': 'blood_pressure_systolic', 'op': '>', 'value': 180, 'consecutive': 1,
+     'severity': 'critical', 'message': 'Systolic blood pressure above 180 mmHg'},
+    {'id': 'systolic_low', 'type': 'threshold', 'field': 'blood_pressure_systolic', 'op': '<', 'value': 90, 'consecutive': 2,
+     'severity': 'high', 'message': 'Systolic blood pressure below 90 mmHg for 2 consecutive readings'},
+    {'id': 'tachycardia', 'type': 'threshold', 'field': 'heart_rate', 'op': '>', 'value': 130, 'consecutive': 2,
+     'severity': 'high', 'message': 'Heart rate above 130 bpm for 2 consecutive readings'},
+    {'id': 'bradycardia', 'type': 'threshold', 'field': 'heart_rate', 'op': '<', 'value': 40, 'consecutive': 2,
+     'severity': 'high', 'message': 'Heart rate below 40 bpm for 2 consecutive readings'},
+    {'id': 'fever_high', 'type': 'threshold', 'field': 'temperature', 'op': '>=', 'value': 39.5, 'consecutive': 1,
+     'severity': 'medium', 'message': 'Temperature at or above 39.5°C'},
+    {'id': 'tachypnea', 'type': 'threshold', 'field': 'respiratory_rate', 'op': '>', 'value': 30, 'consecutive': 2,
+     'severity': 'high', 'message': 'Respiratory rate above 30/min for 2 consecutive readings'},
+    {'id': 'heart_rate_spike', 'type': 'delta', 'field': 'heart_rate', 'change': 40, 'window_ms': 10 * 60 * 1000,
+     'severity': 'high', 'message': 'Heart rate rose by 40+ bpm within 10 minutes'},
+]
+
+OPS = ('<', '<=', '>', '>=')
+
+
+def load_rules(path=None):
+    """Rules from a JSON file (a list in the DEFAULT_VITALS_RULES format), or the defaults."""
+    if not path:
+        return DEFAULT_VITALS_RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class _FieldRules:
+    """All rules on one vital, compiled into arrays so a batch is checked with a few array operations."""
+
+    def __init__(self, field, rules):
+        self.field = field
+        thresholds = [r for r in rules if r.get('type', 'threshold') == 'threshold']
+        deltas = [r for r in rules if r.get('type') == 'delta']
+        self.threshold_rules = thresholds
+        self.threshold_values = np.array([float(r['value']) for r in thresholds])
+        self.op_masks = {op: np.array([r['op'] == op for r in thresholds], dtype=bool) for op in OPS}
+        self.consecutive = np.array([int(r.get('consecutive', 1)) for r in thresholds])
+        self.delta_rules = deltas
+        self.delta_change = np.array([float(r['change']) for r in deltas])
+        self.delta_window = np.array([float(r.get('window_ms', np.inf)) for r in deltas])
+
+
+class VitalsRuleEngine:
+    """Evaluates threshold and trend rules over each stored batch of vitals readings.
+
+    Rules are validated and grouped by vital once, at construction. evaluate()
+    then checks every rule on that vital with broadcast comparisons over
+    the whole batch. Consecutive-reading runs and the previous reading per
+    patient carry over between batches, so a streak can span two uploads.
+    An alert fires once per episode: when the run first reaches its
+    required length. Further alerts for the same patient and rule are
+    suppressed for cooldown_ms. A reading no newer than the last one seen
+    for that patient and vital (a retry or a late upload) is ignored, as
+    is all but the last of several readings sharing a timestamp in one
+    batch, so neither can lengthen a streak or count as a jump.
+    """
+
+    def __init__(self, rules=None, cooldown_ms=15 * 60 * 1000):
+        rules = DEFAULT_VITALS_RULES if rules is None else rules
+        self.cooldown_ms = cooldown_ms
+        self._lock = threading.Lock()
+        self._runs = {}  # (patient_id, rule_id) -> consecutive matching readings so far
+        self._last = {}  # (patient_id, field) -> (ts, value) of the latest reading
+        self._last_alert = {}  # (patient_id, rule_id) -> ts of the last alert
+        self._fields = {}
+        for rule in rules:
+            if rule.get('field') not in VITAL_FIELDS:
+                raise ValueError(f"Rule {rule.get('id')}: unknown field {rule.get('field')!r}")
+            if rule.get('type', 'threshold') == 'threshold' and rule.get('op') not in OPS:
+                raise ValueError(f"Rule {rule.get('id')}: op must be one of {OPS}")
+            if rule.get('type', 'threshold') not in ('threshold', 'delta'):
+                raise ValueError(f"Rule {rule.get('id')}: unknown type {rule.get('type')!r}")
+        for field in VITAL_FIELDS:
+            field_rules = [r for r in rules if r['field'] == field]
+            if field_rules:
+                self._fields[field] = _FieldRules(field, field_rules)
+        self.rules = list(rules)
+
+    def evaluate(self, frame):
+        """Return new alerts for a validated vitals DataFrame (patient_id, ts, vitals...)."""
+        if frame.empty or not self._fields:
+            return []
+        # The store keeps the last of several readings with the same (patient_id, ts); so do the rules
+        frame = frame.drop_duplicates(['patient_id', 'ts'], keep='last').sort_values(['patient_id', 'ts'], kind='stable')
+        patients = frame['patient_id'].to_numpy(dtype=object)
+        timestamps = frame['ts'].to_numpy(dtype=np.int64)
+        fired = []
+        with self._lock:
+            for field, compiled in self._fields.items():
+                column = frame[field].to_numpy(dtype=np.float64)
+                # Readings that did not measure this vital neither extend nor break a streak
+                rows = np.flatnonzero(~np.isnan(column))
+                if rows.size == 0:
+                    continue
+                unique_patients, patient_index = np.unique(patients[rows], return_inverse=True)
+                last_seen = np.array([self._last.get((patient, field), (-np.inf,))[0] for patient in unique_patients])
+                rows = rows[timestamps[rows] > last_seen[patient_index]]
+                if rows.size == 0:
+                    continue
+                p, t, v = patients[rows], timestamps[rows], column[rows]
+                is_start = np.r_[True, p[1:] != p[:-1]]
+                seg_starts = np.flatnonzero(is_start)
+                seg_ends = np.r_[seg_starts[1:], len(p)] - 1
+                seg_of_row = np.cumsum(is_start) - 1
+                seg_patients = p[seg_starts]
+
+                if compiled.threshold_rules:
+                    fired.extend(self._evaluate_thresholds(compiled, p, t, v, seg_starts, seg_ends, seg_of_row, seg_patients))
+                if compiled.delta_rules:
+                    fired.extend(self._evaluate_deltas(compiled, p, t, v, is_start, seg_patients))
+                for patient, end in zip(seg_patients, seg_ends):
+                    self._last[(patient, field)] = (int(t[end]), float(v[end]))
+            return self._deduplicate(fired)
+
+    def _evaluate_thresholds(self, compiled, p, t, v, seg_starts, seg_ends, seg_of_row, seg_patients):
+        values, limits = v[:, None], compiled.threshold_values[None, :]
+        masks = compiled.op_masks
+        matches = ((masks['<'] & (values < limits)) | (masks['<='] & (values <= limits)) |
+                   (masks['>'] & (values > limits)) | (masks['>='] & (values >= limits)))
+
+        # Length of the run of matches ending at each row, restarted at each patient's first row
+        index = np.arange(len(p))[:, None]
+        last_miss = np.maximum.accumulate(np.where(matches, -1, index), axis=0)
+        run_floor = np.maximum(last_miss, seg_starts[seg_of_row][:, None] - 1)
+        runs = index - run_floor
+
+        # Runs that reach back to the start of the batch continue the streak from earlier batches
+        rule_ids = [r['id'] for r in compiled.threshold_rules]
+        carried = np.array([[self._runs.get((patient, rule_id), 0) for rule_id in rule_ids] for patient in seg_patients])
+        runs = np.where(last_miss < seg_starts[seg_of_row][:, None], runs + carried[seg_of_row], runs)
+        runs = np.where(matches, runs, 0)
+
+        for patient, end in zip(seg_patients, seg_ends):
+            for r, rule_id in enumerate(rule_ids):
+                self._runs[(patient, rule_id)] = int(runs[end, r])
+
+        rows, rule_indexes = np.nonzero(runs == compiled.consecutive[None, :])
+        return [(compiled.threshold_rules[r], p[i], int(t[i]), float(v[i])) for i, r in zip(rows, rule_indexes)]
+
+    def _evaluate_deltas(self, compiled, p, t, v, is_start, seg_patients):
+        previous_v = np.r_[np.nan, v[:-1]]
+        previous_t = np.r_[0, t[:-1]].astype(np.float64)
+        for row, patient in zip(np.flatnonzero(is_start), seg_patients):
+            last = self._last.get((patient, compiled.field))
+            previous_t[row], previous_v[row] = last if last else (0, np.nan)
+
+        change = (v - previous_v)[:, None]
+        within = ((t - previous_t)[:, None] <= compiled.delta_window[None, :])
+        rising = compiled.delta_change[None, :] > 0
+        with np.errstate(invalid='ignore'):
+            matches = within & np.where(rising, change >= compiled.delta_change[None, :], change <= compiled.delta_change[None, :])
+        rows, rule_indexes = np.nonzero(matches)
+        return [(compiled.delta_rules[r], p[i], int(t[i]), float(v[i])) for i, r in zip(rows, rule_indexes)]
+
+    def _deduplicate(self, fired):
+        alerts = []
+        now = time.time()
+        for rule, patient_id, ts, value in sorted(fired, key=lambda item: item[2]):
+            key = (patient_id, rule['id'])
+            last = self._last_alert.get(key)
+            if last is not None and abs(ts - last) < self.cooldown_ms:
+                continue
+            self._last_alert[key] = ts
+            alerts.append({
+                'alert_id': str(uuid.uuid4()),
+                'patient_id': patient_id,
+                'rule_id': rule['id'],
+                'severity': rule.get('severity', 'medium'),
+                'field': rule['field'],
+                'value': value,
+                'threshold': rule.get('value', rule.get('change')),
+                'message': rule.get('message', rule['id']),
+                'ts': ts,
+                'created_at': now,
+            })
+        return alerts
@@ -0,0 +1,274 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+VITAL_FIELDS = (
+    'heart_rate',
+    'blood_pressure_systolic',
+    'blood_pressure_diastolic',
+    'temperature',
+    'oxygen_saturation',
+    'respiratory_rate',
+)
+
+# Physiologically plausible bounds; readings outside them are sensor or entry errors
+VITAL_RANGES = {
+    'heart_rate': (20, 250),
+    'blood_pressure_systolic': (50, 260),
+    'blood_pressure_diastolic': (20, 180),
+    'temperature': (30, 45),
+    'oxygen_saturation': (50, 100),
+    'respiratory_rate': (4, 70),
+}
+
+MAX_CLOCK_SKEW_MS = 5 * 60 * 1000
+
+
+def _iso_to_epoch_ms(value):
+    # Parsed one value at a time: vectorized to_datetime infers a single format
+    # from the first value and turns every differently formatted one into NaT
+    if not isinstance(value, str):
+        return np.nan
+    try:
+        parsed = pd.Timestamp(value)
+    except (ValueError, OverflowError):
+        return np.nan
+    if pd.isna(parsed):
+        return np.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.tz_localize('UTC')
+    return float((parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1))
+
+
+def validate_vitals_batch(readings, now_ms=None):
+    """Validate a list of reading dicts in one vectorized pass.
+
+    Each reading needs a patient_id, a timestamp (ISO 8601 string or epoch
+    milliseconds) and at least one vital sign. Returns (accepted, rejected):
+    accepted is a DataFrame with patient_id, ts (epoch ms) and one float
+    column per vital (NaN when absent); rejected is a list of
+    {'index', 'reason'}.
+    """
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    frame = pd.DataFrame.from_records(readings) if readings else pd.DataFrame()
+    n = len(frame)
+    if n == 0:
+        return pd.DataFrame(columns=('patient_id', 'ts') + VITAL_FIELDS), []
+
+    reasons = np.full(n, None, dtype=object)
+
+    def reject(mask, reason):
+        mask = np.asarray(mask, dtype=bool) & pd.isna(reasons)
+        reasons[mask] = reason
+
+    patient_ids = frame['patient_id'].astype('string').str.strip() if 'patient_id' in frame else pd.Series([pd.NA] * n, dtype='string')
+    reject(patient_ids.isna() | (patient_ids == ''), 'missing patient_id')
+
+    raw_ts = frame['timestamp'] if 'timestamp' in frame else pd.Series([None] * n)
+    numeric_ts = pd.to_numeric(raw_ts, errors='coerce')
+    ts = numeric_ts.to_numpy(dtype=np.float64, copy=True)
+    for i in np.flatnonzero(numeric_ts.isna().to_numpy()):
+        ts[i] = _iso_to_epoch_ms(raw_ts.iat[i])
+    reject(np.isnan(ts), 'missing or invalid timestamp')
+    reject(ts > now_ms + MAX_CLOCK_SKEW_MS, 'timestamp in the future')
+
+    values = np.empty((n, len(VITAL_FIELDS)), dtype=np.float64)
+    for column, field in enumerate(VITAL_FIELDS):
+        values[:, column] = pd.to_numeric(frame[field], errors='coerce') if field in frame else np.nan
+        if field in frame:
+            reject(frame[field].notna().to_numpy() & np.isnan(values[:, column]), f'{field} is not a number')
+        low, high = VITAL_RANGES[field]
+        with np.errstate(invalid='ignore'):
+            reject((values[:, column] < low) | (values[:, column] > high), f'{field} out of range')
+    reject(np.isnan(values).all(axis=1), 'no vital signs')
+    with np.errstate(invalid='ignore'):
+        reject(values[:, 1] <= values[:, 2], 'systolic must exceed diastolic')
+
+    ok = pd.isna(reasons)
+    accepted = pd.DataFrame(values[ok], columns=VITAL_FIELDS)
+    accepted.insert(0, 'ts', ts[ok].astype(np.int64))
+    accepted.insert(0, 'patient_id', patient_ids[ok].to_numpy(dtype=object))
+    rejected = [{'index': int(i), 'reason': reasons[i]} for i in np.flatnonzero(~ok)]
+    return accepted, rejected
+
+
+class VitalsStore:
+    """Compact per-reading vitals storage, separate from medical_records.
+
+    One narrow row per reading (patient, timestamp, six REAL columns) in a
+    WITHOUT ROWID table clustered by (patient_id, ts), so a patient's
+    readings sit together on disk. Batches are written in one transaction
+    with executemany. A repeated (patient_id, ts) overwrites the earlier
+    reading, which makes device retries harmless.
+    """
+
+    def __init__(self, db_path, busy_timeout=5.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._ingested = 0
+        self._ingest_seconds = 0.0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS vitals (
+                    patient_id TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    {', '.join(f'{field} REAL' for field in VITAL_FIELDS)},
+                    PRIMARY KEY (patient_id, ts)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vitals_alerts (
+                    alert_id TEXT PRIMARY KEY,
+                    patient_id TEXT NOT NULL,
+                    rule_id TEXT NOT NULL,
+                    severity TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    value REAL,
+                    threshold REAL,
+                    message TEXT,
+                    ts INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (patient_id, rule_id, ts)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_vitals_alerts_created ON vitals_alerts (created_at)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    def insert_frame(self, frame):
+        """Insert a validated DataFrame (see validate_vitals_batch).
+
+        Returns the rows whose (patient_id, ts) was not stored before, so
+        derived copies of the data can skip retries and readings they
+        already hold.
+        """
+        if frame.empty:
+            return frame
+        started = time.perf_counter()
+        floats = frame[list(VITAL_FIELDS)].to_numpy(dtype=np.float64)
+        values = np.where(np.isnan(floats), None, floats)  # NaN -> SQL NULL
+        rows = zip(frame['patient_id'].tolist(), frame['ts'].astype(np.int64).tolist(), *values.T.tolist())
+        # Within a batch the last reading for a (patient_id, ts) wins, as it does in the table
+        new = ~frame.duplicated(['patient_id', 'ts'], keep='last').to_numpy()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for patient_id, group in frame.groupby('patient_id', sort=False):
+                    existing = {row[0] for row in conn.execute(
+                        'SELECT ts FROM vitals WHERE patient_id = ? AND ts BETWEEN ? AND ?',
+                        (patient_id, int(group['ts'].min()), int(group['ts'].max()))
+                    )}
+                    if existing:
+                        new &= ~((frame['patient_id'] == patient_id) & frame['ts'].isin(existing)).to_numpy()
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO vitals VALUES (?, ?, {', '.join('?' for _ in VITAL_FIELDS)})", rows
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        with self._lock:
+            self._ingested += len(frame)
+            self._ingest_seconds += time.perf_counter() - started
+        return frame[new]
+
+    def query(self, patient_id, start_ms=None, end_ms=None):
+        """A patient's readings in [start_ms, end_ms] as a DataFrame ordered by ts."""
+        sql = f"SELECT ts, {', '.join(VITAL_FIELDS)} FROM vitals WHERE patient_id = ?"
+        params = [str(patient_id)]
+        if start_ms is not None:
+            sql += ' AND ts >= ?'
+            params.append(int(start_ms))
+        if end_ms is not None:
+            sql += ' AND ts <= ?'
+            params.append(int(end_ms))
+        with self._connect() as conn:
+            rows = conn.execute(sql + ' ORDER BY ts', params).fetchall()
+        return pd.DataFrame(rows, columns=('ts',) + VITAL_FIELDS, dtype=float).astype({'ts': np.int64})
+
+    def insert_alerts(self, alerts):
+        """Store alerts, skipping any already recorded for the same patient, rule and reading. Returns the new ones."""
+        if not alerts:
+            return []
+        inserted = []
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for alert in alerts:
+                    cursor = conn.execute(
+                        'INSERT OR IGNORE INTO vitals_alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (alert['alert_id'], str(alert['patient_id']), alert['rule_id'], alert['severity'], alert['field'],
+                         alert['value'], alert['threshold'], alert['message'], alert['ts'], alert['created_at'])
+                    )
+                    if cursor.rowcount:
+                        inserted.append(alert)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return inserted
+
+    def recent_alerts(self, limit=100, patient_ids=None):
+        """Most recent alerts first, optionally restricted to some patients."""
+        sql = 'SELECT alert_id, patient_id, rule_id, severity, field, value, threshold, message, ts, created_at FROM vitals_alerts'
+        params = []
+        if patient_ids is not None:
+            patient_ids = [str(p) for p in patient_ids]
+            if not patient_ids:
+                return []
+            sql += f" WHERE patient_id IN ({', '.join('?' for _ in patient_ids)})"
+            params.extend(patient_ids)
+        with self._connect() as conn:
+            rows = conn.execute(sql + ' ORDER BY created_at DESC, ts DESC LIMIT ?', params + [int(limit)]).fetchall()
+        keys = ('alert_id', 'patient_id', 'rule_id', 'severity', 'field', 'value', 'threshold', 'message', 'ts', 'created_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def last_alert_cursor(self):
+        """Cursor of the newest stored alert (0 when there is none), for alerts_after()."""
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM vitals_alerts').fetchone()[0]
+
+    def alerts_after(self, cursor, limit=500):
+        """Alerts stored after cursor, oldest first, as (cursor, alert) pairs.
+
+        The cursor is the SQLite rowid. Inserts are serialized by BEGIN IMMEDIATE,
+        so it grows in commit order whichever process wrote the alert, and every
+        worker can follow the same sequence.
+        """
+        keys = ('alert_id', 'patient_id', 'rule_id', 'severity', 'field', 'value', 'threshold', 'message', 'ts', 'created_at')
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT rowid, {', '.join(keys)} FROM vitals_alerts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (int(cursor), int(limit))
+            ).fetchall()
+        return [(row[0], dict(zip(keys, row[1:]))) for row in rows]
+
+    def stats(self):
+        with self._connect() as conn:
+            count, patients = conn.execute('SELECT COUNT(*), COUNT(DISTINCT patient_id) FROM vitals').fetchone()
+        with self._lock:
+            ingested, seconds = self._ingested, self._ingest_seconds
+        return {
+            'readings': count,
+            'patients': patients,
+            'ingested_since_start': ingested,
+            'insert_readings_per_sec': round(ingested / seconds, 1) if seconds else None,
+        }
@@ -0,0 +1,310 @@
+import copy
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from services.vitals_store import VITAL_FIELDS
+from utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('ts',) + VITAL_FIELDS
+
+
+def _safe_name(name):
+    return ''.join(c for c in str(name) if c.isalnum() or c in '-_')
+
+
+def downsample_minmax(ts, values, start, end, width):
+    """Bucket [start, end] into width equal time slices; per bucket return (bucket_ts, min, max, mean, count).
+
+    ts must be sorted. NaNs (missing readings) are ignored; empty buckets are dropped.
+    """
+    span = max(end - start + 1, 1)
+    buckets = np.minimum((ts - start) * width // span, width - 1).astype(np.int64)
+    valid = ~np.isnan(values)
+    counts = np.bincount(buckets[valid], minlength=width)
+    sums = np.bincount(buckets[valid], weights=values[valid], minlength=width)
+
+    # reduceat needs the first index of each non-empty bucket; ts is sorted, so buckets are too
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    present = buckets[starts]
+    mins = np.full(width, np.nan)
+    maxs = np.full(width, np.nan)
+    mins[present] = np.fmin.reduceat(values, starts)
+    maxs[present] = np.fmax.reduceat(values, starts)
+
+    keep = counts > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    bucket_ts = start + (np.arange(width) * span + span // 2) // width
+    return bucket_ts[keep], mins[keep], maxs[keep], means[keep], counts[keep]
+
+
+def downsample_lttb(ts, values, threshold):
+    """Largest-Triangle-Three-Buckets: pick threshold points that keep the visual shape of the series."""
+    valid = ~np.isnan(values)
+    x, y = ts[valid].astype(np.float64), values[valid]
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x.astype(np.int64), y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean() if next_hi > next_lo else x[-1]
+        avg_y = y[next_lo:next_hi].mean() if next_hi > next_lo else y[-1]
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return x[selected].astype(np.int64), y[selected]
+
+
+class VitalsTimeSeriesStore:
+    """Append-only, columnar per-patient vitals series on memory-mapped segments.
+
+    Each patient has a directory of fixed-capacity segments. A segment is one
+    float64 memmap of shape (len(COLUMNS), capacity): row 0 holds epoch-ms
+    timestamps, the other rows one vital each (NaN when not measured). That
+    way a range query touches only contiguous column slices. meta.json
+    records each segment's row count, time bounds and whether it is sorted.
+    Segments are sorted by time when they fill up and are never rewritten
+    afterwards.
+
+    Several worker processes may share root_dir. Writes hold an exclusive
+    lock on the patient's .lock file and reads hold a shared one. Under the
+    lock, meta.json is re-read whenever it changed on disk, so every process
+    appends after the rows others wrote and sees them in queries.
+    """
+
+    def __init__(self, root_dir, segment_capacity=65536, max_open_segments=256):
+        self.root_dir = root_dir
+        self.segment_capacity = segment_capacity
+        self.max_open_segments = max_open_segments
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._meta = {}  # patient_id -> (meta, (inode, mtime_ns, size) of the meta.json it was read from)
+        self._maps = OrderedDict()  # (patient, segment name) -> memmap, least recently used first
+        self._maps_lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ---------- writes ----------
+
+    def append(self, patient_id, ts, values):
+        """Append rows for one patient: ts is an int64 array, values an (n, len(VITAL_FIELDS)) float array."""
+        ts = np.asarray(ts, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(ts), len(VITAL_FIELDS))
+        if len(ts) == 0:
+            return
+        with self._patient_lock(patient_id), self._file_lock(patient_id):
+            self._append(patient_id, ts, values)
+
+    def _append(self, patient_id, ts, values):
+        # Caller holds the patient's thread and file locks. Edited on a copy, so a failed append leaves the cache intact
+        meta = copy.deepcopy(self._load_meta(patient_id))
+        offset = 0
+        while offset < len(ts):
+            segment = meta['segments'][-1] if meta['segments'] else None
+            if segment is None or segment['count'] >= self.segment_capacity:
+                if segment is not None:
+                    self._seal(patient_id, segment)
+                segment = self._new_segment(patient_id, meta)
+            space = self.segment_capacity - segment['count']
+            chunk_ts, chunk_values = ts[offset:offset + space], values[offset:offset + space]
+            data = self._map(patient_id, segment['name'])
+            row = segment['count']
+            data[0, row:row + len(chunk_ts)] = chunk_ts
+            data[1:, row:row + len(chunk_ts)] = chunk_values.T
+            data.flush()
+
+            if segment['count'] and chunk_ts[0] < segment['max_ts']:
+                segment['sorted'] = False
+            if len(chunk_ts) > 1 and np.any(np.diff(chunk_ts) < 0):
+                segment['sorted'] = False
+            segment['count'] += len(chunk_ts)
+            segment['min_ts'] = float(min(segment['min_ts'], chunk_ts.min())) if segment['min_ts'] is not None else float(chunk_ts.min())
+            segment['max_ts'] = float(max(segment['max_ts'], chunk_ts.max())) if segment['max_ts'] is not None else float(chunk_ts.max())
+            offset += len(chunk_ts)
+        # Rows are written before the count that exposes them, so a crash never surfaces garbage
+        self._save_meta(patient_id, meta)
+
+    def append_frame(self, frame):
+        """Append a validated vitals DataFrame (patient_id, ts, vitals...) grouped by patient."""
+        if frame.empty:
+            return
+        for patient_id, group in frame.groupby('patient_id', sort=False):
+            group = group.sort_values('ts', kind='stable')
+            self.append(patient_id, group['ts'].to_numpy(), group[list(VITAL_FIELDS)].to_numpy(dtype=np.float64))
+
+    def has_patient(self, patient_id):
+        return os.path.exists(self._meta_path(patient_id))
+
+    def ensure_patient(self, patient_id, load_history):
+        """Create a patient's series from load_history() (a DataFrame of ts and vitals) unless it exists.
+
+        Runs once per patient across all processes: the check, the load and
+        the append happen under the patient's file lock. Returns True if
+        this call created the series.
+        """
+        if self.has_patient(patient_id):
+            return False
+        with self._patient_lock(patient_id), self._file_lock(patient_id):
+            if self.has_patient(patient_id):
+                return False
+            history = load_history()
+            if history is not None and not history.empty:
+                history = history.sort_values('ts', kind='stable')
+                self._append(patient_id, history['ts'].to_numpy(dtype=np.float64),
+                             history[list(VITAL_FIELDS)].to_numpy(dtype=np.float64))
+            if not self.has_patient(patient_id):
+                self._save_meta(patient_id, {'segments': []})
+            return True
+
+    # ---------- reads ----------
+
+    def range(self, patient_id, start_ms=None, end_ms=None):
+        """Raw (ts, values) in [start_ms, end_ms], sorted by time."""
+        start = -np.inf if start_ms is None else start_ms
+        end = np.inf if end_ms is None else end_ms
+        parts_ts, parts_values = [], []
+        if not self.has_patient(patient_id):
+            return np.empty(0, dtype=np.int64), np.empty((len(VITAL_FIELDS), 0))
+        with self._patient_lock(patient_id), self._file_lock(patient_id, shared=True):
+            meta = self._load_meta(patient_id)
+            for segment in meta['segments']:
+                if not segment['count'] or segment['max_ts'] < start or segment['min_ts'] > end:
+                    continue
+                data = self._map(patient_id, segment['name'])
+                seg_ts = data[0, :segment['count']]
+                if segment['sorted']:
+                    lo, hi = np.searchsorted(seg_ts, start, 'left'), np.searchsorted(seg_ts, end, 'right')
+                    parts_ts.append(np.array(seg_ts[lo:hi]))
+                    parts_values.append(np.array(data[1:, lo:hi]))
+                else:
+                    mask = (seg_ts >= start) & (seg_ts <= end)
+                    parts_ts.append(np.array(seg_ts[mask]))
+                    parts_values.append(np.array(data[1:, :segment['count']][:, mask]))
+        if not parts_ts:
+            return np.empty(0, dtype=np.int64), np.empty((len(VITAL_FIELDS), 0))
+        ts = np.concatenate(parts_ts)
+        values = np.concatenate(parts_values, axis=1)
+        order = np.argsort(ts, kind='stable')
+        return ts[order].astype(np.int64), values[:, order]
+
+    def query(self, patient_id, start_ms=None, end_ms=None, width=800, mode='minmax'):
+        """Chart-ready series: raw points when they fit in width, else min/max/mean buckets or LTTB points."""
+        ts, values = self.range(patient_id, start_ms, end_ms)
+        result = {'points': int(len(ts)), 'width': width, 'mode': 'raw', 'series': {}}
+        if len(ts) == 0:
+            return result
+        start = int(ts[0] if start_ms is None else start_ms)
+        end = int(ts[-1] if end_ms is None else end_ms)
+        result.update(start=start, end=end)
+
+        if len(ts) <= width:
+            for field, column in zip(VITAL_FIELDS, values):
+                valid = ~np.isnan(column)
+                if valid.any():
+                    result['series'][field] = {'ts': ts[valid].tolist(), 'value': column[valid].tolist()}
+            return result
+
+        result['mode'] = mode
+        for field, column in zip(VITAL_FIELDS, values):
+            if np.isnan(column).all():
+                continue
+            if mode == 'lttb':
+                lttb_ts, lttb_values = downsample_lttb(ts, column, width)
+                result['series'][field] = {'ts': lttb_ts.tolist(), 'value': lttb_values.tolist()}
+            else:
+                bucket_ts, mins, maxs, means, counts = downsample_minmax(ts, column, start, end, width)
+                result['series'][field] = {
+                    'ts': bucket_ts.tolist(), 'min': mins.tolist(), 'max': maxs.tolist(),
+                    'mean': np.round(means, 2).tolist(), 'count': counts.tolist(),
+                }
+        return result
+
+    # ---------- segments ----------
+
+    def _patient_dir(self, patient_id):
+        return os.path.join(self.root_dir, _safe_name(patient_id))
+
+    def _meta_path(self, patient_id):
+        return os.path.join(self._patient_dir(patient_id), 'meta.json')
+
+    def _patient_lock(self, patient_id):
+        with self._locks_guard:
+            return self._locks.setdefault(patient_id, threading.RLock())
+
+    def _file_lock(self, patient_id, shared=False):
+        return file_lock(os.path.join(self._patient_dir(patient_id), '.lock'), shared=shared)
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load_meta(self, patient_id):
+        # Caller holds the patient's file lock; the cached copy is reused only while meta.json is unchanged
+        path = self._meta_path(patient_id)
+        stamp = self._stamp(path)
+        cached = self._meta.get(patient_id)
+        if cached is not None and stamp is not None and cached[1] == stamp:
+            return cached[0]
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {'segments': []}
+        self._meta[patient_id] = (meta, stamp)
+        return meta
+
+    def _save_meta(self, patient_id, meta):
+        path = self._meta_path(patient_id)
+        os.makedirs(self._patient_dir(patient_id), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+        self._meta[patient_id] = (meta, self._stamp(path))
+
+    def _new_segment(self, patient_id, meta):
+        os.makedirs(self._patient_dir(patient_id), exist_ok=True)
+        segment = {'name': f"seg-{len(meta['segments']):06d}.f64", 'count': 0, 'min_ts': None, 'max_ts': None, 'sorted': True}
+        path = os.path.join(self._patient_dir(patient_id), segment['name'])
+        np.memmap(path, dtype=np.float64, mode='w+', shape=(len(COLUMNS), self.segment_capacity)).flush()
+        meta['segments'].append(segment)
+        return segment
+
+    def _seal(self, patient_id, segment):
+        """A full segment is sorted once so later range queries can binary-search it."""
+        if segment['sorted']:
+            return
+        data = self._map(patient_id, segment['name'])
+        order = np.argsort(data[0, :segment['count']], kind='stable')
+        data[:, :segment['count']] = data[:, :segment['count']][:, order]
+        data.flush()
+        segment['sorted'] = True
+
+    def _map(self, patient_id, name):
+        key = (patient_id, name)
+        with self._maps_lock:
+            data = self._maps.get(key)
+            if data is not None:
+                self._maps.move_to_end(key)
+                return data
+            path = os.path.join(self._patient_dir(patient_id), name)
+            data = np.memmap(path, dtype=np.float64, mode='r+', shape=(len(COLUMNS), self.segment_capacity))
+            self._maps[key] = data
+            # Evicted maps are closed once the last array view over them is released
+            while len(self._maps) > self.max_open_segments:
+                self._maps.popitem(last=False)
+            return data
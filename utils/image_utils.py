@@ -0,0 +1,66 @@
+import io
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# cv2 can let libjpeg/libpng skip most of the work for a downscaled decode
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def read_image_size(image_bytes):
+    """Return (width, height) from the image header without decoding pixels, or None."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def decode_image_bytes(image_bytes, working_size=None):
+    """Decode an encoded image buffer (JPEG/PNG/...) into a BGR numpy array.
+
+    If working_size is given, the image is downscaled so its shorter side is
+    no smaller than working_size. Where possible this happens during decoding
+    (DCT scaling), so a full-resolution bitmap is never materialised.
+    Returns None if the buffer is not a decodable image.
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+
+    flag = cv2.IMREAD_COLOR
+    if working_size:
+        size = read_image_size(image_bytes)
+        if size:
+            shorter_side = min(size)
+            for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+                if shorter_side // factor >= working_size:
+                    flag = reduced_flag
+                    break
+
+    image = cv2.imdecode(buffer, flag)
+    if image is None:
+        return None
+
+    if working_size:
+        image = downscale_image(image, working_size)
+    return image
+
+
+def downscale_image(image, working_size):
+    """Shrink image so its shorter side equals working_size. Never upscales."""
+    height, width = image.shape[:2]
+    shorter_side = min(height, width)
+    if shorter_side <= working_size:
+        return image
+    scale = working_size / shorter_side
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
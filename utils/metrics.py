@@ -0,0 +1,44 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyMetrics:
+    """Rolling latency samples per metric name, summarized as mean and percentiles (milliseconds)."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, value_ms):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(value_ms)
+
+    def summary(self, name):
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        return self._summarize(samples)
+
+    def snapshot(self):
+        with self._lock:
+            names = list(self._samples)
+        return {name: self.summary(name) for name in names}
+
+    @staticmethod
+    def _summarize(samples):
+        if not samples:
+            return {'count': 0}
+        values = np.asarray(samples)
+        return {
+            'count': int(values.size),
+            'mean': round(float(values.mean()), 3),
+            'p50': round(float(np.percentile(values, 50)), 3),
+            'p95': round(float(np.percentile(values, 95)), 3),
+            'p99': round(float(np.percentile(values, 99)), 3),
+            'max': round(float(values.max()), 3),
+        }
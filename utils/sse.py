@@ -0,0 +1,27 @@
+import json
+
+# Headers for text/event-stream responses; X-Accel-Buffering stops nginx from holding events back
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+
+def format_sse(data, event=None, event_id=None, retry=None):
+    """Serialize one Server-Sent Event. data is JSON-encoded unless it is already a string."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    if retry is not None:
+        lines.append(f"retry: {int(retry)}")
+    payload = data if isinstance(data, str) else json.dumps(data)
+    for line in payload.splitlines() or ['']:
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_sse_comment(comment=''):
+    """An SSE comment line, used as a heartbeat that clients ignore."""
+    return f": {comment}\n\n"